@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Benchmarks of the protocol loading and the query throughput of bob.db.ijbc.
+
+The benchmarks follow the conventions of airspeed velocity (``asv run``): ``time_*`` methods are timed, ``peakmem_*`` methods record the peak resident memory, and ``track_*`` methods record the returned value.
+They run on synthetic protocol files (see :py:func:`bob.db.ijbc.synthetic.write_protocol`), whose size is given as a fraction of IJB-C by the ``IJBC_BENCHMARK_SCALE`` environment variable (default: ``0.05``).
+
+Without asv, the benchmarks can be run with ``python benchmarks/benchmarks.py [--scale 0.05] [--filter read]``, which runs each benchmark in a separate process and reports its best time and its peak resident memory.
+"""
+
+import os
+import sys
+import shutil
+
+import bob.db.ijbc
+from bob.db.ijbc.reader import Protocol
+from bob.db.ijbc.synthetic import write_protocol
+
+scale = float(os.environ.get("IJBC_BENCHMARK_SCALE", "0.05"))
+
+template_lists = ("G1", "G2", "Mixed", "Image", "Video", "Covariates")
+match_protocols = ("1:1", "Covariates")
+query_protocols = ("1:1", "Covariates", "1:N-Mixed")
+
+
+def _protocol_directories(directory="ijbc-benchmark"):
+    """Writes the synthetic protocol files twice: as plain CSV files, and with a compiled protocol cache"""
+    directories = {}
+    for source in ("csv", "cache"):
+        directories[source] = os.path.abspath(os.path.join(directory, source))
+        if os.path.exists(directories[source]):
+            shutil.rmtree(directories[source])
+        write_protocol(directories[source], scale)
+    Protocol(directories["cache"]).compile()
+    return directories
+
+
+class _Benchmark:
+    """The base class of all benchmarks, which share the synthetic protocol files.
+
+    asv identifies the cached result of ``setup_cache`` by the location of its definition, so that the protocol files are generated once for all derived classes.
+    """
+
+    timeout = 600
+
+    def setup_cache(self):
+        return _protocol_directories()
+
+
+class ReadProtocol(_Benchmark):
+    """Parses the protocol files, either from the CSV files or from the memory-mapped protocol cache"""
+
+    params = ["csv", "cache"]
+    param_names = ["source"]
+
+    def setup(self, directories, source):
+        self.directory = directories[source]
+
+    def time_read_metadata(self, directories, source):
+        Protocol(self.directory)._read_metadata()
+
+    def time_read_annotations(self, directories, source):
+        Protocol(self.directory)._read_metadata().has_annotation
+
+    def time_read_template_lists(self, directories, source):
+        protocol = Protocol(self.directory)
+        for which in template_lists:
+            protocol._read_template_list(which).file_rows
+
+    def time_read_match_files(self, directories, source):
+        protocol = Protocol(self.directory)
+        for which in match_protocols:
+            protocol._read_match_file(which)
+
+    def peakmem_read_all(self, directories, source):
+        protocol = Protocol(self.directory)
+        protocol._read_metadata().has_annotation
+        for which in template_lists:
+            protocol._read_template_list(which).file_rows
+        for which in match_protocols:
+            protocol._read_match_file(which)
+
+
+class ReadTemplateList(_Benchmark):
+    """Parses each template list from its CSV file"""
+
+    params = list(template_lists)
+    param_names = ["list"]
+
+    def setup(self, directories, which):
+        self.protocol = Protocol(directories["csv"])
+        self.protocol._read_metadata()
+
+    def time_read_template_list(self, directories, which):
+        self.protocol._read_template_list(which).file_rows
+        self.protocol._templates.clear()
+
+
+class ReadMatchFile(_Benchmark):
+    """Parses each match file from its CSV file"""
+
+    params = list(match_protocols)
+    param_names = ["protocol"]
+
+    def setup(self, directories, which):
+        self.protocol = Protocol(directories["csv"])
+
+    def time_read_match_file(self, directories, which):
+        self.protocol._read_match_file(which)
+        self.protocol._matches.clear()
+
+
+class Queries(_Benchmark):
+    """Queries of the database interface on the compiled protocol cache"""
+
+    params = list(query_protocols)
+    param_names = ["protocol"]
+
+    def setup(self, directories, protocol):
+        self.db = bob.db.ijbc.Database(protocol_directory=directories["cache"])
+        self.model_ids = self.db.model_ids(protocol=protocol)
+
+    def time_model_ids(self, directories, protocol):
+        bob.db.ijbc.Database(protocol_directory=self.db.protocol.base_directory).model_ids(protocol=protocol)
+
+    def time_enroll_templates(self, directories, protocol):
+        # the first lookup builds the combined gallery of the 1:1 and 1:N protocols, which all later lookups reuse
+        for model_id in self.model_ids:
+            self.db.protocol.enroll_template(protocol, model_id)
+
+    def time_objects_per_model(self, directories, protocol):
+        for model_id in self.model_ids:
+            self.db.objects(protocol=protocol, model_ids=model_id, purposes="probe")
+
+    def peakmem_objects_per_model(self, directories, protocol):
+        for model_id in self.model_ids:
+            self.db.objects(protocol=protocol, model_ids=model_id, purposes="probe")
+
+
+class ObjectSets(_Benchmark):
+    """Queries of the probe templates of each model; the ``Covariates`` protocol does not provide templates"""
+
+    params = [p for p in query_protocols if p != "Covariates"]
+    param_names = ["protocol"]
+
+    def setup(self, directories, protocol):
+        self.db = bob.db.ijbc.Database(protocol_directory=directories["cache"])
+        self.model_ids = self.db.model_ids(protocol=protocol)
+
+    def time_object_sets_per_model(self, directories, protocol):
+        for model_id in self.model_ids:
+            self.db.object_sets(protocol=protocol, model_ids=model_id)
+
+
+class Pairs(_Benchmark):
+    """Iteration over all comparisons of the protocols that define a match list"""
+
+    params = list(match_protocols)
+    param_names = ["protocol"]
+
+    def setup(self, directories, protocol):
+        self.db = bob.db.ijbc.Database(protocol_directory=directories["cache"])
+
+    def time_iter_pairs(self, directories, protocol):
+        for models, probes in self.db.iter_pairs(protocol):
+            pass
+
+    def peakmem_iter_pairs(self, directories, protocol):
+        for models, probes in self.db.iter_pairs(protocol):
+            pass
+
+    def track_comparisons(self, directories, protocol):
+        return sum(len(models) for models, _ in self.db.iter_pairs(protocol))
+
+    track_comparisons.unit = "comparisons"
+
+
+def _benchmarks(pattern=None):
+    """Yields the class, the method name and the parameter of all benchmarks whose name contains the given pattern"""
+    for cls in (ReadProtocol, ReadTemplateList, ReadMatchFile, Queries, ObjectSets, Pairs):
+        for name in sorted(dir(cls)):
+            if name.split("_")[0] not in ("time", "peakmem", "track"):
+                continue
+            for param in cls.params:
+                if pattern is None or pattern in "%s.%s(%s)" % (cls.__name__, name, param):
+                    yield cls, name, param
+
+
+def _run(cls_name, name, param, directories, repeat, queue):
+    """Runs a single benchmark, and reports its best time, its value and the peak resident memory of the process"""
+    import timeit
+    import resource
+    cls = globals()[cls_name]
+    benchmark = cls()
+    benchmark.setup(directories, param)
+    method = getattr(benchmark, name)
+    value = None
+    if name.startswith("track"):
+        value = method(directories, param)
+    elif name.startswith("time"):
+        value = min(timeit.repeat(lambda: method(directories, param), number=1, repeat=repeat))
+    else:
+        method(directories, param)
+    # ru_maxrss is given in kilobytes on Linux
+    queue.put((value, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.))
+
+
+def main(command_line_parameters=None):
+    """Runs the benchmarks without asv"""
+    import argparse
+    import tempfile
+    import multiprocessing
+    from six.moves.queue import Empty
+
+    global scale
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("-s", "--scale", type=float, default=scale, help="The size of the synthetic protocols as a fraction of IJB-C")
+    parser.add_argument("-f", "--filter", help="Only run the benchmarks whose name contains this string")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="The number of repetitions of each timed benchmark")
+    args = parser.parse_args(command_line_parameters)
+
+    scale = args.scale
+    os.environ["IJBC_BENCHMARK_SCALE"] = str(scale)
+    temp_dir = tempfile.mkdtemp(prefix="bob.db.ijbc_benchmark_")
+    # each benchmark runs in a fresh process, so that the peak memory of one benchmark does not include the others;
+    # as the peak memory is inherited by new processes, the protocol files are generated in a separate process, too
+    context = multiprocessing.get_context("spawn") if hasattr(multiprocessing, "get_context") else multiprocessing
+    try:
+        pool = context.Pool(1)
+        directories = pool.apply(_protocol_directories, (os.path.join(temp_dir, "protocol"),))
+        pool.close()
+        pool.join()
+        print("Synthetic IJB-C protocols at scale %g in %s" % (scale, temp_dir))
+        for cls, name, param in _benchmarks(args.filter):
+            queue = context.Queue()
+            process = context.Process(target=_run, args=(cls.__name__, name, param, directories, args.repeat, queue))
+            process.start()
+            # a benchmark that raises an exception terminates its process without a result
+            result = None
+            while result is None and (process.is_alive() or not queue.empty()):
+                try:
+                    result = queue.get(timeout=1)
+                except Empty:
+                    pass
+            process.join()
+            label = "%s.%s(%s)" % (cls.__name__, name, param)
+            if result is None:
+                print("%-50s %14s" % (label, "failed"))
+                continue
+            value, memory = result
+            if name.startswith("time"):
+                result = "%10.4f s" % value
+            elif name.startswith("track"):
+                result = "%12d" % value
+            else:
+                result = ""
+            print("%-50s %14s  peak RSS %8.1f MB" % (label, result, memory))
+            sys.stdout.flush()
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,7 +5,7 @@
 """
 
 from .query import Database
-from .reader import File, Annotation, Template, Protocol
+from .reader import File, Annotation, Template, Protocol, Shard, Metadata
 
 
 def get_config():
@@ -32,7 +32,9 @@ __appropriate__(
     Database,
     File,
     Template,
-    Protocol
+    Protocol,
+    Shard,
+    Metadata
 )
 
 __all__ = [_ for _ in dir() if not _.startswith('_')]
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""
+Persistent binary cache of the parsed protocol files
+"""
+
+import os
+import json
+import fcntl
+import hashlib
+import logging
+import contextlib
+
+import numpy
+
+logger = logging.getLogger("bob.db.ijbc")
+
+# increase this number whenever the layout of the cached arrays changes
+CACHE_VERSION = 2
+
+
+def checksum(filename, block_size=1 << 20):
+    """Returns the SHA-1 checksum of the given file as a hexadecimal string"""
+    sha1 = hashlib.sha1()
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+class ProtocolCache:
+    """Stores the arrays of parsed protocol files as ``.npy`` files in the given directory.
+
+    Each entry of the cache is created from one or more source files.
+    The ``index.json`` file inside the cache directory contains the version of the cache, and the size, modification time and SHA-1 checksum of the source files of each entry.
+    It is updated under a lock of the ``index.json.lock`` file, so that several processes can store entries into the same cache concurrently.
+    An entry is only returned by :py:meth:`load` if the checksums of its source files are unchanged.
+    The checksum is only recomputed when size or modification time of a source file differ from the recorded ones; when the checksum is unchanged, the new modification time is recorded in the index.
+
+    By default, the arrays are memory-mapped read-only, so that all processes on a host share the same pages through the page cache of the operating system.
+    """
+
+    def __init__(self, directory, mmap_mode="r"):
+        self.directory = directory
+        self.mmap_mode = mmap_mode
+        self._index = None
+
+    def _index_file(self):
+        return os.path.join(self.directory, "index.json")
+
+    def _array_file(self, name, array):
+        return os.path.join(self.directory, "%s.%s.npy" % (name, array))
+
+    def _read_index(self):
+        index = {"version": CACHE_VERSION, "entries": {}}
+        if os.path.exists(self._index_file()):
+            with open(self._index_file()) as f:
+                stored = json.load(f)
+            if stored.get("version") == CACHE_VERSION:
+                index = stored
+            else:
+                logger.warning("Ignoring protocol cache in '%s' with version %s, expected version %d", self.directory, stored.get("version"), CACHE_VERSION)
+        return index
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """Holds an exclusive lock of the index, so that processes that update different entries concurrently do not lose each other's entries"""
+        with open(self._index_file() + ".lock", "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def index(self):
+        """Returns the index of the cache, which is empty if the cache does not exist or has a different version"""
+        if self._index is None:
+            self._index = self._read_index()
+        return self._index
+
+    def is_current(self, name, sources):
+        """Checks if the cache entry with the given name exists and has been created from the given source files"""
+        entry = self.index()["entries"].get(name)
+        if entry is None or sorted(entry["sources"]) != sorted(os.path.basename(s) for s in sources):
+            return False
+        for source in sources:
+            if not os.path.exists(source):
+                return False
+            info = entry["sources"][os.path.basename(source)]
+            stat = os.stat(source)
+            if stat.st_size != info["size"]:
+                return False
+            if stat.st_mtime != info["mtime"]:
+                if checksum(source) != info["sha1"]:
+                    return False
+                # the content is unchanged, e.g., after a new checkout; record the new modification time to avoid checking it again
+                self._update_mtime(os.path.basename(source), info, stat.st_mtime)
+        return True
+
+    def _update_mtime(self, source, info, mtime):
+        """Stores the new modification time of the given unchanged source file in all entries that were created from it"""
+        def update(index):
+            for entry in index["entries"].values():
+                stored = entry["sources"].get(source)
+                if stored is not None and stored["size"] == info["size"] and stored["sha1"] == info["sha1"]:
+                    stored["mtime"] = mtime
+        update(self.index())
+        try:
+            self._update_index(update)
+        except (IOError, OSError) as e:
+            # the cache might be read-only; the new modification time is still used by this process
+            logger.debug("Could not update the index of the protocol cache '%s': %s", self.directory, e)
+
+    def _update_index(self, update):
+        """Applies the function ``update`` to the index stored on disk, and writes the index atomically while holding the lock"""
+        with self._locked():
+            # merge with the entries that other processes have stored since the index was read
+            index = self._read_index()
+            update(index)
+            # write the index atomically, so that concurrent readers never see a partial file
+            temp_file = self._index_file() + ".%d" % os.getpid()
+            with open(temp_file, "w") as f:
+                json.dump(index, f, indent=2, sort_keys=True)
+            os.rename(temp_file, self._index_file())
+        self._index = index
+
+    def load(self, name, sources):
+        """Returns the dictionary of arrays of the given entry, or ``None`` if the entry does not exist or is stale"""
+        if name not in self.index()["entries"]:
+            return None
+        if not self.is_current(name, sources):
+            logger.warning("The protocol cache entry '%s' is outdated; reading the protocol files instead. Please run 'bob_dbmanage.py ijbc create'", name)
+            return None
+        logger.debug("Loading '%s' from protocol cache '%s'", name, self.directory)
+        return {array: numpy.load(self._array_file(name, array), mmap_mode=self.mmap_mode, allow_pickle=False) for array in self.index()["entries"][name]["arrays"]}
+
+    def save(self, name, sources, arrays):
+        """Stores the given dictionary of arrays as entry with the given name, created from the given source files"""
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        for array, data in arrays.items():
+            # replace the file instead of overwriting it, as other processes might have it memory-mapped
+            temp_file = self._array_file(name, array) + ".%d" % os.getpid()
+            with open(temp_file, "wb") as f:
+                numpy.save(f, data, allow_pickle=False)
+            os.rename(temp_file, self._array_file(name, array))
+
+        entry = {
+            "arrays": sorted(arrays),
+            "sources": {
+                os.path.basename(source): {
+                    "size": os.stat(source).st_size,
+                    "mtime": os.stat(source).st_mtime,
+                    "sha1": checksum(source)
+                } for source in sources
+            }
+        }
+        self._update_index(lambda index: index["entries"].__setitem__(name, entry))
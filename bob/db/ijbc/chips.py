@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""On-disk store of pre-cropped face chips of IJB-C files
+"""
+
+import os
+import json
+import logging
+
+import numpy
+
+from .loader import FaceLoader
+
+logger = logging.getLogger("bob.db.ijbc")
+
+
+def resize(image, shape):
+    """Resizes the given gray (H x W) or color (3 x H x W) image to the given ``shape`` ``(height, width)`` using nearest-neighbor interpolation"""
+    height, width = image.shape[-2:]
+    if not height or not width:
+        return numpy.zeros(image.shape[:-2] + tuple(shape), image.dtype)
+    rows = (numpy.arange(shape[0]) * height // shape[0])
+    columns = (numpy.arange(shape[1]) * width // shape[1])
+    return image[..., rows[:, None], columns]
+
+
+def convert(image, color):
+    """Converts the given image to color (3 x H x W) or gray (H x W)"""
+    if color and image.ndim == 2:
+        return numpy.repeat(image[None], 3, axis=0)
+    if not color and image.ndim == 3:
+        return numpy.round(numpy.tensordot((0.299, 0.587, 0.114), image, axes=1)).astype(image.dtype)
+    return image
+
+
+class ChipStore:
+    """Stores face chips of a fixed size for a set of :py:class:`bob.db.ijbc.File` objects in a flat, memory-mapped array.
+
+    The chips are cropped with the given ``margin`` around the bounding box (see :py:func:`bob.db.ijbc.loader.bounding_box`) and resized to ``shape``.
+    The chips of each set of crop parameters are stored under a different name inside ``directory``:
+
+    * ``<name>.chips.npy``: the ``uint8`` chips of all files, in the order in which they were added
+    * ``<name>.ids.npy``: the sorted :py:attr:`bob.db.ijbc.File.id`'s
+    * ``<name>.index.npy``: the position of the chip of each sorted id
+    * ``<name>.json``: the crop parameters
+
+    Reading the chips of many files is fastest when they are read in the order in which they have been stored, see :py:meth:`blocks`.
+
+    **Parameters:**
+
+    directory : str
+      The directory where the chips are stored
+
+    shape : (int, int)
+      The ``(height, width)`` of the chips
+
+    margin : float
+      The factor of the bounding box size that is added on each side before cropping
+
+    color : bool
+      Whether to store color (3 x H x W) or gray (H x W) chips
+    """
+
+    def __init__(self, directory, shape=(112, 112), margin=0., color=True):
+        self.directory = directory
+        self.shape = tuple(int(s) for s in shape)
+        self.margin = float(margin)
+        self.color = bool(color)
+        self.name = "chips-%dx%d-%s-m%g" % (self.shape[0], self.shape[1], "color" if self.color else "gray", self.margin)
+        self._chips = self._ids = self._index = None
+
+    def _file(self, kind):
+        return os.path.join(self.directory, "%s.%s" % (self.name, kind))
+
+    @property
+    def path(self):
+        """The file name of the array of all chips of this store"""
+        return self._file("chips.npy")
+
+    def exists(self):
+        """Checks if the chips have been stored for the crop parameters of this store"""
+        return os.path.exists(self._file("json"))
+
+    def _load(self):
+        if self._chips is None:
+            if not self.exists():
+                raise IOError("The chips '%s' have not been created in '%s'" % (self.name, self.directory))
+            self._chips = numpy.load(self.path, mmap_mode="r")
+            self._ids = numpy.load(self._file("ids.npy"))
+            self._index = numpy.load(self._file("index.npy"))
+
+    def __len__(self):
+        self._load()
+        return len(self._ids)
+
+    def __contains__(self, file):
+        self._load()
+        file_id = getattr(file, "id", file)
+        position = numpy.searchsorted(self._ids, file_id)
+        return position < len(self._ids) and self._ids[position] == file_id
+
+    def positions(self, files):
+        """Returns the positions of the chips of the given files or file ids; raises a :py:class:`KeyError` if a file is not stored"""
+        self._load()
+        file_ids = numpy.array([getattr(f, "id", f) for f in files], dtype=self._ids.dtype)
+        positions = numpy.searchsorted(self._ids, file_ids)
+        found = positions < len(self._ids)
+        found[found] = self._ids[positions[found]] == file_ids[found]
+        if not numpy.all(found):
+            raise KeyError("The chips of the files %s are not stored" % file_ids[~found][:10].tolist())
+        return self._index[positions]
+
+    def chips(self, files):
+        """Returns the chips of the given files or file ids as a ``uint8`` array of shape ``(N, [3,] H, W)``"""
+        positions = self.positions(files)
+        # read the chips in storage order, and reorder them afterward
+        order = numpy.argsort(positions, kind="mergesort")
+        chips = numpy.empty((len(positions),) + self._chips.shape[1:], self._chips.dtype)
+        chips[order] = self._chips[positions[order]]
+        return chips
+
+    def blocks(self, block_size=1024):
+        """Yields the ids and the chips of all stored files in contiguous blocks, in storage order"""
+        self._load()
+        ids = numpy.empty(len(self._ids), self._ids.dtype)
+        ids[self._index] = self._ids
+        for start in range(0, len(ids), block_size):
+            yield ids[start:start + block_size], numpy.asarray(self._chips[start:start + block_size])
+
+    def create(self, files, original_directory, **kwargs):
+        """Crops the chips of the given files from the original images and stores them.
+
+        The images are loaded in parallel with a :py:class:`bob.db.ijbc.loader.FaceLoader`, to which all ``kwargs`` are passed.
+        The chips are stored in the given order of the files; duplicate files are stored once.
+        Existing chips with the same crop parameters are replaced.
+
+        **Parameters:**
+
+        files : [:py:class:`bob.db.ijbc.File`]
+          The files to crop
+
+        original_directory : str
+          The directory containing the original images and frames
+
+        **Returns:**
+
+        count : int
+          The number of stored chips
+        """
+        seen = set()
+        files = [f for f in files if not (f.id in seen or seen.add(f.id))]
+
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        # write all files under temporary names, and replace the old ones at the end
+        suffix = ".%d" % os.getpid()
+        shape = (len(files),) + ((3,) if self.color else ()) + self.shape
+        chips = numpy.lib.format.open_memmap(self.path + suffix, mode="w+", dtype=numpy.uint8, shape=shape)
+        loader = FaceLoader(original_directory, margin=self.margin, **kwargs)
+        position = 0
+        for batch, faces in loader.batches(files):
+            for face in faces:
+                chip = resize(convert(face, self.color), self.shape)
+                if chip.dtype != numpy.uint8:
+                    # images of other types are rounded and clipped to the range of uint8, instead of being truncated and wrapped around
+                    chip = numpy.clip(numpy.rint(chip), 0, 255)
+                chips[position] = chip
+                position += 1
+            logger.info("Cropped %d of %d chips", position, len(files))
+        chips.flush()
+        del chips
+
+        ids = numpy.array([f.id for f in files], dtype=str)
+        index = numpy.argsort(ids, kind="mergesort")
+        for kind, array in (("ids.npy", ids[index]), ("index.npy", index)):
+            with open(self._file(kind) + suffix, "wb") as f:
+                numpy.save(f, array, allow_pickle=False)
+        with open(self._file("json") + suffix, "w") as f:
+            json.dump({"shape": self.shape, "margin": self.margin, "color": self.color, "count": len(files)}, f, indent=2)
+        for kind in ("chips.npy", "ids.npy", "index.npy", "json"):
+            os.rename(self._file(kind) + suffix, self._file(kind))
+
+        self._chips = self._ids = self._index = None
+        return len(files)
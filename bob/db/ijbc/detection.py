@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Evaluation of face detectors on the IJB-C face detection protocols
+"""
+
+import numpy
+
+from .reader import _ranges
+
+
+def iou(boxes, other):
+    """Computes the intersection over union of corresponding bounding boxes ``(x, y, width, height)``, given as two N x 4 :py:class:`numpy.ndarray`'s"""
+    left = numpy.maximum(boxes[:, 0], other[:, 0])
+    top = numpy.maximum(boxes[:, 1], other[:, 1])
+    right = numpy.minimum(boxes[:, 0] + boxes[:, 2], other[:, 0] + other[:, 2])
+    bottom = numpy.minimum(boxes[:, 1] + boxes[:, 3], other[:, 1] + other[:, 3])
+    intersection = numpy.maximum(right - left, 0) * numpy.maximum(bottom - top, 0)
+    union = boxes[:, 2] * boxes[:, 3] + other[:, 2] * other[:, 3] - intersection
+    return intersection / numpy.where(union > 0, union, 1)
+
+
+def match(ground_truth_offsets, ground_truth_boxes, detection_offsets, detection_boxes, detection_scores, overlap=0.5):
+    """Matches the detected bounding boxes with the ground-truth bounding boxes of all images at once.
+
+    Both ground truth and detections are given in compressed sparse row format over the same list of images.
+    Each detection is assigned to the ground-truth box of the same image with which it has the largest intersection over union.
+    If this overlap is at least ``overlap``, and no other detection with a higher score is assigned to the same ground-truth box, the detection is a true positive.
+    All pairs of detections and ground-truth boxes of the same image are evaluated with vectorized operations, without looping over images or boxes.
+
+    **Returns:**
+
+    true_positives : :py:class:`numpy.ndarray` (bool)
+      Whether each detection is a true positive
+
+    overlaps : :py:class:`numpy.ndarray` (float)
+      The largest intersection over union of each detection with a ground-truth box of its image, ``0`` if the image contains no face
+    """
+    detection_scores = numpy.asarray(detection_scores, numpy.float64)
+    ground_truth_counts = numpy.diff(ground_truth_offsets)
+    detection_counts = numpy.diff(detection_offsets)
+
+    # all pairs of detections and ground-truth boxes of the same image
+    pairs_per_detection = numpy.repeat(ground_truth_counts, detection_counts)
+    detection_index = numpy.repeat(numpy.arange(len(detection_boxes)), pairs_per_detection)
+    ground_truth_index = _ranges(numpy.repeat(ground_truth_offsets[:-1], detection_counts), numpy.repeat(ground_truth_offsets[1:], detection_counts))
+    overlaps = iou(detection_boxes[detection_index], ground_truth_boxes[ground_truth_index])
+
+    # the best ground-truth box of each detection; pairs are sorted by detection
+    order = numpy.lexsort((overlaps, detection_index))
+    has_pairs = pairs_per_detection > 0
+    last = numpy.cumsum(pairs_per_detection)[has_pairs] - 1
+    best_overlap = numpy.zeros(len(detection_boxes))
+    best_ground_truth = numpy.full(len(detection_boxes), -1, numpy.int64)
+    best_overlap[has_pairs] = overlaps[order[last]]
+    best_ground_truth[has_pairs] = ground_truth_index[order[last]]
+
+    # each ground-truth box is only assigned to the detection with the highest score
+    candidates = numpy.flatnonzero(best_overlap >= overlap)
+    order = numpy.lexsort((-detection_scores[candidates], best_ground_truth[candidates]))
+    candidates = candidates[order]
+    first = numpy.concatenate(([True], best_ground_truth[candidates][1:] != best_ground_truth[candidates][:-1]))
+    true_positives = numpy.zeros(len(detection_boxes), bool)
+    true_positives[candidates[first]] = True
+    return true_positives, best_overlap
+
+
+def evaluate(ground_truth, images, boxes, scores, overlap=0.5):
+    """Evaluates the detections of all images of a detection protocol.
+
+    **Parameters:**
+
+    ground_truth : :py:class:`bob.db.ijbc.reader.DetectionList`
+      The images and ground-truth bounding boxes of the protocol
+
+    images : [str]
+      The image file name of each detection, as given in :py:attr:`bob.db.ijbc.reader.DetectionList.images`
+
+    boxes : :py:class:`numpy.ndarray` (float, N x 4)
+      The detected bounding boxes ``(x, y, width, height)``
+
+    scores : :py:class:`numpy.ndarray` (float)
+      The confidence of each detection
+
+    overlap : float
+      The minimum intersection over union of a true positive detection
+
+    **Returns:**
+
+    thresholds : :py:class:`numpy.ndarray` (float)
+      The detection scores in descending order
+
+    precision, recall : :py:class:`numpy.ndarray` (float)
+      The precision and the recall (true positive rate) when accepting all detections with at least the according threshold
+
+    false_positives : :py:class:`numpy.ndarray` (int)
+      The number of false positive detections at the according threshold; together with ``recall``, this is the discrete ROC of the detector
+    """
+    images = numpy.asarray(images)
+    boxes = numpy.asarray(boxes, numpy.float64).reshape(-1, 4)
+    scores = numpy.asarray(scores, numpy.float64)
+    if not len(images) == len(boxes) == len(scores):
+        raise ValueError("The number of images %d, boxes %d and scores %d of the detections differ" % (len(images), len(boxes), len(scores)))
+
+    # group the detections by image of the ground truth
+    index = numpy.minimum(numpy.searchsorted(ground_truth.images, images), max(len(ground_truth.images) - 1, 0))
+    unknown = ground_truth.images[index] != images if len(ground_truth.images) else numpy.ones(len(images), bool)
+    if numpy.any(unknown):
+        raise ValueError("The image '%s' is not part of the detection protocol" % images[unknown][0])
+    order = numpy.argsort(index, kind="mergesort")
+    offsets = numpy.append(0, numpy.cumsum(numpy.bincount(index, minlength=len(ground_truth.images)))).astype(numpy.int64)
+    true_positives, _ = match(ground_truth.offsets, ground_truth.boxes, offsets, boxes[order], scores[order], overlap)
+
+    # accumulate in order of descending score
+    ranking = numpy.argsort(-scores[order], kind="mergesort")
+    cumulative = numpy.cumsum(true_positives[ranking])
+    false_positives = numpy.arange(1, len(ranking) + 1) - cumulative
+    precision = cumulative / numpy.arange(1, len(ranking) + 1, dtype=numpy.float64)
+    recall = cumulative / float(max(len(ground_truth.boxes), 1))
+    return scores[order][ranking], precision, recall, false_positives
@@ -6,6 +6,7 @@
 
 import os
 import sys
+import numpy
 import pkg_resources
 
 from bob.db.base.driver import Interface as BaseInterface
@@ -15,28 +16,30 @@ def checkfiles(args):
     """Checks existence of files based on your criteria"""
 
     from .query import Database
+    from .reader import DirectoryIndex
+    import json
 
-    protocols = ['search_split%d' % s for s in range(1, 11)]
-    protocols.extend(['compare_split%d' % s for s in range(1, 11)])
+    db = Database(protocol_directory=args.protocol_directory)
+    protocols = args.protocols or db.protocol_names()
 
-    for p in protocols:
-
-        db = Database()
-        r = db.objects(protocol=p)
-        good = {}
-        bad = {}
-        # go through all files, check if they are available on the filesystem
-        for f in r:
-
-            found = False
-            for e in args.extension:
+    if args.extension:
+        # the unique file names of all files of all protocols, with each of the given extensions
+        files = set()
+        for protocol in protocols:
+            files.update(db.objects(protocol=protocol))
+        files = sorted(files)
+        candidates = [[f.make_path(args.directory, e) for e in args.extension] for f in files]
+        file_ids = lambda index: [files[index].id]
+    else:
+        # the original files, where the files of several subjects that share the same image are checked once
+        paths = db.unique_paths(protocol=protocols)
+        candidates = [[os.path.join(args.directory or '', p)] for p in paths.paths.tolist()]
+        file_ids = lambda index: [f.id for f in paths.files(index)]
 
-                if os.path.exists(f.make_path(args.directory, e)):
-                    good[f.id] = f.make_path(args.directory, e)
-                    found = True
-                    break
-            if not found:
-                bad[f.id] = f.make_path(args.directory, args.extension[0])
+    # read the contents of all required directories once, instead of checking each file
+    exist = DirectoryIndex(args.parallel).exist([c for names in candidates for c in names])
+    offsets = numpy.cumsum([0] + [len(names) for names in candidates])
+    bad = [(index, names[0]) for index, (names, first, last) in enumerate(zip(candidates, offsets[:-1], offsets[1:])) if not numpy.any(exist[first:last])]
 
     # report
     output = sys.stdout
@@ -44,32 +47,131 @@ def checkfiles(args):
         from bob.db.base.utils import null
         output = null()
 
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump({
+                "directory": args.directory,
+                "protocols": list(protocols),
+                "checked": len(candidates),
+                "missing": [{"ids": file_ids(index), "path": path} for index, path in bad]
+            }, f, indent=2)
+
     if bad:
-        for id, f in bad.items():
-            output.write('Cannot find file "%s"\n' % f)
+        for _, path in bad:
+            output.write('Cannot find file "%s"\n' % path)
         output.write('%d files (out of %d) were not found at "%s"\n' % \
-                     (len(bad), len(r), args.directory))
+                     (len(bad), len(candidates), args.directory))
     else:
         output.write('All files were found !!!')
 
     return 0
 
 
+def create(args):
+    """Parses the protocol files and stores them in a binary cache"""
+
+    from .reader import Protocol
+    import logging
+    if args.verbose:
+        logging.getLogger("bob.db.ijbc").setLevel(logging.INFO if args.verbose == 1 else logging.DEBUG)
+        logging.basicConfig()
+
+    protocol = Protocol(args.protocol_directory)
+    written = protocol.compile(recreate=args.recreate)
+
+    output = sys.stdout
+    if args.selftest:
+        from bob.db.base.utils import null
+        output = null()
+
+    for protocol_file in written:
+        output.write('Compiled "%s"\n' % protocol_file)
+    output.write('%d protocol files were written to the cache at "%s"\n' % (len(written), protocol.cache.directory))
+
+    return 0
+
+
+def chips(args):
+    """Crops the faces of the files of the given protocols and stores them as chips of a fixed size"""
+
+    from .query import Database
+    from .chips import ChipStore
+    import logging
+    if args.verbose:
+        logging.getLogger("bob.db.ijbc").setLevel(logging.INFO if args.verbose == 1 else logging.DEBUG)
+        logging.basicConfig()
+
+    db = Database(original_directory=args.directory, protocol_directory=args.protocol_directory)
+    protocols = args.protocols or db.protocol_names()
+
+    # collect the unique files of all protocols, sorted to read the images directory by directory
+    files = set()
+    for protocol in protocols:
+        files.update(db.objects(protocol=protocol))
+    files = sorted(files, key=lambda f: f.id)
+
+    store = ChipStore(args.output, shape=args.size, margin=args.margin, color=not args.gray)
+    count = store.create(files, args.directory, batch_size=args.batch_size, parallel=args.parallel, processes=args.processes)
+
+    output = sys.stdout
+    if args.selftest:
+        from bob.db.base.utils import null
+        output = null()
+    output.write('%d chips were written to "%s"\n' % (count, store.path))
+
+    return 0
+
+
+def _read_ids(args):
+    """Yields the file ids given on the command line, or read line by line from the input file or stdin"""
+    if args.id:
+        for file_id in args.id:
+            yield file_id
+    else:
+        f = sys.stdin if args.input in (None, '-') else open(args.input)
+        try:
+            for line in f:
+                if line.strip():
+                    yield line.strip()
+        finally:
+            if f is not sys.stdin:
+                f.close()
+
+
 def path(args):
     """Returns a list of fully formed paths or stems given some file id"""
 
     from .query import Database
-    db = Database()
+    import itertools
+    if args.original and args.directory is None:
+        sys.stderr.write('The original file names require the original directory, please specify --directory\n')
+        return 1
+    db = Database(original_directory=args.directory, protocol_directory=args.protocol_directory)
 
     output = sys.stdout
     if args.selftest:
         from bob.db.base.utils import null
         output = null()
 
-    r = db.paths(args.id, prefix=args.directory, suffix=args.extension)
-    for path in r: output.write('%s\n' % path)
+    # process the ids in chunks, writing the results as soon as they are available
+    ids = _read_ids(args)
+    found = total = 0
+    while True:
+        chunk = list(itertools.islice(ids, args.chunk_size))
+        if not chunk:
+            break
+        if args.original:
+            r = db.original_file_names(chunk, check_existence=False, skip_unknown=True)
+        else:
+            r = db.paths(chunk, prefix=args.directory, suffix=args.extension)
+        for path in r: output.write('%s\n' % path)
+        output.flush()
+        found += len(r)
+        total += len(chunk)
 
-    if not r: return 1
+    if total == 1 and not found:
+        sys.stderr.write('The file id could not be found in the database\n')
+    if not found: return 1
 
     return 0
 
@@ -84,14 +186,16 @@ class Interface(BaseInterface):
     def files(self):
         basedir = pkg_resources.resource_filename(__name__, 'protocol')
         # these are the files that are currently used in the protocol;
-        # more files might be added later, e.g., for face detection or clustering
+        # more files might be added later, e.g., for clustering
         filenames = [
             "ijbc_11_G1_G2_matches.csv",
             "ijbc_11_covariate_matches.csv",
             "ijbc_11_covariate_probe_reference.csv",
             "ijbc_1N_gallery_G1.csv",
             "ijbc_1N_gallery_G2.csv",
+            "ijbc_1N_probe_img.csv",
             "ijbc_1N_probe_mixed.csv",
+            "ijbc_1N_probe_video.csv",
             "ijbc_face_detection.csv",
             "ijbc_face_detection_ground_truth.csv",
             "ijbc_metadata.csv",
@@ -113,16 +217,62 @@ class Interface(BaseInterface):
         parser = subparsers.add_parser('checkfiles', help=checkfiles.__doc__)
         parser.add_argument('-d', '--directory', help="if given, this path will be prepended to every entry returned.")
         parser.add_argument('-e', '--extension', nargs="+",
-                            help="if given, this extension will be appended to every entry returned.")
+                            help="if given, the unique file names with these extensions are checked; otherwise the original files are checked.")
+        parser.add_argument('-p', '--protocols', nargs="+",
+                            help="if given, only the files of these protocols are checked; by default, all protocols are checked.")
+        parser.add_argument('-j', '--parallel', type=int, default=16,
+                            help="the number of threads that read the directory contents in parallel.")
+        parser.add_argument('-r', '--report',
+                            help="if given, a JSON report containing the ids and paths of all missing files is written to this file.")
+        parser.add_argument('--protocol-directory',
+                            help="if given, the protocol files are read from this directory instead of the package directory.")
         parser.add_argument('--self-test', dest="selftest", action='store_true', help=argparse.SUPPRESS)
         parser.set_defaults(func=checkfiles)  # action
 
+        # the "create" action
+        parser = subparsers.add_parser('create', help=create.__doc__)
+        parser.add_argument('-R', '--recreate', action='store_true',
+                            help="if set, all cache entries are re-created, even if they are up-to-date.")
+        parser.add_argument('--protocol-directory',
+                            help="if given, the protocol files are read from (and the cache is written to) this directory instead of the package directory.")
+        parser.add_argument('-v', '--verbose', action='count', default=0, help="increase the verbosity of the output.")
+        parser.add_argument('--self-test', dest="selftest", action='store_true', help=argparse.SUPPRESS)
+        parser.set_defaults(func=create)  # action
+
+        # the "chips" action
+        parser = subparsers.add_parser('chips', help=chips.__doc__)
+        parser.add_argument('-d', '--directory', required=True, help="the directory containing the original images and frames.")
+        parser.add_argument('-o', '--output', required=True, help="the directory where the chips are written to.")
+        parser.add_argument('-p', '--protocols', nargs="+",
+                            help="if given, only the files of these protocols are cropped; by default, all protocols are used.")
+        parser.add_argument('-s', '--size', nargs=2, type=int, default=(112, 112), metavar=('HEIGHT', 'WIDTH'),
+                            help="the size of the chips.")
+        parser.add_argument('-m', '--margin', type=float, default=0.,
+                            help="the factor of the bounding box size that is added on each side of the bounding box.")
+        parser.add_argument('-g', '--gray', action='store_true', help="if given, gray instead of color chips are stored.")
+        parser.add_argument('-b', '--batch-size', type=int, default=64, help="the number of images that are loaded together.")
+        parser.add_argument('-j', '--parallel', type=int, default=8, help="the number of threads (or processes) that load the images.")
+        parser.add_argument('-P', '--processes', action='store_true', help="if given, the images are loaded with processes instead of threads.")
+        parser.add_argument('--protocol-directory',
+                            help="if given, the protocol files are read from this directory instead of the package directory.")
+        parser.add_argument('-v', '--verbose', action='count', default=0, help="increase the verbosity of the output.")
+        parser.add_argument('--self-test', dest="selftest", action='store_true', help=argparse.SUPPRESS)
+        parser.set_defaults(func=chips)  # action
+
         # adds the "path" command
         parser = subparsers.add_parser('path', help=path.__doc__)
         parser.add_argument('-d', '--directory', help="if given, this path will be prepended to every entry returned.")
         parser.add_argument('-e', '--extension',
                             help="if given, this extension will be appended to every entry returned.")
-        parser.add_argument('id', type=int, nargs='+',
+        parser.add_argument('-o', '--original', action='store_true',
+                            help="if given, the original file names including their original extension are returned, and --extension is ignored; requires --directory.")
+        parser.add_argument('-i', '--input',
+                            help="if no ids are given, they are read line by line from this file, or from stdin if not given or '-'.")
+        parser.add_argument('-c', '--chunk-size', type=int, default=10000,
+                            help="the number of ids that are processed at once, before writing the results.")
+        parser.add_argument('--protocol-directory',
+                            help="if given, the protocol files are read from this directory instead of the package directory.")
+        parser.add_argument('id', nargs='*',
                             help="one or more file ids to look up. If you provide more than one, files which cannot be found will be omitted from the output. If you provide a single id to lookup, an error message will be printed if the id does not exist in the database. The exit status will be non-zero in such case.")
         parser.add_argument('--self-test', dest="selftest", action='store_true', help=argparse.SUPPRESS)
         parser.set_defaults(func=path)  # action
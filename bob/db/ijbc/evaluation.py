@@ -0,0 +1,278 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Evaluation of the scores of the IJB-C verification protocols
+"""
+
+import numpy
+
+from .reader import Metadata
+
+# the false acceptance rates at which the IJB-C verification protocols are typically reported
+far_values = (1e-6, 1e-5, 1e-4, 1e-3, 1e-2, 1e-1)
+
+
+# the default bins of the covariates: bin edges for continuous covariates, ``None`` for covariates with discrete values
+covariate_bins = {
+    "facial_hair": None,
+    "age": (0, 20, 35, 50, 65, numpy.inf),
+    "indoor": None,
+    "skintone": None,
+    "gender": None,
+    "yaw": (-numpy.inf, -45, -15, 15, 45, numpy.inf),
+    "roll": (-numpy.inf, -30, -10, 10, 30, numpy.inf),
+    "occlusion": (0, 1, 2, 4, 8, 19),
+}
+
+
+def _comparisons(protocol, name, chunk_size):
+    """Yields the model ids, the probe ids and the labels of the comparisons of the given protocol in chunks"""
+    model_ids, model_subjects = protocol.template_subjects(name, "enroll")
+    probe_ids, probe_subjects = protocol.template_subjects(name, "probe")
+    for models, probes in protocol.iter_pairs(name, chunk_size):
+        yield models, probes, model_subjects[numpy.searchsorted(model_ids, models)] == probe_subjects[numpy.searchsorted(probe_ids, probes)]
+
+
+def iter_labels(protocol, name, chunk_size=1000000):
+    """Yields the labels of all comparisons of the given protocol in chunks, in the order of :py:meth:`bob.db.ijbc.Protocol.iter_pairs`.
+
+    A comparison is genuine (``True``) when model and probe template belong to the same subject.
+
+    **Parameters:**
+
+    protocol : :py:class:`bob.db.ijbc.Protocol`
+      The protocol files
+
+    name : str
+      The name of a protocol that defines a list of comparisons, i.e., ``'1:1'`` or ``'Covariates'``
+
+    chunk_size : int
+      The maximum number of labels that are returned at once
+    """
+    for _, _, labels in _comparisons(protocol, name, chunk_size):
+        yield labels
+
+
+def bin_values(values, edges=None):
+    """Assigns the given values to bins.
+
+    **Parameters:**
+
+    values : :py:class:`numpy.ndarray` (float)
+      The values, which might contain ``NaN``'s
+
+    edges : [float] or ``None``
+      The edges of the bins; if ``None``, each unique value is a bin
+
+    **Returns:**
+
+    index : :py:class:`numpy.ndarray` (int)
+      The bin index of each value, ``-1`` for ``NaN`` values and values outside of the bins
+
+    labels : [float] or [(float, float)]
+      The unique value of each bin, or its lower and upper edge
+    """
+    valid = ~numpy.isnan(values)
+    if edges is None:
+        labels = numpy.unique(values[valid])
+        index = numpy.searchsorted(labels, numpy.where(valid, values, 0))
+        return numpy.where(valid, index, -1), labels.tolist()
+    edges = numpy.asarray(edges, numpy.float64)
+    index = numpy.searchsorted(edges, values, side="right") - 1
+    index[~valid | (index >= len(edges) - 1)] = -1
+    return index, list(zip(edges[:-1].tolist(), edges[1:].tolist()))
+
+
+class TopScores:
+    """Keeps the ``count`` largest of all scores that are added in chunks, using memory proportional to ``count``"""
+
+    def __init__(self, count):
+        self.count = max(int(count), 1)
+        self.scores = numpy.zeros(0, numpy.float64)
+        self.total = 0
+
+    def add(self, scores):
+        """Adds the given scores"""
+        self.total += len(scores)
+        self.scores = numpy.concatenate((self.scores, scores))
+        if len(self.scores) > 2 * self.count:
+            self.scores = numpy.partition(self.scores, len(self.scores) - self.count)[-self.count:]
+
+    def sorted(self):
+        """Returns the kept scores in descending order"""
+        return numpy.sort(self.scores)[::-1][:self.count]
+
+
+def tar_at_far(genuine, impostors, impostor_count, far_values=far_values):
+    """Computes the true acceptance rates at the given false acceptance rates.
+
+    The threshold at a false acceptance rate ``far`` is the ``floor(far * impostor_count)``'th largest impostor score, and scores larger than the threshold are accepted.
+    Hence, the actual false acceptance rate does not exceed ``far``.
+
+    **Parameters:**
+
+    genuine : :py:class:`numpy.ndarray` (float)
+      All genuine scores
+
+    impostors : :py:class:`numpy.ndarray` (float)
+      The largest impostor scores in descending order; at least ``floor(max(far_values) * impostor_count) + 1`` are required
+
+    impostor_count : int
+      The total number of impostor scores
+
+    far_values : [float]
+      The false acceptance rates
+
+    **Returns:**
+
+    thresholds, tars, fars : :py:class:`numpy.ndarray` (float)
+      The thresholds, the true acceptance rates and the actual false acceptance rates for each of the ``far_values``
+    """
+    far_values = numpy.asarray(far_values, numpy.float64)
+    if not len(impostors):
+        return numpy.full(len(far_values), -numpy.inf), numpy.ones(len(far_values)), numpy.zeros(len(far_values))
+    positions = numpy.floor(far_values * impostor_count).astype(numpy.int64)
+    if len(impostors) < impostor_count and numpy.any(positions >= len(impostors)):
+        raise ValueError("Not enough impostor scores are given to compute the threshold at FAR %g" % far_values.max())
+    thresholds = impostors[numpy.minimum(positions, len(impostors) - 1)]
+    # the number of scores that are strictly larger than the thresholds
+    ascending = impostors[::-1]
+    fars = (len(impostors) - numpy.searchsorted(ascending, thresholds, side="right")) / float(impostor_count)
+    genuine = numpy.sort(genuine)
+    tars = (len(genuine) - numpy.searchsorted(genuine, thresholds, side="right")) / float(max(len(genuine), 1))
+    return thresholds, tars, fars
+
+
+def evaluate(scores, labels, far_values=far_values):
+    """Computes the true acceptance rates at the given false acceptance rates from scores and labels given in chunks.
+
+    All genuine scores are kept, but only the largest impostor scores that are required for the thresholds, so that the memory stays bounded for large protocols.
+
+    **Parameters:**
+
+    scores : :py:class:`numpy.ndarray` (float)
+      The scores of all comparisons, which can be memory-mapped
+
+    labels : iterable of :py:class:`numpy.ndarray` (bool)
+      The labels of the comparisons in chunks, aligned with ``scores``, see :py:func:`iter_labels`
+
+    far_values : [float]
+      The false acceptance rates
+
+    **Returns:**
+
+    thresholds, tars, fars : :py:class:`numpy.ndarray` (float)
+      See :py:func:`tar_at_far`
+    """
+    # the number of impostors is only known at the end; keep enough for all comparisons
+    top = TopScores(numpy.floor(max(far_values) * len(scores)) + 1)
+    genuine = []
+    start = 0
+    for chunk in labels:
+        values = numpy.asarray(scores[start:start + len(chunk)], numpy.float64)
+        if len(values) != len(chunk):
+            raise ValueError("The number of scores %d is smaller than the number of comparisons" % len(scores))
+        genuine.append(values[chunk])
+        top.add(values[~chunk])
+        start += len(chunk)
+    if start != len(scores):
+        raise ValueError("The number of scores %d differs from the number of comparisons %d" % (len(scores), start))
+    return tar_at_far(numpy.concatenate(genuine) if genuine else numpy.zeros(0), top.sorted(), top.total, far_values)
+
+
+def evaluate_covariates(scores, protocol, name="Covariates", covariates=None, bins=None, purpose="probe", far_values=far_values, chunk_size=1000000):
+    """Computes the true acceptance rates at the given false acceptance rates for the comparisons in each bin of each covariate.
+
+    The covariates of the templates (see :py:meth:`bob.db.ijbc.Protocol.template_covariates`) are binned once.
+    Then, all comparisons are grouped by the bins of all covariates in a single pass over the scores, and the ROC of each bin is computed from the genuine and impostor comparisons of that bin.
+
+    **Parameters:**
+
+    scores : :py:class:`numpy.ndarray` (float)
+      The scores of all comparisons of the protocol in the order of :py:meth:`bob.db.ijbc.Protocol.iter_pairs`, which can be memory-mapped
+
+    protocol : :py:class:`bob.db.ijbc.Protocol`
+      The protocol files
+
+    name : str
+      The name of a protocol that defines a list of comparisons, i.e., ``'Covariates'`` or ``'1:1'``
+
+    covariates : [str] or ``None``
+      The covariates to evaluate, see :py:data:`covariate_bins`; by default, all covariates are evaluated
+
+    bins : {str: [float] or ``None``} or ``None``
+      Bin edges for some covariates that replace the ones in :py:data:`covariate_bins`
+
+    purpose : str
+      Whether the covariates of the ``'probe'`` or of the ``'enroll'`` template define the bin of a comparison
+
+    far_values : [float]
+      The false acceptance rates
+
+    chunk_size : int
+      The number of comparisons that are processed at once
+
+    **Returns:**
+
+    results : {str: {label: (thresholds, tars, fars)}}
+      For each covariate and each of its bins (see :py:func:`bin_values`), the thresholds, true acceptance rates and actual false acceptance rates at the ``far_values``, see :py:func:`tar_at_far`
+    """
+    names = list(covariate_bins) if covariates is None else list(covariates)
+    edges = dict(covariate_bins)
+    edges.update(bins or {})
+    columns = list(Metadata.covariate_names) + ["occlusion"]
+    template_ids, template_covariates = protocol.template_covariates(name, purpose)
+    matches = protocol._read_match_file(name)
+
+    # bin the covariates of the templates, and enumerate the bins of all covariates
+    template_bins, labels, offset = [], [], 0
+    for covariate in names:
+        index, bin_labels = bin_values(template_covariates[:, columns.index(covariate)], edges[covariate])
+        template_bins.append(numpy.where(index >= 0, index + offset, -1))
+        labels.append(bin_labels)
+        offset += len(bin_labels)
+    template_bins = numpy.column_stack(template_bins) if names else numpy.zeros((len(template_ids), 0), numpy.int64)
+    # small integer keys are sorted with a radix sort
+    if offset < numpy.iinfo(numpy.int16).max:
+        template_bins = template_bins.astype(numpy.int16)
+
+    # count the comparisons of each template, to know the number of impostor scores that must be kept for each bin
+    if purpose == "probe":
+        comparisons = numpy.zeros(len(template_ids), numpy.int64)
+        for start in range(0, len(matches.probe_ids), chunk_size):
+            comparisons += numpy.bincount(numpy.searchsorted(template_ids, matches.probe_ids[start:start + chunk_size]), minlength=len(template_ids))
+    else:
+        comparisons = numpy.zeros(len(template_ids), numpy.int64)
+        comparisons[numpy.searchsorted(template_ids, matches.model_ids)] = numpy.diff(matches.offsets)
+    valid = template_bins >= 0
+    bin_counts = numpy.bincount(template_bins[valid], numpy.repeat(comparisons[:, None], template_bins.shape[1], axis=1)[valid], minlength=offset)
+    tops = [TopScores(numpy.floor(max(far_values) * count) + 1) for count in bin_counts]
+    genuine = [[] for _ in range(offset)]
+
+    # group the scores of each chunk by the bins of all covariates
+    start = 0
+    for models, probes, chunk_labels in _comparisons(protocol, name, chunk_size):
+        values = numpy.asarray(scores[start:start + len(chunk_labels)], numpy.float64)
+        if len(values) != len(chunk_labels):
+            raise ValueError("The number of scores %d is smaller than the number of comparisons" % len(scores))
+        start += len(chunk_labels)
+        keys = template_bins[numpy.searchsorted(template_ids, probes if purpose == "probe" else models)].ravel()
+        positions = numpy.repeat(numpy.arange(len(values)), template_bins.shape[1])
+        order = numpy.argsort(keys, kind="mergesort")
+        keys, positions = keys[order], positions[order]
+        boundaries = numpy.searchsorted(keys, numpy.arange(offset + 1, dtype=keys.dtype))
+        for key in numpy.flatnonzero(numpy.diff(boundaries)).tolist():
+            selected = positions[boundaries[key]:boundaries[key + 1]]
+            is_genuine = chunk_labels[selected]
+            genuine[key].append(values[selected[is_genuine]])
+            tops[key].add(values[selected[~is_genuine]])
+    if start != len(scores):
+        raise ValueError("The number of scores %d differs from the number of comparisons %d" % (len(scores), start))
+
+    results, offset = {}, 0
+    for covariate, bin_labels in zip(names, labels):
+        results[covariate] = {}
+        for label in bin_labels:
+            results[covariate][label] = tar_at_far(numpy.concatenate(genuine[offset]) if genuine[offset] else numpy.zeros(0), tops[offset].sorted(), tops[offset].total, far_values)
+            offset += 1
+    return results
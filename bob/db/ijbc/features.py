@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Aggregation of the features of IJB-C files into template features
+"""
+
+import numpy
+
+from .reader import _ranges
+
+
+def segment_means(values, keys):
+    """Computes the mean of the ``values`` over each segment of equal, sorted ``keys``.
+
+    **Parameters:**
+
+    values : :py:class:`numpy.ndarray` (N x D)
+      The values, sorted by ``keys``
+
+    keys : :py:class:`numpy.ndarray` (N)
+      The sorted keys of the values
+
+    **Returns:**
+
+    unique_keys : :py:class:`numpy.ndarray` (M)
+      The unique keys
+
+    means : :py:class:`numpy.ndarray` (M x D)
+      The mean of the values of each unique key
+    """
+    if not len(keys):
+        return keys[:0], numpy.zeros((0,) + values.shape[1:], numpy.result_type(values, numpy.float32))
+    starts = numpy.flatnonzero(numpy.concatenate(([True], keys[1:] != keys[:-1])))
+    counts = numpy.diff(numpy.append(starts, len(keys)))
+
+    # add the k'th element of all segments that are longer than k at once;
+    # this is much faster than numpy.add.reduceat along the first axis, as segments are short
+    order = numpy.argsort(-counts, kind="mergesort")
+    sorted_counts, sorted_starts = counts[order], starts[order]
+    sums = values[starts].astype(numpy.result_type(values, numpy.float32))
+    for k in range(1, sorted_counts[0]):
+        active = numpy.searchsorted(-sorted_counts, -k, side="left")
+        sums[order[:active]] += values[sorted_starts[:active] + k]
+    sums /= counts.reshape((-1,) + (1,) * (values.ndim - 1))
+    return keys[starts], sums
+
+
+def _normalize(values):
+    """Divides the rows of the given matrix by their Euclidean norm, in place"""
+    norms = numpy.sqrt(numpy.einsum("ij,ij->i", values, values))
+    values /= numpy.where(norms > 0, norms, 1)[:, None]
+    return values
+
+
+def aggregate(templates, template_ids, feature_rows, features, media, normalize=False, skip_missing=False):
+    """Computes the features of the given templates from the features of their files.
+
+    The features of the files of each template are grouped by media, and averaged per media first.
+    The template feature is the average of its media features, so that each image and each video contributes the same weight, independent of the number of its frames.
+
+    **Parameters:**
+
+    templates : :py:class:`bob.db.ijbc.reader.TemplateList`
+      The template list containing the templates
+
+    template_ids : :py:class:`numpy.ndarray` (int)
+      The ids of the templates to compute
+
+    feature_rows : :py:class:`numpy.ndarray` (int)
+      The row in ``features`` for each row of the metadata, ``-1`` for files without feature
+
+    features : :py:class:`numpy.ndarray` (N x D)
+      The features of the files
+
+    media : :py:class:`numpy.ndarray` (int)
+      The media index of each row of the metadata, see :py:meth:`bob.db.ijbc.Protocol.media_index`
+
+    normalize : bool
+      If enabled, the media features and the template features are normalized to unit Euclidean length
+
+    skip_missing : bool
+      If enabled, files without feature are ignored, and templates without any feature are set to ``NaN``; otherwise, a :py:class:`ValueError` is raised
+
+    **Returns:**
+
+    template_features : :py:class:`numpy.ndarray` (len(template_ids) x D)
+      The features of the templates, in the order of ``template_ids``
+    """
+    index = numpy.searchsorted(templates.template_ids, template_ids)
+    starts, ends = templates.offsets[index], templates.offsets[index + 1]
+    rows = templates.file_rows[_ranges(starts, ends)]
+    template_index = numpy.repeat(numpy.arange(len(template_ids), dtype=numpy.int64), ends - starts)
+
+    # find the features of the files
+    file_features = feature_rows[rows]
+    valid = file_features >= 0
+    if not numpy.all(valid):
+        if not skip_missing:
+            raise ValueError("No feature was given for the file in row %d of the metadata, which is part of template %d" % (rows[~valid][0], template_ids[template_index[~valid][0]]))
+        rows, template_index, file_features = rows[valid], template_index[valid], file_features[valid]
+
+    # average the features of each media of each template
+    media_count = int(media.max()) + 1 if len(media) else 1
+    keys = template_index * media_count + media[rows]
+    order = numpy.argsort(keys, kind="mergesort")
+    media_keys, media_features = segment_means(features[file_features[order]], keys[order])
+    if normalize:
+        _normalize(media_features)
+
+    # average the media of each template
+    result = numpy.full((len(template_ids),) + features.shape[1:], numpy.nan, media_features.dtype)
+    present, template_features = segment_means(media_features, media_keys // media_count)
+    result[present] = _normalize(template_features) if normalize else template_features
+    return result
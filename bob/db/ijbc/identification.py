@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Search of probe templates in the gallery of the IJB-C identification protocols, and its evaluation
+"""
+
+import numpy
+
+# the false positive identification rates at which the IJB-C identification protocols are typically reported
+fpir_values = (1e-2, 1e-1)
+
+
+def _prepare(features, metric):
+    """Returns the features and their squared norms, normalized for the cosine similarity"""
+    features = numpy.asarray(features)
+    if not numpy.issubdtype(features.dtype, numpy.floating):
+        features = features.astype(numpy.float64)
+    squared_norms = numpy.einsum("ij,ij->i", features, features)
+    if metric == "cosine":
+        norms = numpy.sqrt(squared_norms)
+        return features / numpy.where(norms > 0, norms, 1)[:, None], None
+    elif metric == "euclidean":
+        return features, squared_norms
+    raise ValueError("The metric '%s' is not one of ('cosine', 'euclidean')" % metric)
+
+
+def search(gallery_features, probe_features, gallery_subjects, probe_subjects, k=20, metric="cosine", block_size=1024):
+    """Compares all probes with all gallery templates, and returns the ``k`` best gallery templates of each probe, and the rank of its mate.
+
+    The scores are computed as matrix products of blocks of ``block_size`` probes with the whole gallery, so that the memory stays bounded.
+    The ``k`` best scores of each probe are selected with :py:func:`numpy.argpartition`.
+
+    **Parameters:**
+
+    gallery_features, probe_features : :py:class:`numpy.ndarray` (N x D)
+      The features of the gallery and the probe templates
+
+    gallery_subjects, probe_subjects : :py:class:`numpy.ndarray` (int)
+      The subject ids of the gallery and the probe templates
+
+    k : int
+      The number of best gallery templates to return for each probe
+
+    metric : str
+      ``'cosine'`` for the cosine similarity, or ``'euclidean'`` for the negative Euclidean distance
+
+    block_size : int
+      The number of probes that are compared at once
+
+    **Returns:**
+
+    top_index : :py:class:`numpy.ndarray` (int, P x k)
+      The indexes of the ``k`` best gallery templates of each probe, best first
+
+    top_scores : :py:class:`numpy.ndarray` (float, P x k)
+      The according scores
+
+    mated_scores : :py:class:`numpy.ndarray` (float, P)
+      The best score of each probe with a gallery template of the same subject, ``NaN`` for non-mated probes
+
+    mated_ranks : :py:class:`numpy.ndarray` (int, P)
+      The rank of the mated score, i.e., one plus the number of non-mated gallery templates with a higher score; ``0`` for non-mated probes
+    """
+    gallery, gallery_norms = _prepare(gallery_features, metric)
+    probes, probe_norms = _prepare(probe_features, metric)
+    gallery_subjects, probe_subjects = numpy.asarray(gallery_subjects), numpy.asarray(probe_subjects)
+    k = min(k, len(gallery))
+
+    top_index = numpy.empty((len(probes), k), numpy.int64)
+    top_scores = numpy.empty((len(probes), k), numpy.float32)
+    mated_scores = numpy.full(len(probes), numpy.nan, numpy.float32)
+    mated_ranks = numpy.zeros(len(probes), numpy.int64)
+    for start in range(0, len(probes), block_size):
+        end = min(start + block_size, len(probes))
+        scores = numpy.dot(probes[start:end], gallery.T)
+        if metric == "euclidean":
+            scores = -numpy.sqrt(numpy.maximum(probe_norms[start:end, None] + gallery_norms[None, :] - 2 * scores, 0))
+
+        # the k best scores, sorted
+        if k < len(gallery):
+            index = numpy.argpartition(-scores, k - 1, axis=1)[:, :k]
+        else:
+            index = numpy.tile(numpy.arange(len(gallery)), (end - start, 1))
+        best = numpy.take_along_axis(scores, index, axis=1)
+        order = numpy.argsort(-best, axis=1, kind="mergesort")
+        top_index[start:end] = numpy.take_along_axis(index, order, axis=1)
+        top_scores[start:end] = numpy.take_along_axis(best, order, axis=1)
+
+        # the score and the rank of the mates
+        mates = gallery_subjects[None, :] == probe_subjects[start:end, None]
+        mated = numpy.any(mates, axis=1)
+        best_mate = numpy.where(mates, scores, -numpy.inf).max(axis=1)
+        mated_scores[start:end][mated] = best_mate[mated]
+        mated_ranks[start:end] = numpy.where(mated, 1 + numpy.sum((scores > best_mate[:, None]) & ~mates, axis=1), 0)
+    return top_index, top_scores, mated_scores, mated_ranks
+
+
+def cmc(mated_ranks, ranks=(1, 5, 10, 20)):
+    """Returns the identification rates of the mated probes at the given ranks, i.e., the cumulative match characteristic"""
+    mated_ranks = numpy.asarray(mated_ranks)
+    mated_ranks = numpy.sort(mated_ranks[mated_ranks > 0])
+    return numpy.searchsorted(mated_ranks, ranks, side="right") / float(max(len(mated_ranks), 1))
+
+
+def fnir_at_fpir(top_scores, mated_scores, mated_ranks, fpir_values=fpir_values, rank=1):
+    """Computes the false negative identification rates at the given false positive identification rates of the open-set identification.
+
+    The threshold at a false positive identification rate ``fpir`` is the ``floor(fpir * N)``'th largest of the best scores of the ``N`` non-mated probes, and scores larger than the threshold are accepted.
+    A mated probe is missed when its mated score is not accepted, or its mate is not within the given ``rank``.
+
+    **Parameters:**
+
+    top_scores : :py:class:`numpy.ndarray` (float)
+      The best score of each probe
+
+    mated_scores, mated_ranks : :py:class:`numpy.ndarray`
+      The mated scores and ranks of each probe, see :py:func:`search`
+
+    fpir_values : [float]
+      The false positive identification rates
+
+    rank : int
+      The maximum rank of the mate to be identified
+
+    **Returns:**
+
+    thresholds, fnirs, fpirs : :py:class:`numpy.ndarray` (float)
+      The thresholds, the false negative identification rates and the actual false positive identification rates for each of the ``fpir_values``
+    """
+    top_scores, mated_ranks = numpy.asarray(top_scores), numpy.asarray(mated_ranks)
+    is_mated = mated_ranks > 0
+    non_mated = numpy.sort(top_scores[~is_mated])
+    if not len(non_mated):
+        raise ValueError("The false positive identification rates cannot be computed without non-mated probes")
+    positions = numpy.minimum(numpy.floor(numpy.asarray(fpir_values) * len(non_mated)).astype(numpy.int64), len(non_mated) - 1)
+    thresholds = non_mated[::-1][positions]
+    fpirs = (len(non_mated) - numpy.searchsorted(non_mated, thresholds, side="right")) / float(len(non_mated))
+    # the mates that are identified at the given rank
+    mated = numpy.sort(numpy.where(mated_ranks[is_mated] <= rank, numpy.asarray(mated_scores)[is_mated], -numpy.inf))
+    fnirs = numpy.searchsorted(mated, thresholds, side="right") / float(max(len(mated), 1))
+    return thresholds, fnirs, fpirs
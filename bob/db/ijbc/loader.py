@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Parallel loading of the annotated face regions of IJB-C images and video frames
+"""
+
+import collections
+import multiprocessing.pool
+
+import numpy
+
+
+def _load_image(file_name):
+    """Loads the given image with :py:func:`bob.io.base.load`"""
+    import bob.io.base
+    import bob.io.image
+    return bob.io.base.load(file_name)
+
+
+def _box(annotation):
+    """Returns the bounding box ``(x, y, width, height)`` of the given :py:class:`bob.db.ijbc.Annotation`, or ``NaN``'s if it is ``None``"""
+    if annotation is None:
+        return (numpy.nan,) * 4
+    return (annotation.topleft[1], annotation.topleft[0], annotation.size[1], annotation.size[0])
+
+
+def bounding_box(box, shape, margin=0.):
+    """Returns the region ``(top, bottom, left, right)`` of the given bounding box ``(x, y, width, height)``.
+
+    The bounding box is enlarged by ``margin`` times its size on each side, and clipped to the image ``shape`` ``(height, width)``.
+    If the bounding box contains ``NaN`` values, the whole image is returned.
+    """
+    if numpy.any(numpy.isnan(box)):
+        return 0, shape[0], 0, shape[1]
+    x, y, width, height = box
+    top = int(round(max(y - margin * height, 0)))
+    bottom = int(round(min(y + (1. + margin) * height, shape[0])))
+    left = int(round(max(x - margin * width, 0)))
+    right = int(round(min(x + (1. + margin) * width, shape[1])))
+    return top, max(top, bottom), left, max(left, right)
+
+
+def crop(image, box, margin=0.):
+    """Returns a copy of the region of the given bounding box ``(x, y, width, height)`` of the given gray (H x W) or color (3 x H x W) image, see :py:func:`bounding_box`"""
+    top, bottom, left, right = bounding_box(box, image.shape[-2:], margin)
+    return image[..., top:bottom, left:right].copy()
+
+
+def _load_batch(file_names, boxes, margin, load_function):
+    """Loads and crops the given batch of images; only the face regions are kept in memory"""
+    return [crop(load_function(file_name), box, margin) for file_name, box in zip(file_names, boxes)]
+
+
+class FaceLoader:
+    """Loads and crops the faces of IJB-C files in parallel.
+
+    The faces are loaded in batches of ``batch_size`` files by a pool of ``parallel`` threads (or processes, if ``processes`` is set).
+    At most ``prefetch`` batches are loaded ahead of the batch that is currently processed by the caller.
+    Each image is cropped to the bounding box of its :py:class:`bob.db.ijbc.Annotation` right after loading, so that only the face regions are kept in memory.
+
+    **Parameters:**
+
+    original_directory : str
+      The directory containing the original IJB-C images and video frames
+
+    batch_size : int
+      The number of files that are loaded together
+
+    parallel : int
+      The number of threads or processes that load the batches
+
+    prefetch : int
+      The maximum number of batches that are loaded ahead
+
+    margin : float
+      The bounding boxes are enlarged by this factor of their size on each side, see :py:func:`bounding_box`
+
+    processes : bool
+      Use processes instead of threads to load the images; useful when decoding does not release the GIL
+
+    load_function : callable or ``None``
+      The function to load an image from its file name; by default :py:func:`bob.io.base.load` is used.
+      When using ``processes``, this function must be picklable.
+    """
+
+    def __init__(self, original_directory, batch_size=64, parallel=8, prefetch=4, margin=0., processes=False, load_function=None):
+        self.original_directory = original_directory
+        self.batch_size = batch_size
+        self.parallel = parallel
+        self.prefetch = max(prefetch, 1)
+        self.margin = margin
+        self.processes = processes
+        self.load_function = load_function or _load_image
+
+    def _files(self, objects):
+        """Expands the files of the given :py:class:`bob.db.ijbc.Template`'s"""
+        for obj in objects:
+            if hasattr(obj, "files"):
+                for file in obj.files:
+                    yield file
+            else:
+                yield obj
+
+    def batches(self, objects):
+        """Yields the faces of the given files or templates in batches.
+
+        **Parameters:**
+
+        objects : [:py:class:`bob.db.ijbc.File`] or [:py:class:`bob.db.ijbc.Template`]
+          The files to load; the files of templates are loaded in the order of :py:attr:`bob.db.ijbc.Template.files`
+
+        **Yields:**
+
+        files : [:py:class:`bob.db.ijbc.File`]
+          The files of the current batch
+
+        faces : [:py:class:`numpy.ndarray`]
+          The cropped face regions of the files of the current batch, in the same order
+        """
+        files = list(self._files(objects))
+        pool = multiprocessing.Pool(self.parallel) if self.processes else multiprocessing.pool.ThreadPool(self.parallel)
+        try:
+            pending = collections.deque()
+            for start in range(0, len(files), self.batch_size):
+                batch = files[start:start + self.batch_size]
+                file_names = [f.make_path(self.original_directory, f.extension, add_client_id=False) for f in batch]
+                boxes = numpy.array([_box(f.annotation) for f in batch], numpy.float64)
+                pending.append((batch, pool.apply_async(_load_batch, (file_names, boxes, self.margin, self.load_function))))
+                # bound the number of batches that are loaded ahead
+                if len(pending) > self.prefetch:
+                    batch, result = pending.popleft()
+                    yield batch, result.get()
+            while pending:
+                batch, result = pending.popleft()
+                yield batch, result.get()
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def __call__(self, objects):
+        """Yields the files of the given files or templates together with their cropped face, one by one, see :py:meth:`batches`"""
+        for files, faces in self.batches(objects):
+            for file, face in zip(files, faces):
+                yield file, face
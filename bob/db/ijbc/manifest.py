@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Resumable progress tracking of jobs that process IJB-C files, e.g., feature extraction
+"""
+
+import os
+import json
+import glob
+import socket
+import hashlib
+import logging
+
+import numpy
+import six
+
+logger = logging.getLogger("bob.db.ijbc")
+
+# the metadata rows are stored as little-endian 32 bit integers in the logs
+_row_dtype = numpy.dtype("<i4")
+
+
+def fingerprint(metadata):
+    """Returns a checksum of the rows of the given :py:class:`bob.db.ijbc.reader.Metadata`, which changes when files are added or removed"""
+    return hashlib.sha1(numpy.ascontiguousarray(metadata.keys, numpy.int64).tobytes()).hexdigest()
+
+
+class ManifestWriter:
+    """Appends completed files to the log of a single worker, see :py:meth:`Manifest.writer`.
+
+    The log file is opened in append mode for each call of :py:meth:`add` and closed afterward, so that completed files are on disk as soon as :py:meth:`add` returns.
+    A record that is only partially written, e.g., when the worker is killed, is ignored when reading the log, and it is removed before the next records are appended to the same log.
+    """
+
+    def __init__(self, filename, metadata):
+        self.filename = filename
+        self._metadata = metadata
+
+    def add(self, files):
+        """Marks the given :py:class:`bob.db.ijbc.File`'s or :py:attr:`bob.db.ijbc.File.id`'s as completed"""
+        file_ids = [f if isinstance(f, six.string_types) else f.id for f in files]
+        rows = self._metadata.rows_from_ids(file_ids).astype(_row_dtype)
+        with open(self.filename, "ab") as f:
+            # remove a partially written record, so that the appended records are aligned
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            if size % _row_dtype.itemsize:
+                logger.warning("Removing a partially written record of the manifest log '%s'", self.filename)
+                f.truncate(size - size % _row_dtype.itemsize)
+            f.write(rows.tobytes())
+        return len(rows)
+
+
+class Manifest:
+    """Records which files of the IJB-C metadata have been completed by a job, stored in the given ``directory``.
+
+    The completed files are kept as a bitmap over the rows of the :py:class:`bob.db.ijbc.reader.Metadata`, i.e., a job over 500k files requires about 60 kB.
+    Many workers can record their progress concurrently: each worker appends the metadata rows of its completed files to its own log, see :py:meth:`writer`.
+    The bitmap and all logs are combined by :py:meth:`completed`, so that the remaining files of a protocol are found without checking any output file.
+
+    * ``manifest.json``: the number of metadata rows and their :py:func:`fingerprint`
+    * ``completed.npy``: the bitmap of the completed files, packed with :py:func:`numpy.packbits`
+    * ``log-<worker>.bin``: the metadata rows completed by each worker, as ``int32``
+
+    **Parameters:**
+
+    directory : str
+      The directory of the manifest, which is created if it does not exist
+
+    metadata : :py:class:`bob.db.ijbc.reader.Metadata`
+      The metadata of the files; a :py:exc:`ValueError` is raised if the manifest was created for a different metadata
+    """
+
+    def __init__(self, directory, metadata):
+        self.directory = directory
+        self._metadata = metadata
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        info = {"rows": len(metadata), "fingerprint": fingerprint(metadata)}
+        if os.path.exists(self._file("manifest.json")):
+            with open(self._file("manifest.json")) as f:
+                stored = json.load(f)
+            if stored != info:
+                raise ValueError("The manifest in '%s' was created for a different metadata with %d rows" % (directory, stored.get("rows", -1)))
+        else:
+            self._write_json(info)
+
+    def _file(self, name):
+        return os.path.join(self.directory, name)
+
+    def _write_json(self, info):
+        temp_file = self._file("manifest.json") + ".%d" % os.getpid()
+        with open(temp_file, "w") as f:
+            json.dump(info, f, indent=2, sort_keys=True)
+        os.rename(temp_file, self._file("manifest.json"))
+
+    def _logs(self):
+        return sorted(glob.glob(self._file("log-*.bin")))
+
+    def _read_bitmap(self):
+        """Returns the completed files that are stored in the bitmap"""
+        if not os.path.exists(self._file("completed.npy")):
+            return numpy.zeros(len(self._metadata), bool)
+        return numpy.unpackbits(numpy.load(self._file("completed.npy"), allow_pickle=False))[:len(self._metadata)].astype(bool)
+
+    def _read_log(self, filename):
+        """Returns the metadata rows of the given log, ignoring a partially written last record"""
+        with open(filename, "rb") as f:
+            data = f.read()
+        rows = numpy.frombuffer(data[:len(data) - len(data) % _row_dtype.itemsize], _row_dtype)
+        invalid = (rows < 0) | (rows >= len(self._metadata))
+        if numpy.any(invalid):
+            logger.warning("Ignoring %d invalid entries of the manifest log '%s'", numpy.count_nonzero(invalid), filename)
+            rows = rows[~invalid]
+        return rows
+
+    def writer(self, name=None):
+        """Returns a :py:class:`ManifestWriter` that appends to the log of the given worker ``name``, which defaults to the host name and the process id.
+
+        Each concurrent worker must use a different name."""
+        if name is None:
+            name = "%s-%d" % (socket.gethostname(), os.getpid())
+        return ManifestWriter(self._file("log-%s.bin" % name), self._metadata)
+
+    def add(self, files):
+        """Marks the given :py:class:`bob.db.ijbc.File`'s or :py:attr:`bob.db.ijbc.File.id`'s as completed, using the log of the current process"""
+        return self.writer().add(files)
+
+    def completed(self):
+        """Returns whether each row of the metadata has been completed, as a boolean :py:class:`numpy.ndarray`"""
+        completed = self._read_bitmap()
+        for log in self._logs():
+            completed[self._read_log(log)] = True
+        return completed
+
+    def is_completed(self, files):
+        """Returns whether each of the given :py:class:`bob.db.ijbc.File`'s or :py:attr:`bob.db.ijbc.File.id`'s has been completed"""
+        file_ids = [f if isinstance(f, six.string_types) else f.id for f in files]
+        return self.completed()[self._metadata.rows_from_ids(file_ids)]
+
+    def compact(self):
+        """Merges all logs into the bitmap, and removes them.
+
+        This must only be called when no worker is writing to the manifest, e.g., before a job is restarted.
+        Returns the number of completed files.
+        """
+        logs = self._logs()
+        completed = self.completed()
+        temp_file = self._file("completed.npy") + ".%d" % os.getpid()
+        with open(temp_file, "wb") as f:
+            numpy.save(f, numpy.packbits(completed), allow_pickle=False)
+        os.rename(temp_file, self._file("completed.npy"))
+        for log in logs:
+            os.remove(log)
+        return int(numpy.count_nonzero(completed))
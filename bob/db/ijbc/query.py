@@ -7,7 +7,15 @@
 """
 
 from .reader import *
+from .features import aggregate
+from .scoring import Scorer
+from . import evaluation
+from . import identification
+from . import detection
+from .manifest import Manifest
 import bob.db.base
+import numpy
+import six
 
 
 class Database(bob.db.base.Database):
@@ -19,12 +27,14 @@ class Database(bob.db.base.Database):
 
     def __init__(self,
                  original_directory=None,
-                 check_valid=True
+                 check_valid=True,
+                 protocol_directory=None
                  ):
         # call base class constructor
         super(Database, self).__init__(original_directory=original_directory, original_extension=None)
 
-        self.protocol = Protocol()
+        self.protocol = Protocol(protocol_directory)
+        self._directory_index = DirectoryIndex()
 
     def provides_file_set_for_protocol(self, protocol):
         """Returns ``True`` for 1:1 and 1:N-... protocols, otherwise ``False``
@@ -52,10 +62,8 @@ class Database(bob.db.base.Database):
 
         Returns: A list containing all the client ids which have the desired properties.
         """
-        # retrieve enroll templates
-        templates = self.protocol.get_templates(protocol, purpose="enroll")
-        client_ids = set(template.client_id for template in templates.values())
-        return sorted(client_ids)
+        protocol = self.check_parameter_for_validity(protocol, "protocol", self.protocol_names())
+        return self.protocol.client_ids(protocol).tolist()
 
     def model_ids(self, groups='dev', protocol="1:1"):
         """Returns a list of model ids for the specific query by the user.
@@ -72,10 +80,7 @@ class Database(bob.db.base.Database):
         """
         protocol = self.check_parameter_for_validity(protocol, "protocol", self.protocol_names())
 
-        # retrieve templates
-        templates = self.protocol.get_templates(protocol, "enroll")
-        # get keys of templates, which are the template ids
-        return sorted(list(templates.keys()))
+        return self.protocol.model_ids(protocol).tolist()
 
     def get_client_id_from_model_id(self, protocol, model_id):
         """Returns the client_id attached to the given model_id
@@ -90,9 +95,12 @@ class Database(bob.db.base.Database):
 
         Returns: The client_id attached to the given model_id
         """
-        # try to find the client id for the given model id in any previously read file
+        # the subject ids of the gallery templates are known without reading the metadata
         protocol = self.check_parameter_for_validity(protocol, "protocol", self.protocol_names())
-        return self.protocol.enroll_template(protocol, model_id).client_id
+        template_ids, subject_ids = self.protocol.template_subjects(protocol, "enroll")
+        index = numpy.searchsorted(template_ids, model_id)
+        assert index < len(template_ids) and template_ids[index] == model_id, "The given model id '%s' is not a gallery template ID" % model_id
+        return None if subject_ids[index] == -1 else int(subject_ids[index])
 
     def get_model_ids_from_client_id(self, protocol, purpose, client_id):
         """Returns the model ids (templates) for the given client_id
@@ -108,10 +116,41 @@ class Database(bob.db.base.Database):
         protocol = self.check_parameter_for_validity(protocol, "protocol", self.protocol_names())
         purpose = self.check_parameter_for_validity(purpose, "purpose", ("enroll", "probe"))
 
-        return self.uniquify(
-            t.id for t in self.protocol.get_templates(protocol, purpose).values() if t.client_id == client_id)
+        return self.protocol.client_index(protocol, purpose)[client_id].tolist()
+
+    def get_model_ids_from_client_ids(self, protocol, purpose, client_ids):
+        """Returns the model ids (templates) for each of the given client ids
+
+        Keyword Parameters:
+
+        client_ids : [int] or :py:class:`numpy.ndarray`
+          The client ids
+
+        Returns: A list containing the sorted :py:class:`numpy.ndarray` of model ids (template ids) for each of the given clients
+        """
+        protocol = self.check_parameter_for_validity(protocol, "protocol", self.protocol_names())
+        purpose = self.check_parameter_for_validity(purpose, "purpose", ("enroll", "probe"))
+
+        return self.protocol.client_index(protocol, purpose).lookup(numpy.asarray(client_ids).tolist())
+
+    def get_template_ids_from_file(self, protocol, purpose, file):
+        """Returns the ids of the templates of the given protocol and purpose that contain the given file
+
+        Keyword Parameters:
+
+        file : :py:class:`File` or str
+          The file, or its :py:attr:`File.id`
+
+        Returns: The sorted list of template ids
+        """
+        protocol = self.check_parameter_for_validity(protocol, "protocol", self.protocol_names())
+        purpose = self.check_parameter_for_validity(purpose, "purpose", ("enroll", "probe"))
+        file_id = file if isinstance(file, six.string_types) else file.id
+
+        row = self.protocol._read_metadata().rows_from_ids([file_id])[0]
+        return self.protocol.file_index(protocol, purpose)[row].tolist()
 
-    def objects(self, groups='dev', protocol=None, purposes=None, model_ids=None):
+    def objects(self, groups='dev', protocol=None, purposes=None, model_ids=None, frame_stride=1, max_frames=None, frame_selection="uniform"):
         """Using the specified restrictions, this function returns a list of :py:class:`File` objects.
 
         Keyword Parameters:
@@ -130,6 +169,15 @@ class Database(bob.db.base.Database):
         model_ids : int or [int] or ``None``
           If given (as a list of model id's or a single one), only the files belonging to the specified model id is returned.
           For 'probe' purposes, the probe images belonging to the given model ids are returned.
+
+        frame_stride : int
+          If larger than 1, only every ``frame_stride``'th frame of each video of a template is returned
+
+        max_frames : int or ``None``
+          If given, at most ``max_frames`` frames of each video of a template are returned
+
+        frame_selection : str
+          How the ``max_frames`` frames are selected: ``'uniform'`` for evenly spaced frames, or ``'quality'`` for the frames with the smallest absolute yaw and roll angles
         """
 
         # check that every parameter is as expected
@@ -144,18 +192,19 @@ class Database(bob.db.base.Database):
         if 'enroll' in purposes:
             for protocol in protocols:
                 if model_ids:
-                    for model_id in model_ids:
-                        templates.add(self.protocol.enroll_template(protocol, model_id))
+                    selected = [self.protocol.enroll_template(protocol, model_id) for model_id in model_ids]
                 else:
-                    templates.update(self.protocol.get_templates(protocol, "enroll").values())
+                    selected = self.protocol.get_templates(protocol, "enroll").values()
+                templates.update(self._subsample(protocol, "enroll", selected, frame_stride, max_frames, frame_selection))
 
         if 'probe' in purposes:
             for protocol in protocols:
-                if model_ids:
-                    for model_id in model_ids:
-                        templates.update(self.protocol.probe_templates(protocol, model_id))
+                if model_ids and protocol in self.protocol.match_files:
+                    selected = [t for model_id in model_ids for t in self.protocol.probe_templates(protocol, model_id)]
                 else:
-                    templates.update(self.protocol.get_templates(protocol, "probe").values())
+                    # in the 1:N protocols, all probes are compared to all models
+                    selected = self.protocol.get_templates(protocol, "probe").values()
+                templates.update(self._subsample(protocol, "probe", selected, frame_stride, max_frames, frame_selection))
 
         # get a unique set of files
         files = set(file for template in templates for file in template.files)
@@ -163,7 +212,58 @@ class Database(bob.db.base.Database):
         # now, collect all files and return them
         return files
 
-    def object_sets(self, groups='dev', protocol=None, purposes='probe', model_ids=None):
+    def unique_paths(self, protocol=None, purposes=None):
+        """Returns the unique physical files that are required for the given protocols and purposes.
+
+        Many images and frames are shared between the templates of different protocols and purposes, and an image that shows several subjects is listed as several :py:class:`File`'s with different :py:attr:`File.id`'s.
+        Each image only needs to be read once for all of these files; note that the faces of the different subjects in an image have different annotations.
+
+        Keyword Parameters:
+
+        protocol : str or [str] or ``None``
+          One or more of the available protocol names, see :py:meth:`protocol_names`.
+          If not specified, all protocols will be assumed.
+
+        purposes : str or [str] or ``None``
+          One or several purposes for which files should be retrieved ('enroll', 'probe').
+
+        Returns: A :py:class:`PathIndex`, which maps the sorted original file names of the unique files to the :py:attr:`File.id`'s of all files in the given protocols that share this file.
+        """
+        return PathIndex(self.protocol._read_metadata(), self._rows(protocol, purposes))
+
+    def _rows(self, protocol, purposes):
+        """Returns the sorted unique metadata rows of the files of the given protocols and purposes"""
+        protocols = self.check_parameters_for_validity(protocol, "protocol", self.protocol_names())
+        purposes = self.check_parameters_for_validity(purposes, "purpose", ("enroll", "probe"))
+        # the keys of the file indexes are the sorted unique metadata rows of the files of the protocols
+        return numpy.unique(numpy.concatenate([self.protocol.file_index(p, purpose).keys for p in protocols for purpose in purposes]))
+
+    def manifest(self, directory):
+        """Opens or creates the :py:class:`bob.db.ijbc.manifest.Manifest` in the given directory, which records the files that have been completed by a job"""
+        return Manifest(directory, self.protocol._read_metadata())
+
+    def remaining_files(self, manifest, protocol=None, purposes=None):
+        """Returns the files of the given protocols and purposes that have not been completed yet.
+
+        Keyword Parameters:
+
+        manifest : :py:class:`bob.db.ijbc.manifest.Manifest`
+          The manifest of the job, see :py:meth:`manifest`
+
+        protocol : str or [str] or ``None``
+          One or more of the available protocol names, see :py:meth:`protocol_names`.
+          If not specified, all protocols will be assumed.
+
+        purposes : str or [str] or ``None``
+          One or several purposes for which files should be retrieved ('enroll', 'probe').
+
+        Returns: The list of remaining :py:class:`File` objects, sorted by path.
+        """
+        rows = self._rows(protocol, purposes)
+        metadata = self.protocol._read_metadata()
+        return [metadata.file(row) for row in rows[~manifest.completed()[rows]].tolist()]
+
+    def object_sets(self, groups='dev', protocol=None, purposes='probe', model_ids=None, frame_stride=1, max_frames=None, frame_selection="uniform"):
         """Using the specified restrictions, this function returns a list of :py:class:`Template` objects.
 
         Keyword Parameters:
@@ -179,6 +279,9 @@ class Database(bob.db.base.Database):
 
         model_ids : int or [int] or ``None``
           If given, the probe templates belonging to the given model ids are returned.
+
+        frame_stride, max_frames, frame_selection
+          Subsample the frames of the videos of each template, see :py:meth:`objects`
         """
 
         # check that every parameter is as expected
@@ -191,14 +294,330 @@ class Database(bob.db.base.Database):
 
         # collect the templates, and filter them by the given criteria
         templates = set()
-        if model_ids:
+        if model_ids and protocol in self.protocol.match_files:
             for model_id in model_ids:
                 templates.update(self.protocol.probe_templates(protocol, model_id))
         else:
+            # in the 1:N protocols, all probes are compared to all models
             templates.update(self.protocol.get_templates(protocol, "probe").values())
 
         # return list of all templates
-        return templates
+        return set(self._subsample(protocol, "probe", templates, frame_stride, max_frames, frame_selection))
+
+    def _subsample(self, protocol, purpose, templates, frame_stride, max_frames, frame_selection):
+        """Returns the given templates, or copies of them that contain only the subsampled frames of their videos, see :py:meth:`Protocol.frame_index`"""
+        if frame_stride == 1 and max_frames is None:
+            return templates
+        frame_selection = self.check_parameter_for_validity(frame_selection, "frame selection", FrameIndex.selections)
+        templates = sorted(templates)
+        template_ids = numpy.array([t.id for t in templates], numpy.int64)
+        offsets, rows = self.protocol.frame_index(protocol, purpose).select(template_ids, frame_stride, max_frames, frame_selection)
+        metadata = self.protocol._read_metadata()
+        files = [metadata.file(row) for row in rows.tolist()]
+        return [Template(t.id, t.client_id, files[first:last]) for t, first, last in zip(templates, offsets[:-1].tolist(), offsets[1:].tolist())]
+
+    def iter_pairs(self, protocol="1:1", chunk_size=1000000):
+        """Iterates over all comparisons of the given protocol in chunks, without creating :py:class:`Template` objects.
+
+        Keyword Parameters:
+
+        protocol : str
+          One of the protocols that define a list of comparisons, i.e., ``'1:1'`` or ``'Covariates'``
+
+        chunk_size : int
+          The maximum number of comparisons that is returned at once
+
+        Yields: A tuple of two :py:class:`numpy.ndarray`'s, containing the model template ids and the probe template ids of the comparisons of the current chunk.
+        The comparisons are ordered by model id, and by the order of the match file for each model.
+        """
+        protocol = self.check_parameter_for_validity(protocol, "protocol", sorted(self.protocol.match_files))
+        return self.protocol.iter_pairs(protocol, chunk_size)
+
+    def shards(self, protocol="1:1", count=1, index=0):
+        """Returns one part of the comparisons of the given protocol, to distribute the computation of scores over several machines.
+
+        Keyword Parameters:
+
+        protocol : str
+          One of the protocols that define a list of comparisons, i.e., ``'1:1'`` or ``'Covariates'``
+
+        count : int
+          The total number of shards
+
+        index : int
+          The index of the shard to return, must be in the range ``[0, count)``
+
+        Returns: A :py:class:`Shard` containing the model ids, the probe template ids and the files required to compute the scores of this shard.
+        The shards are balanced by their number of comparisons, and the assignment is deterministic.
+        """
+        protocol = self.check_parameter_for_validity(protocol, "protocol", sorted(self.protocol.match_files))
+        return self.protocol.shard(protocol, count, index)
+
+    def template_features(self, features, files, protocol="1:1", purposes=None, normalize=False, skip_missing=False, block_size=10000):
+        """Computes the features of all templates of the given protocol from the features of their files.
+
+        The frames of each video are averaged first, and the template feature is the average over its images and videos, see :py:func:`bob.db.ijbc.features.aggregate`.
+        The media of each file is derived from its path and frame number, see :py:meth:`Protocol.media_index`.
+
+        Keyword Parameters:
+
+        features : 2D :py:class:`numpy.ndarray`
+          The features of the given files, one per row
+
+        files : [:py:class:`File`] or [str]
+          The files, or their :py:attr:`File.id`'s, aligned with the rows of ``features``
+
+        protocol : str
+          One of the protocols of the dataset
+
+        purposes : str or [str] or ``None``
+          The purposes of the templates to compute ('enroll', 'probe'); by default, all templates are computed
+
+        normalize : bool
+          If enabled, media and template features are normalized to unit Euclidean length
+
+        skip_missing : bool
+          If enabled, files that are not in ``files`` are ignored, and templates without any feature contain ``NaN``'s; otherwise, a :py:class:`ValueError` is raised
+
+        block_size : int
+          The number of templates that are computed at once, which limits the memory requirements
+
+        Returns: A tuple of the sorted template ids as a :py:class:`numpy.ndarray`, and the according template features, one per row.
+        """
+        protocol = self.check_parameter_for_validity(protocol, "protocol", self.protocol_names())
+        purposes = self.check_parameters_for_validity(purposes, "purpose", ("enroll", "probe"))
+        features = numpy.asarray(features)
+        file_ids = [f if isinstance(f, six.string_types) else f.id for f in files]
+        if len(file_ids) != len(features):
+            raise ValueError("The number of files %d differs from the number of features %d" % (len(file_ids), len(features)))
+
+        metadata = self.protocol._read_metadata()
+        feature_rows = numpy.full(len(metadata), -1, numpy.int64)
+        feature_rows[metadata.rows_from_ids(file_ids)] = numpy.arange(len(file_ids))
+        media = self.protocol.media_index()
+
+        # collect the template ids of each template list, as enrollment and probe templates might be stored in the same list
+        lists = []
+        for purpose in purposes:
+            for templates, ids in self.protocol._purpose_lists(protocol, purpose):
+                for entry in lists:
+                    if entry[0] is templates:
+                        entry[1].append(ids)
+                        break
+                else:
+                    lists.append((templates, [ids]))
+
+        template_ids, template_features = [], []
+        for templates, ids in lists:
+            ids = numpy.unique(numpy.concatenate(ids))
+            for start in range(0, len(ids), block_size):
+                template_ids.append(ids[start:start + block_size])
+                template_features.append(aggregate(templates, template_ids[-1], feature_rows, features, media, normalize, skip_missing))
+
+        template_ids = numpy.concatenate(template_ids)
+        template_features = numpy.concatenate(template_features)
+        order = numpy.argsort(template_ids, kind="mergesort")
+        return template_ids[order], template_features[order]
+
+    def scores(self, template_ids, template_features, protocol="1:1", metric="cosine", output=None, score_format="4column", parallel=1, block_size=1000000, dense_ratio=4):
+        """Computes the scores of all comparisons of the given protocol from the given template features, see :py:class:`bob.db.ijbc.scoring.Scorer`.
+
+        Keyword Parameters:
+
+        template_ids : :py:class:`numpy.ndarray` (int)
+          The sorted ids of the templates, e.g., as returned by :py:meth:`template_features`
+
+        template_features : 2D :py:class:`numpy.ndarray`
+          The features of the templates, one per row
+
+        protocol : str
+          One of the protocols that define a list of comparisons, i.e., ``'1:1'`` or ``'Covariates'``
+
+        metric : str
+          ``'cosine'`` for the cosine similarity, or ``'euclidean'`` for the negative Euclidean distance
+
+        output : str or ``None``
+          If given, the scores are written into this file; otherwise, they are returned
+
+        score_format : str
+          The format of the score file: ``'4column'`` and ``'5column'`` for the text score formats of ``bob.bio.base``, using the subject ids as client ids, or ``'binary'`` for a ``.npy`` file of ``float32`` scores in the order of :py:meth:`iter_pairs`
+
+        parallel : int
+          The number of processes that compute the scores
+
+        block_size : int
+          The approximate number of comparisons that are computed at once
+
+        dense_ratio : float
+          The ratio above which a block is not computed with a matrix product, see :py:class:`bob.db.ijbc.scoring.Scorer`
+
+        Returns: A :py:class:`numpy.ndarray` of ``float32`` scores in the order of :py:meth:`iter_pairs`, or the number of written scores if ``output`` is given.
+        """
+        protocol = self.check_parameter_for_validity(protocol, "protocol", sorted(self.protocol.match_files))
+        scorer = Scorer(template_ids, template_features, self.protocol._read_match_file(protocol), metric,
+                        self.protocol.template_subjects(protocol, "enroll"), self.protocol.template_subjects(protocol, "probe"), dense_ratio)
+        if output is None:
+            return scorer(parallel, block_size)
+        return scorer.write(output, score_format, parallel, block_size)
+
+    def labels(self, protocol="1:1"):
+        """Returns whether each comparison of the given protocol is genuine, i.e., whether model and probe template belong to the same subject.
+
+        Keyword Parameters:
+
+        protocol : str
+          One of the protocols that define a list of comparisons, i.e., ``'1:1'`` or ``'Covariates'``
+
+        Returns: A :py:class:`numpy.ndarray` of ``bool``, in the order of :py:meth:`iter_pairs`.
+        """
+        protocol = self.check_parameter_for_validity(protocol, "protocol", sorted(self.protocol.match_files))
+        labels = list(evaluation.iter_labels(self.protocol, protocol))
+        return numpy.concatenate(labels) if labels else numpy.zeros(0, bool)
+
+    def evaluate(self, scores, protocol="1:1", far_values=evaluation.far_values, chunk_size=1000000):
+        """Computes the true acceptance rates of the given scores at the given false acceptance rates, see :py:func:`bob.db.ijbc.evaluation.tar_at_far`.
+
+        The labels of the comparisons are computed in chunks, and only the largest impostor scores are kept, so that the memory stays bounded.
+
+        Keyword Parameters:
+
+        scores : :py:class:`numpy.ndarray` (float)
+          The scores of all comparisons of the protocol in the order of :py:meth:`iter_pairs`, e.g., as returned by :py:meth:`scores` or memory-mapped from a binary score file
+
+        protocol : str
+          One of the protocols that define a list of comparisons, i.e., ``'1:1'`` or ``'Covariates'``
+
+        far_values : [float]
+          The false acceptance rates; by default, the rates from ``1e-6`` to ``1e-1``
+
+        chunk_size : int
+          The number of comparisons that are processed at once
+
+        Returns: A tuple of three :py:class:`numpy.ndarray`'s containing the thresholds, the true acceptance rates and the actual false acceptance rates for each of the ``far_values``.
+        """
+        protocol = self.check_parameter_for_validity(protocol, "protocol", sorted(self.protocol.match_files))
+        return evaluation.evaluate(scores, evaluation.iter_labels(self.protocol, protocol, chunk_size), far_values)
+
+    def evaluate_covariates(self, scores, protocol="Covariates", covariates=None, bins=None, purpose="probe", far_values=evaluation.far_values, chunk_size=1000000):
+        """Computes the true acceptance rates of the given scores at the given false acceptance rates, separately for the comparisons in each bin of each covariate.
+
+        See :py:func:`bob.db.ijbc.evaluation.evaluate_covariates` for details.
+
+        Keyword Parameters:
+
+        scores : :py:class:`numpy.ndarray` (float)
+          The scores of all comparisons of the protocol in the order of :py:meth:`iter_pairs`
+
+        protocol : str
+          One of the protocols that define a list of comparisons, i.e., ``'Covariates'`` or ``'1:1'``
+
+        covariates : [str] or ``None``
+          The covariates to evaluate, any of ``'facial_hair'``, ``'age'``, ``'indoor'``, ``'skintone'``, ``'gender'``, ``'yaw'``, ``'roll'`` and ``'occlusion'`` (the number of occluded regions); by default, all are evaluated
+
+        bins : {str: [float] or ``None``} or ``None``
+          Bin edges for some covariates, replacing the defaults of :py:data:`bob.db.ijbc.evaluation.covariate_bins`; ``None`` uses each unique value as a bin
+
+        purpose : str
+          Whether the covariates of the ``'probe'`` or of the ``'enroll'`` template define the bin of a comparison
+
+        far_values : [float]
+          The false acceptance rates
+
+        chunk_size : int
+          The number of comparisons that are processed at once
+
+        Returns: A dictionary with the thresholds, the true acceptance rates and the actual false acceptance rates for each covariate and each of its bins.
+        """
+        protocol = self.check_parameter_for_validity(protocol, "protocol", sorted(self.protocol.match_files))
+        purpose = self.check_parameter_for_validity(purpose, "purpose", ("enroll", "probe"))
+        if covariates is not None:
+            covariates = self.check_parameters_for_validity(covariates, "covariate", list(evaluation.covariate_bins))
+        return evaluation.evaluate_covariates(scores, self.protocol, protocol, covariates, bins, purpose, far_values, chunk_size)
+
+    def identify(self, template_ids, template_features, protocol="1:N-Mixed", k=20, metric="cosine", block_size=1024):
+        """Searches all probe templates of the given identification protocol in its gallery, see :py:func:`bob.db.ijbc.identification.search`.
+
+        The results can be evaluated with :py:func:`bob.db.ijbc.identification.cmc` and :py:func:`bob.db.ijbc.identification.fnir_at_fpir`.
+
+        Keyword Parameters:
+
+        template_ids : :py:class:`numpy.ndarray` (int)
+          The sorted ids of the templates, e.g., as returned by :py:meth:`template_features`
+
+        template_features : 2D :py:class:`numpy.ndarray`
+          The features of the templates, one per row
+
+        protocol : str
+          One of the ``1:N`` protocols
+
+        k : int
+          The number of best gallery templates that are returned for each probe
+
+        metric : str
+          ``'cosine'`` for the cosine similarity, or ``'euclidean'`` for the negative Euclidean distance
+
+        block_size : int
+          The number of probes that are compared with the gallery at once
+
+        Returns: A tuple of the sorted probe template ids, the ids and the scores of the ``k`` best gallery templates of each probe, the mated score and the rank of the mate of each probe (``NaN`` and ``0`` for non-mated probes).
+        """
+        protocol = self.check_parameter_for_validity(protocol, "protocol", [p for p in self.protocol_names() if p.startswith("1:N")])
+        template_ids = numpy.asarray(template_ids)
+
+        def _features(ids):
+            rows = numpy.minimum(numpy.searchsorted(template_ids, ids), len(template_ids) - 1)
+            missing = template_ids[rows] != ids
+            if numpy.any(missing):
+                raise ValueError("No feature was given for template %d" % ids[missing][0])
+            return template_features[rows]
+
+        gallery_ids, gallery_subjects = self.protocol.template_subjects(protocol, "enroll")
+        probe_ids, probe_subjects = self.protocol.template_subjects(protocol, "probe")
+        template_features = numpy.asarray(template_features)
+        top_index, top_scores, mated_scores, mated_ranks = identification.search(
+            _features(gallery_ids), _features(probe_ids), gallery_subjects, probe_subjects, k, metric, block_size)
+        return probe_ids, gallery_ids[top_index], top_scores, mated_scores, mated_ranks
+
+    def detection_protocol_names(self):
+        """Returns the names of the face detection protocols: ``'detection'`` for the face detection protocol, and ``'wild9'``, ``'wild10'`` and ``'wild11'`` for the test sets of the detection in the wild"""
+        return sorted(self.protocol.detection_files)
+
+    def detection_ground_truth(self, protocol="detection"):
+        """Returns the images and the ground-truth face bounding boxes of the given face detection protocol.
+
+        Keyword Parameters:
+
+        protocol : str
+          One of the :py:meth:`detection_protocol_names`
+
+        Returns: A :py:class:`DetectionList`, which maps each image file name to its bounding boxes ``(x, y, width, height)``; images without faces have no bounding box.
+        """
+        protocol = self.check_parameter_for_validity(protocol, "protocol", self.detection_protocol_names())
+        return self.protocol._read_detection_list(protocol)
+
+    def evaluate_detections(self, images, boxes, scores, protocol="detection", overlap=0.5):
+        """Evaluates the detected face bounding boxes of all images of the given face detection protocol, see :py:func:`bob.db.ijbc.detection.evaluate`.
+
+        Keyword Parameters:
+
+        images : [str]
+          The image file name of each detection, relative to the ``original_directory``, e.g., ``'img/1.jpg'``
+
+        boxes : 2D :py:class:`numpy.ndarray`
+          The detected bounding boxes ``(x, y, width, height)``, one per row
+
+        scores : :py:class:`numpy.ndarray` (float)
+          The confidence of each detection
+
+        protocol : str
+          One of the :py:meth:`detection_protocol_names`
+
+        overlap : float
+          The minimum intersection over union of a detection with a ground-truth bounding box to be a true positive
+
+        Returns: A tuple of the thresholds in descending order, and the precision, the recall and the number of false positives at each threshold; recall over false positives is the discrete ROC.
+        """
+        return detection.evaluate(self.detection_ground_truth(protocol), images, boxes, scores, overlap)
 
     def templates(self, groups='dev', protocol=None):
         """Returns all templates (enrollment and probe) for the given protocol """
@@ -211,8 +630,23 @@ class Database(bob.db.base.Database):
         """Returns the annotations for the given :py:class:`File` object as a dictionary, see :py:class:`Annotation` for details."""
         return None if file.annotation is None else file.annotation()
 
+    def annotations_array(self, files):
+        """Returns the annotations of many files at once as a structured :py:class:`numpy.ndarray`.
+
+        Keyword Parameters:
+
+        files : [:py:class:`File`] or [str]
+          The files, or their :py:attr:`File.id`'s
+
+        Returns: A structured array of type :py:attr:`Metadata.annotation_dtype`, aligned with the given files.
+        It contains the fields ``topleft``, ``bottomright`` and ``size`` in ``(y, x)`` order, ``frame``, all covariates, the 18 ``occlusion`` annotations, and ``has_annotation``, which is ``False`` for files without annotation.
+        """
+        file_ids = [f if isinstance(f, six.string_types) else f.id for f in files]
+        metadata = self.protocol._read_metadata()
+        return metadata.annotations(metadata.rows_from_ids(file_ids))
+
     def protocol_names(self):
-        """Returns all registered protocol names, including ``['1:1', 'Covariates', '1:N-Mixed']``"""
+        """Returns all registered protocol names: ``'1:1'`` and ``'Covariates'`` for verification, and the ``'1:N-...'`` protocols for identification, searching the ``Image``, ``Video`` or ``Mixed`` probes in the ``G1`` gallery, the ``G2`` gallery, or both galleries"""
         return self.protocol.protocol_names
 
     def original_file_name(self, file, check_existence=True):
@@ -235,3 +669,52 @@ class Database(bob.db.base.Database):
             return file_name
         raise ValueError("The file '%s' was not found. Please check the original directory '%s'?" % (
         file_name, self.original_directory))
+
+    def original_file_names(self, files, check_existence=True, skip_unknown=False):
+        """Returns the original image file names of many files at once.
+        To be able to call this function, the ``original_directory`` must have been specified in the :py:class:`Database` constructor.
+
+        Keyword parameters:
+
+        files : [:py:class:`File`] or [str]
+          The ``File`` objects, or their :py:attr:`File.id`'s, to get the original file names from.
+
+        check_existence : bool
+          If set to True (the default), the existence of the original image files is checked.
+          The contents of the directories of the ``original_directory`` are listed once and cached; they are not updated afterward.
+
+        skip_unknown : bool
+          If set to True, file ids that are not in the database are omitted; by default, a :py:exc:`ValueError` is raised.
+
+        Returns: The list of original file names, aligned with the given files (unless unknown files are skipped).
+        """
+        if not self.original_directory:
+            raise ValueError("The original_directory was not specified in the constructor.")
+        metadata = self.protocol._read_metadata()
+        rows = metadata.rows_from_ids([f if isinstance(f, six.string_types) else f.id for f in files], strict=not skip_unknown)
+        file_names = [os.path.join(self.original_directory, name) for name in metadata.file_names(rows[rows >= 0])]
+        if check_existence:
+            exist = self._directory_index.exist(file_names)
+            if not numpy.all(exist):
+                raise ValueError("%d of %d files were not found, e.g., '%s'. Please check the original directory '%s'?" % (
+                    numpy.sum(~exist), len(file_names), file_names[numpy.flatnonzero(~exist)[0]], self.original_directory))
+        return file_names
+
+    def paths(self, ids, prefix=None, suffix=None):
+        """Returns the unique file names of the given file ids, see :py:meth:`File.make_path`.
+
+        Keyword parameters:
+
+        ids : [str]
+          The :py:attr:`File.id`'s; ids that are not in the database are omitted
+
+        prefix : str or ``None``
+          The directory to prepend
+
+        suffix : str or ``None``
+          The extension to append
+
+        Returns: The list of file names of the known ids
+        """
+        rows = self.protocol._read_metadata().rows_from_ids(ids, strict=False)
+        return [os.path.join(prefix or '', file_id + (suffix or '')) for file_id, row in zip(ids, rows.tolist()) if row >= 0]
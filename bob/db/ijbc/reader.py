@@ -11,21 +11,37 @@ import pkg_resources
 import os
 
 import bob.db.base
-import csv
 import numpy
 
+from .cache import ProtocolCache
+
 import logging
 import six
 
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
 logger = logging.getLogger("bob.db.ijbc")
 
 
-class Annotation:
+def _optional(value):
+    """Returns ``None`` for ``NaN`` values, otherwise the value itself"""
+    return None if value != value else value
+
+
+class Annotation(object):
     """
     Annotations for a File of the IJB-C dataset
+
+    The 18 ``occlusion`` annotations are given as a ``tuple``.
+    If a dictionary of ``occlusions`` is given, annotations with the same occlusion values share the same tuple, which is stored in this dictionary.
     """
 
-    def __init__(self, annots):
+    __slots__ = ("topleft", "size", "frame", "facial_hair", "age", "indoor", "skintone", "gender", "yaw", "roll", "occlusion", "_annotation")
+
+    def __init__(self, annots, occlusions=None):
         # assure that we have all annotations
         assert len(annots) == 30
 
@@ -33,19 +49,32 @@ class Annotation:
         assert not numpy.all(numpy.isnan(annots[:4]))
         self.topleft = (annots[1], annots[0])
         self.size = (annots[3], annots[2])
-        self.bottomright = tuple(self.topleft[i] + self.size[i] for i in range(2))
 
-        self.frame = None if numpy.isnan(annots[4]) else annots[4]
-        self.facial_hair = None if numpy.isnan(annots[5]) else annots[5]
-        self.age = None if numpy.isnan(annots[6]) else annots[6]
-        self.indoor = None if numpy.isnan(annots[7]) else annots[7]
-        self.skintone = None if numpy.isnan(annots[8]) else annots[8]
-        self.gender = None if numpy.isnan(annots[9]) else annots[9]
-        self.yaw = None if numpy.isnan(annots[10]) else annots[10]
-        self.roll = None if numpy.isnan(annots[11]) else annots[11]
-
-        self.occlusion = annots[12:30]
-        self.annotation = dict(topleft=self.topleft, bottomright=self.bottomright, size=self.size)
+        self.frame = _optional(annots[4])
+        self.facial_hair = _optional(annots[5])
+        self.age = _optional(annots[6])
+        self.indoor = _optional(annots[7])
+        self.skintone = _optional(annots[8])
+        self.gender = _optional(annots[9])
+        self.yaw = _optional(annots[10])
+        self.roll = _optional(annots[11])
+
+        self.occlusion = tuple(annots[12:30])
+        if occlusions is not None:
+            # NaN values are replaced in the key, as they do not compare equal
+            self.occlusion = occlusions.setdefault(tuple(_optional(o) for o in self.occlusion), self.occlusion)
+        self._annotation = None
+
+    @property
+    def bottomright(self):
+        return tuple(self.topleft[i] + self.size[i] for i in range(2))
+
+    @property
+    def annotation(self):
+        """The dictionary of ``topleft``, ``bottomright`` and ``size``, which is created on first access"""
+        if self._annotation is None:
+            self._annotation = dict(topleft=self.topleft, bottomright=self.bottomright, size=self.size)
+        return self._annotation
 
     def __call__(self):
         return self.annotation
@@ -59,6 +88,10 @@ class File(bob.db.base.File):
 
     """
 
+    # path and id are stored by the base class; as the base class does not define __slots__, each object still has a __dict__,
+    # and these slots only keep the attributes of this class out of it
+    __slots__ = ("extension", "client_id", "annotation")
+
     @staticmethod
     def make_id(path, subject_id):
         return "%s-%s" % (path, subject_id)
@@ -80,7 +113,9 @@ class File(bob.db.base.File):
         annotation : :py:class:`Annotation` or ``None``
           The annotation of the file, if present
         """
-        path, self.extension = os.path.splitext(path)
+        path, extension = os.path.splitext(path)
+        # there are only a few different extensions, which are shared by all files
+        self.extension = six.moves.intern(extension)
         super(File, self).__init__(path, self.make_id(path, subject_id))
         self.client_id = subject_id
         self.annotation = annotation
@@ -113,7 +148,7 @@ class File(bob.db.base.File):
         return os.path.join(directory, path)
 
 
-class Template:
+class Template(object):
     """A ``Template`` contains a list of :py:class:`File` objects belonging to
     the same subject (there might be several templates per subject).
 
@@ -137,12 +172,16 @@ class Template:
 
     """
 
+    __slots__ = ("id", "client_id", "files")
+
     def __init__(self, template_id, subject_id, files=None):
         self.id = template_id
         self.client_id = subject_id
         self.files = files if files is not None else []
 
-        self.path = str(template_id)
+    @property
+    def path(self):
+        return str(self.id)
 
     def __lt__(self, other):
         """This function defines the order on the Template objects. Template objects are
@@ -150,145 +189,1146 @@ class Template:
         return self.id < other.id
 
 
+def _read_columns(filename, usecols, dtype, skip_header=True):
+    """Reads the given columns of a CSV file in bulk into a :py:class:`numpy.ndarray`; with a structured ``dtype``, all columns are parsed in a single pass"""
+    with open(filename) as f:
+        if skip_header:
+            six.next(f)
+        data = numpy.loadtxt(f, delimiter=",", usecols=usecols, dtype=dtype, ndmin=2 if len(usecols) > 1 and numpy.dtype(dtype).names is None else 1)
+    return data
+
+
+def _column_width(filename, column, skip_header=True):
+    """Returns the maximum number of bytes of the given column of a CSV file, without parsing the other columns"""
+    with open(filename, "rb") as f:
+        if skip_header:
+            six.next(f)
+        return max([len(line.split(b",", column + 1)[column]) for line in f if line.strip()] or [1])
+
+
+def _split_extensions(filenames):
+    """Splits the given array of file names into paths and extensions, as :py:func:`os.path.splitext` does.
+    Only the unique file names are split, with vectorized operations on their characters (or bytes for a ``bytes`` array).
+    Returns the path (of the same type as the file names) and the index into the list of unique extensions for each file name."""
+    unique_names, name_index = numpy.unique(filenames, return_inverse=True)
+    name_index = name_index.ravel()
+    kind = "S" if unique_names.dtype.kind == "S" else "U"
+    width = unique_names.dtype.itemsize // (1 if kind == "S" else 4)
+    chars = unique_names.view(numpy.uint8 if kind == "S" else numpy.uint32).reshape(len(unique_names), width)
+    positions = numpy.arange(width)
+
+    # the extension starts at the last dot after the last separator, but not at the leading dots of the base name
+    is_dot = chars == ord(".")
+    is_separator = (chars == ord("/")) | (chars == ord(os.sep))
+    last_dot = numpy.where(is_dot.any(axis=1), width - 1 - numpy.argmax(is_dot[:, ::-1], axis=1), -1)
+    last_separator = numpy.where(is_separator.any(axis=1), width - 1 - numpy.argmax(is_separator[:, ::-1], axis=1), -1)
+    in_base_name = (positions > last_separator[:, None]) & (positions < last_dot[:, None])
+    split = (last_dot > last_separator) & numpy.any(in_base_name & ~is_dot, axis=1)
+    lengths = numpy.count_nonzero(chars, axis=1)
+    starts = numpy.where(split, last_dot, lengths)
+
+    paths = numpy.where(positions < starts[:, None], chars, 0).view(unique_names.dtype).ravel()
+    # the extensions are short, and only their characters are gathered
+    extension_positions = starts[:, None] + numpy.arange(max(int(numpy.max(lengths - starts, initial=0)), 1))
+    extension_chars = numpy.where(extension_positions < lengths[:, None], chars[numpy.arange(len(chars))[:, None], numpy.minimum(extension_positions, width - 1)], 0)
+    extensions, extension_index = numpy.unique(numpy.ascontiguousarray(extension_chars, chars.dtype).view("%s%d" % (kind, extension_chars.shape[1])).ravel(), return_inverse=True)
+    extensions = [e.decode("utf-8") if kind == "S" else e for e in extensions.tolist()]
+    return paths[name_index], extensions, extension_index.ravel()[name_index].astype(numpy.uint8)
+
+
+def _read_pairs(filename, chunk_size=1 << 24):
+    """Reads a header-less CSV file with two integral columns in chunks of the given number of bytes"""
+    def _parse(data):
+        return numpy.fromstring(data.replace(b"\n", b",").strip(b", \r"), dtype=numpy.int64, sep=",").astype(numpy.int32)
+
+    chunks = []
+    with open(filename, "rb") as f:
+        remainder = b""
+        while True:
+            data = f.read(chunk_size)
+            if not data:
+                break
+            data = remainder + data
+            end = data.rfind(b"\n") + 1
+            chunks.append(_parse(data[:end]))
+            remainder = data[end:]
+        chunks.append(_parse(remainder))
+    return numpy.concatenate(chunks).reshape(-1, 2)
+
+
+def _ranges(starts, ends):
+    """Returns the concatenation of the index ranges ``[starts[i], ends[i])`` as a :py:class:`numpy.ndarray`"""
+    lengths = ends - starts
+    shifts = numpy.repeat(starts - numpy.cumsum(lengths) + lengths, lengths)
+    return shifts + numpy.arange(numpy.sum(lengths), dtype=numpy.int64)
+
+
+class Metadata:
+    """Column-wise storage of the ``ijbc_metadata.csv`` file.
+
+    All information of the metadata file is read in a single pass and kept in typed :py:class:`numpy.ndarray`'s, which are indexed by the row of the file.
+    :py:class:`File` and :py:class:`Annotation` objects are only created on request, and cached afterward.
+    Duplicate entries (i.e., with the same ``path`` and ``subject_id``) are removed, and the rows are sorted by ``path`` and ``subject_id``.
+
+    **Attributes:**
+
+    paths : :py:class:`numpy.ndarray` (str)
+      The sorted list of unique paths (without extension) of the files
+
+    extensions : :py:class:`numpy.ndarray` (str)
+      The list of unique file name extensions
+
+    path_index, extension_index : :py:class:`numpy.ndarray` (int)
+      The index into ``paths`` and ``extensions`` for each row
+
+    subject_id : :py:class:`numpy.ndarray` (int)
+      The subject id for each row, ``-1`` if no subject is given
+
+    bbox : :py:class:`numpy.ndarray` (float, N x 4)
+      The face bounding box for each row, in the order ``FACE_X, FACE_Y, FACE_WIDTH, FACE_HEIGHT``
+
+    frame : :py:class:`numpy.ndarray` (float)
+      The frame number, ``NaN`` for images
+
+    covariates : :py:class:`numpy.ndarray` (float, N x 7)
+      The covariates in the order given by ``covariate_names``
+
+    occlusion : :py:class:`numpy.ndarray` (float, N x 18)
+      The occlusion annotations
+    """
+
+    covariate_names = ("facial_hair", "age", "indoor", "skintone", "gender", "yaw", "roll")
+
+    # the data type of the structured arrays returned by :py:meth:`annotations`
+    annotation_dtype = numpy.dtype(
+        [("topleft", numpy.float64, (2,)), ("bottomright", numpy.float64, (2,)), ("size", numpy.float64, (2,)), ("frame", numpy.float64)] +
+        [(name, numpy.float64) for name in covariate_names] +
+        [("occlusion", numpy.float32, (18,)), ("has_annotation", bool)]
+    )
+
+    _arrays = ("paths", "extensions", "keys", "path_index", "extension_index", "subject_id", "bbox", "frame", "covariates", "occlusion", "has_annotation")
+
+    def __init__(self, filename, arrays=None):
+        self._filename = filename
+        if arrays is None:
+            arrays = self._read(filename)
+        for name, array in arrays.items():
+            setattr(self, name, array)
+        self._file_cache = {}
+        # the occlusion tuples that are shared between the Annotation objects of this metadata
+        self._occlusions = {}
+
+    def _read(self, filename):
+        """Reads all columns of the metadata file in a single pass and returns the dictionary of arrays"""
+        dtype = numpy.dtype([
+            ("subject_id", numpy.float64), ("filename", "S%d" % _column_width(filename, 1)),
+            ("bbox", numpy.float64, (4,)), ("frame", numpy.float64), ("covariates", numpy.float64, (7,)), ("occlusion", numpy.float32, (18,))
+        ])
+        data = _read_columns(filename, (0, 1) + tuple(range(3, 33)), dtype)
+
+        stems, extensions, extension_index = _split_extensions(data["filename"])
+        paths, path_index = numpy.unique(stems, return_inverse=True)
+        path_index = path_index.ravel()
+        try:
+            paths = paths.astype(str)
+        except UnicodeDecodeError:
+            paths = numpy.char.decode(paths, "utf-8")
+        subject_id = numpy.where(numpy.isnan(data["subject_id"]), -1, data["subject_id"]).astype(numpy.int32)
+
+        # remove duplicate entries, keeping the first occurrence, and sort by key
+        keys, rows = numpy.unique(self._make_keys(path_index, subject_id), return_index=True)
+        arrays = dict(
+            paths=paths,
+            extensions=numpy.array(extensions),
+            keys=keys,
+            path_index=path_index[rows].astype(numpy.int32),
+            extension_index=extension_index[rows],
+            subject_id=subject_id[rows],
+        )
+        for name in ("bbox", "frame", "covariates", "occlusion"):
+            arrays[name] = data[name][rows]
+        del data
+        arrays["has_annotation"] = ~(numpy.all(numpy.isnan(arrays["bbox"]), axis=1) & numpy.isnan(arrays["frame"]) &
+                                     numpy.all(numpy.isnan(arrays["covariates"]), axis=1) & numpy.all(numpy.isnan(arrays["occlusion"]), axis=1))
+        return arrays
+
+    @staticmethod
+    def _make_keys(path_index, subject_id):
+        """Combines path index and subject id into a single sortable key"""
+        return (numpy.asarray(path_index, numpy.int64) << 32) + (numpy.asarray(subject_id, numpy.int64) + 1)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def find(self, paths, subject_ids):
+        """Returns the row indices for the given paths (without extension) and subject ids (``-1`` for none), or ``-1`` for entries that are not in the metadata"""
+        paths = numpy.asarray(paths)
+        if not len(self.paths) or not len(paths):
+            return numpy.full(paths.shape, -1, numpy.int64)
+        path_index = numpy.searchsorted(self.paths, paths)
+        path_index[path_index == len(self.paths)] = 0
+        keys = self._make_keys(path_index, subject_ids)
+        rows = numpy.searchsorted(self.keys, keys)
+        rows[rows == len(self.keys)] = 0
+        valid = (self.paths[path_index] == paths) & (self.keys[rows] == keys)
+        return numpy.where(valid, rows, -1)
+
+    def rows(self, paths, subject_ids):
+        """Returns the row indices for the given paths (without extension) and subject ids (``-1`` for none).
+
+        Raises a :py:exc:`ValueError` if one of the given entries is not in the metadata."""
+        rows = self.find(paths, subject_ids)
+        if numpy.any(rows == -1):
+            raise ValueError("The file '%s' is not listed in the metadata" % numpy.asarray(paths)[rows == -1][0])
+        return rows
+
+    def rows_from_ids(self, file_ids, strict=True):
+        """Returns the row indices for the given :py:attr:`File.id`'s, see :py:meth:`rows`.
+
+        If ``strict`` is disabled, ``-1`` is returned for unknown ids instead of raising a :py:exc:`ValueError`."""
+        paths, subject_ids = [], []
+        for file_id in file_ids:
+            path, _, subject_id = file_id.rpartition("-")
+            paths.append(path)
+            subject_ids.append(-1 if subject_id == "None" else int(subject_id) if subject_id.isdigit() else -2)
+        rows = self.find(paths, subject_ids) if paths else numpy.zeros(0, numpy.int64)
+        rows[numpy.asarray(subject_ids) == -2] = -1
+        if strict and numpy.any(rows == -1):
+            raise ValueError("The file id '%s' is not listed in the metadata" % file_ids[numpy.flatnonzero(rows == -1)[0]])
+        return rows
+
+    def file_names(self, rows):
+        """Returns the original file names (paths with extension) of the given rows"""
+        rows = numpy.asarray(rows)
+        return [p + e for p, e in zip(self.paths[self.path_index[rows]].tolist(), self.extensions[self.extension_index[rows]].tolist())]
+
+    def annotations(self, rows):
+        """Returns the annotations of the given rows as a structured :py:class:`numpy.ndarray` of type :py:attr:`annotation_dtype`.
+
+        As in :py:class:`Annotation`, ``topleft``, ``bottomright`` and ``size`` are given in ``(y, x)`` order.
+        For files without annotations, ``has_annotation`` is ``False`` and all other values are ``NaN``."""
+        rows = numpy.asarray(rows)
+        annotations = numpy.empty(rows.shape, self.annotation_dtype)
+        bbox = self.bbox[rows]
+        annotations["topleft"] = bbox[..., [1, 0]]
+        annotations["size"] = bbox[..., [3, 2]]
+        annotations["bottomright"] = annotations["topleft"] + annotations["size"]
+        annotations["frame"] = self.frame[rows]
+        covariates = self.covariates[rows]
+        for index, name in enumerate(self.covariate_names):
+            annotations[name] = covariates[..., index]
+        annotations["occlusion"] = self.occlusion[rows]
+        annotations["has_annotation"] = self.has_annotation[rows]
+        return annotations
+
+    def annotation(self, row):
+        """Returns the :py:class:`Annotation` for the given row, or ``None``"""
+        if not self.has_annotation[row]:
+            return None
+        return Annotation(self.bbox[row].tolist() + [float(self.frame[row])] + self.covariates[row].tolist() + self.occlusion[row].tolist(), self._occlusions)
+
+    def file(self, row):
+        """Returns the :py:class:`File` for the given row; the same object is returned for repeated calls"""
+        if row not in self._file_cache:
+            subject_id = int(self.subject_id[row])
+            path = str(self.paths[self.path_index[row]]) + str(self.extensions[self.extension_index[row]])
+            self._file_cache[row] = File(None if subject_id == -1 else subject_id, path, self.annotation(row))
+        return self._file_cache[row]
+
+
+class TemplateList(Mapping):
+    """Read-only dictionary of :py:class:`Template`'s, indexed by template id.
+
+    The template lists are stored column-wise, :py:class:`Template` objects are only created on request, and cached afterward.
+    The files of the templates are only looked up in the metadata, which is obtained by calling ``metadata()``, when they are first required.
+    """
+
+    _arrays = ("template_ids", "subject_ids", "offsets", "file_rows")
+
+    def __init__(self, filename, metadata, arrays=None):
+        if arrays is None:
+            arrays = self._read(filename)
+        for name, array in arrays.items():
+            setattr(self, name, array)
+        self._metadata = metadata
+        self._template_cache = {}
+
+    def __getattr__(self, name):
+        # the files are only looked up in the metadata when they are first accessed
+        if name == "file_rows":
+            self.file_rows = self._metadata().rows(self.__dict__.pop("_file_paths"), self.__dict__.pop("_file_subject_ids")).astype(numpy.int32)
+            return self.file_rows
+        raise AttributeError(name)
+
+    def _read(self, filename):
+        """Reads the template list file and returns the dictionary of arrays"""
+        # read template ids and subject ids, and the file names
+        numbers = _read_columns(filename, (0, 1), numpy.float64)
+        stems = _split_extensions(_read_columns(filename, (2,), str))[0]
+        template_ids = numbers[:, 0].astype(numpy.int64)
+        subject_ids = numpy.where(numpy.isnan(numbers[:, 1]), -1, numbers[:, 1]).astype(numpy.int32)
+
+        # group the files by template, keeping the order of the files
+        order = numpy.argsort(template_ids, kind="mergesort")
+        template_ids, starts = numpy.unique(template_ids[order], return_index=True)
+        return dict(
+            template_ids=template_ids,
+            subject_ids=subject_ids[order][starts],
+            offsets=numpy.append(starts, len(order)).astype(numpy.int64),
+            _file_paths=stems[order],
+            _file_subject_ids=subject_ids[order],
+        )
+
+    def _index(self, template_id):
+        index = numpy.searchsorted(self.template_ids, template_id)
+        if index < len(self.template_ids) and self.template_ids[index] == template_id:
+            return index
+        return None
+
+    def __getitem__(self, template_id):
+        if template_id not in self._template_cache:
+            index = self._index(template_id)
+            if index is None:
+                raise KeyError(template_id)
+            subject_id = int(self.subject_ids[index])
+            metadata = self._metadata()
+            files = [metadata.file(row) for row in self.file_rows[self.offsets[index]:self.offsets[index + 1]].tolist()]
+            self._template_cache[template_id] = Template(int(self.template_ids[index]), None if subject_id == -1 else subject_id, files)
+        return self._template_cache[template_id]
+
+    def __contains__(self, template_id):
+        return self._index(template_id) is not None
+
+    def __iter__(self):
+        return iter(self.template_ids.tolist())
+
+    def __len__(self):
+        return len(self.template_ids)
+
+    def rows(self, template_ids):
+        """Returns the sorted unique metadata rows of the files of the given templates"""
+        index = numpy.searchsorted(self.template_ids, template_ids)
+        return numpy.unique(self.file_rows[_ranges(self.offsets[index], self.offsets[index + 1])])
+
+
+class TemplateView(Mapping):
+    """Read-only dictionary of a subset of the :py:class:`Template`'s of a :py:class:`TemplateList`, given by sorted unique template ids"""
+
+    def __init__(self, templates, template_ids):
+        self.templates = templates
+        self.template_ids = template_ids
+
+    def __getitem__(self, template_id):
+        if template_id not in self:
+            raise KeyError(template_id)
+        return self.templates[template_id]
+
+    def __contains__(self, template_id):
+        index = numpy.searchsorted(self.template_ids, template_id)
+        return index < len(self.template_ids) and self.template_ids[index] == template_id
+
+    def __iter__(self):
+        return iter(self.template_ids.tolist())
+
+    def __len__(self):
+        return len(self.template_ids)
+
+    def rows(self, template_ids):
+        """Returns the sorted unique metadata rows of the files of the given templates"""
+        return self.templates.rows(template_ids)
+
+
+class TemplateUnion(Mapping):
+    """Read-only dictionary of the :py:class:`Template`'s of several :py:class:`TemplateList`'s with disjoint template ids, without copying them.
+
+    The sorted ids of all templates are merged once, together with the index of the list that contains each template.
+    """
+
+    def __init__(self, lists):
+        self.lists = lists
+        template_ids = numpy.concatenate([templates.template_ids for templates in lists])
+        order = numpy.argsort(template_ids, kind="mergesort")
+        self.template_ids = template_ids[order]
+        self._list_index = numpy.repeat(numpy.arange(len(lists)), [len(templates) for templates in lists])[order]
+
+    def _index(self, template_id):
+        index = numpy.searchsorted(self.template_ids, template_id)
+        if index < len(self.template_ids) and self.template_ids[index] == template_id:
+            return index
+        return None
+
+    def __getitem__(self, template_id):
+        index = self._index(template_id)
+        if index is None:
+            raise KeyError(template_id)
+        return self.lists[self._list_index[index]][template_id]
+
+    def __contains__(self, template_id):
+        return self._index(template_id) is not None
+
+    def __iter__(self):
+        return iter(self.template_ids.tolist())
+
+    def __len__(self):
+        return len(self.template_ids)
+
+    def rows(self, template_ids):
+        """Returns the sorted unique metadata rows of the files of the given templates"""
+        template_ids = numpy.asarray(template_ids)
+        list_index = self._list_index[numpy.searchsorted(self.template_ids, template_ids)]
+        return numpy.unique(numpy.concatenate([templates.rows(template_ids[list_index == i]) for i, templates in enumerate(self.lists)]))
+
+
+class MatchList(Mapping):
+    """Read-only dictionary of the probe template ids for each model id, stored in compressed sparse row format.
+
+    **Attributes:**
+
+    model_ids : :py:class:`numpy.ndarray` (int32)
+      The sorted list of unique model ids
+
+    offsets : :py:class:`numpy.ndarray` (int64)
+      The probes of ``model_ids[i]`` are stored in ``probe_ids[offsets[i]:offsets[i+1]]``
+
+    probe_ids : :py:class:`numpy.ndarray` (int32)
+      The probe ids of all models, in the order of the match file
+
+    unique_probe_ids : :py:class:`numpy.ndarray` (int32)
+      The sorted list of unique probe ids
+    """
+
+    _arrays = ("model_ids", "offsets", "probe_ids", "unique_probe_ids")
+
+    def __init__(self, filename, arrays=None):
+        if arrays is None:
+            arrays = self._read(filename)
+        for name in self._arrays:
+            setattr(self, name, arrays[name])
+
+    def _read(self, filename):
+        """Reads the match file and returns the dictionary of arrays"""
+        pairs = _read_pairs(filename)
+        models = pairs[:, 0]
+        # sort by model id, only if required, keeping the order of the probes
+        if numpy.any(models[1:] < models[:-1]):
+            order = numpy.argsort(models, kind="mergesort")
+            models, probe_ids = models[order], pairs[order, 1]
+        else:
+            probe_ids = numpy.ascontiguousarray(pairs[:, 1])
+        model_ids, starts = numpy.unique(models, return_index=True)
+        return dict(
+            model_ids=model_ids,
+            offsets=numpy.append(starts, len(models)).astype(numpy.int64),
+            probe_ids=probe_ids,
+            unique_probe_ids=numpy.unique(probe_ids),
+        )
+
+    def _index(self, model_id):
+        index = numpy.searchsorted(self.model_ids, model_id)
+        if index < len(self.model_ids) and self.model_ids[index] == model_id:
+            return index
+        return None
+
+    def __getitem__(self, model_id):
+        """Returns the probe ids for the given model id as a :py:class:`numpy.ndarray` view"""
+        index = self._index(model_id)
+        if index is None:
+            raise KeyError(model_id)
+        return self.probe_ids[self.offsets[index]:self.offsets[index + 1]]
+
+    def __contains__(self, model_id):
+        return self._index(model_id) is not None
+
+    def __iter__(self):
+        return iter(self.model_ids.tolist())
+
+    def __len__(self):
+        return len(self.model_ids)
+
+    def iter_pairs(self, chunk_size=1000000):
+        """Yields all (model id, probe id) pairs as two :py:class:`numpy.ndarray`'s of at most ``chunk_size`` elements"""
+        for start in range(0, len(self.probe_ids), chunk_size):
+            end = min(start + chunk_size, len(self.probe_ids))
+            # the models that have probes in the current chunk
+            first = numpy.searchsorted(self.offsets, start, side="right") - 1
+            last = numpy.searchsorted(self.offsets, end, side="left")
+            counts = numpy.diff(numpy.clip(self.offsets[first:last + 1], start, end))
+            yield numpy.repeat(self.model_ids[first:last], counts), self.probe_ids[start:end]
+
+
+class DetectionList(Mapping):
+    """Read-only dictionary of the ground-truth face bounding boxes of each image of a face detection protocol file, stored in compressed sparse row format.
+
+    The columns are identified by the ``FILENAME``, ``FACE_X``, ``FACE_Y``, ``FACE_WIDTH`` and ``FACE_HEIGHT`` entries of the header, or taken from the first five columns otherwise.
+    Files that contain only file names list images without faces; rows without bounding box are kept as images without faces, too.
+
+    **Attributes:**
+
+    images : :py:class:`numpy.ndarray` (str)
+      The sorted list of unique image file names
+
+    offsets : :py:class:`numpy.ndarray` (int64)
+      The boxes of ``images[i]`` are stored in ``boxes[offsets[i]:offsets[i+1]]``
+
+    boxes : :py:class:`numpy.ndarray` (float, N x 4)
+      The bounding boxes of all images in the order ``FACE_X, FACE_Y, FACE_WIDTH, FACE_HEIGHT``
+    """
+
+    _arrays = ("images", "offsets", "boxes")
+    _columns = ("FILENAME", "FACE_X", "FACE_Y", "FACE_WIDTH", "FACE_HEIGHT")
+
+    def __init__(self, filename, arrays=None):
+        if arrays is None:
+            arrays = self._read(filename)
+        for name in self._arrays:
+            setattr(self, name, arrays[name])
+
+    def _read(self, filename):
+        """Reads the detection file and returns the dictionary of arrays"""
+        with open(filename) as f:
+            header = [column.strip().upper() for column in f.readline().split(",")]
+        columns = [header.index(c) for c in self._columns if c in header]
+        if len(columns) not in (1, 5):
+            columns = list(range(min(len(header), 5)))
+        names = _read_columns(filename, (columns[0],), str)
+        if len(columns) == 5:
+            boxes = _read_columns(filename, tuple(columns[1:]), numpy.float64).reshape(-1, 4)
+        else:
+            boxes = numpy.full((len(names), 4), numpy.nan)
+        return self.create(names, boxes)
+
+    @staticmethod
+    def create(names, boxes):
+        """Groups the given bounding boxes by image and returns the dictionary of arrays; boxes containing ``NaN`` are removed"""
+        images, index = numpy.unique(numpy.asarray(names), return_inverse=True)
+        index = index.ravel()
+        valid = ~numpy.any(numpy.isnan(boxes), axis=1)
+        order = numpy.argsort(index[valid], kind="mergesort")
+        return dict(
+            images=images,
+            offsets=numpy.append(0, numpy.cumsum(numpy.bincount(index[valid], minlength=len(images)))).astype(numpy.int64),
+            boxes=numpy.ascontiguousarray(boxes[valid][order], numpy.float64),
+        )
+
+    @staticmethod
+    def merge(lists):
+        """Returns a :py:class:`DetectionList` containing the images and boxes of all given lists"""
+        names = numpy.concatenate([numpy.repeat(l.images, numpy.diff(l.offsets)) for l in lists] + [l.images for l in lists])
+        boxes = numpy.concatenate([l.boxes for l in lists] + [numpy.full((len(l.images), 4), numpy.nan) for l in lists])
+        return DetectionList(None, DetectionList.create(names, boxes))
+
+    def _index(self, image):
+        index = numpy.searchsorted(self.images, image)
+        if index < len(self.images) and self.images[index] == image:
+            return index
+        return None
+
+    def __getitem__(self, image):
+        """Returns the bounding boxes of the given image as a :py:class:`numpy.ndarray` view"""
+        index = self._index(image)
+        if index is None:
+            raise KeyError(image)
+        return self.boxes[self.offsets[index]:self.offsets[index + 1]]
+
+    def __contains__(self, image):
+        return self._index(image) is not None
+
+    def __iter__(self):
+        return iter(self.images.tolist())
+
+    def __len__(self):
+        return len(self.images)
+
+
+class DirectoryIndex:
+    """Caches the contents of directories to check the existence of many files without calling :py:func:`os.stat` for each.
+
+    Directories are listed on first request, using a pool of ``parallel`` threads.
+    Changes of the directory contents after they have been listed are not detected.
+    """
+
+    def __init__(self, parallel=16):
+        self.parallel = parallel
+        self._listings = {}
+
+    def _list(self, directory):
+        try:
+            return directory, frozenset(os.listdir(directory or os.curdir))
+        except OSError:
+            return directory, frozenset()
+
+    def exist(self, paths):
+        """Returns a boolean :py:class:`numpy.ndarray` that indicates, which of the given paths exist"""
+        splits = [os.path.split(path) for path in paths]
+        missing = set(directory for directory, _ in splits) - set(self._listings)
+        if missing:
+            from multiprocessing.pool import ThreadPool
+            pool = ThreadPool(self.parallel)
+            try:
+                self._listings.update(pool.imap_unordered(self._list, missing))
+            finally:
+                pool.close()
+                pool.join()
+        return numpy.array([name in self._listings[directory] for directory, name in splits], bool)
+
+
+class GroupIndex:
+    """Inverted index, which maps each key to the sorted unique :py:class:`numpy.ndarray` of values that appear together with this key"""
+
+    def __init__(self, keys, values):
+        order = numpy.lexsort((values, keys))
+        keys, values = keys[order], values[order]
+        # remove duplicate pairs
+        unique = numpy.ones(len(keys), bool)
+        unique[1:] = (keys[1:] != keys[:-1]) | (values[1:] != values[:-1])
+        keys, self.values = keys[unique], values[unique]
+        self.keys, starts = numpy.unique(keys, return_index=True)
+        ranges = zip(starts.tolist(), numpy.append(starts[1:], len(keys)).tolist())
+        self._ranges = dict(zip(self.keys.tolist(), ranges))
+
+    def __getitem__(self, key):
+        """Returns the values for the given key, which are empty if the key is unknown"""
+        start, end = self._ranges.get(key, (0, 0))
+        return self.values[start:end]
+
+    def lookup(self, keys):
+        """Returns the list of values for each of the given keys"""
+        return [self[key] for key in keys]
+
+
+class FrameIndex:
+    """Index from templates to their media (images or videos), and from each media to the metadata rows of its files, sorted by frame number.
+
+    Both levels are stored in compressed sparse row format, and the frames of a media can be subsampled for many templates at once with :py:meth:`select`.
+
+    **Attributes:**
+
+    template_ids : :py:class:`numpy.ndarray` (int)
+      The sorted ids of the templates
+
+    media_offsets : :py:class:`numpy.ndarray` (int64)
+      The media of ``template_ids[i]`` are ``media[media_offsets[i]:media_offsets[i+1]]``
+
+    media : :py:class:`numpy.ndarray` (int64)
+      The media index of each media of each template, see :py:meth:`Protocol.media_index`
+
+    row_offsets : :py:class:`numpy.ndarray` (int64)
+      The files of the ``j``'th media are ``rows[row_offsets[j]:row_offsets[j+1]]``
+
+    rows : :py:class:`numpy.ndarray` (int)
+      The metadata rows of the files, sorted by frame number within each media
+
+    quality : :py:class:`numpy.ndarray` (float)
+      The quality of each file in ``rows``, where smaller values are better
+    """
+
+    selections = ("uniform", "quality")
+
+    def __init__(self, template_ids, template_index, rows, media, frames, quality):
+        # sort the files by template, media and frame number; images without frame number have a single file per media
+        order = numpy.lexsort((rows, frames, media, template_index))
+        template_index, media, self.rows, self.quality = template_index[order], media[order], rows[order], quality[order]
+        starts = numpy.flatnonzero(numpy.concatenate(([True], (template_index[1:] != template_index[:-1]) | (media[1:] != media[:-1])))) if len(order) else numpy.zeros(0, numpy.int64)
+        self.template_ids = template_ids
+        self.media = media[starts].astype(numpy.int64)
+        self.row_offsets = numpy.append(starts, len(order)).astype(numpy.int64)
+        self.media_offsets = numpy.append(0, numpy.cumsum(numpy.bincount(template_index[starts], minlength=len(template_ids)))).astype(numpy.int64)
+
+    def select(self, template_ids, stride=1, max_frames=None, selection="uniform"):
+        """Subsamples the frames of each media of the given templates.
+
+        First, every ``stride``'th frame of each media is kept.
+        Then, at most ``max_frames`` of the remaining frames of each media are kept, either evenly spaced (``selection='uniform'``) or those with the smallest :py:attr:`quality` (``selection='quality'``), in the order of their frame numbers.
+        Still images are media with a single file, which are always kept.
+
+        Returns the offsets and the metadata rows of the kept files in compressed sparse row format: the files of ``template_ids[i]`` are ``rows[offsets[i]:offsets[i+1]]``.
+        """
+        if selection not in self.selections:
+            raise ValueError("The frame selection '%s' is not one of %s" % (selection, self.selections))
+        if stride < 1 or (max_frames is not None and max_frames < 1):
+            raise ValueError("The frame stride %d and the maximum number of frames %s must be positive" % (stride, max_frames))
+        index = numpy.searchsorted(self.template_ids, template_ids)
+        groups = _ranges(self.media_offsets[index], self.media_offsets[index + 1])
+        group_templates = numpy.repeat(numpy.arange(len(index)), self.media_offsets[index + 1] - self.media_offsets[index])
+        starts, ends = self.row_offsets[groups], self.row_offsets[groups + 1]
+        positions = _ranges(starts, ends)
+        group_index = numpy.repeat(numpy.arange(len(groups)), ends - starts)
+        # the position of each frame within its media
+        frame = positions - numpy.repeat(starts, ends - starts)
+
+        keep = frame % stride == 0
+        positions, group_index, frame = positions[keep], group_index[keep], frame[keep] // stride
+        if max_frames is not None:
+            counts = numpy.bincount(group_index, minlength=len(groups))
+            if selection == "uniform":
+                # the frames at the evenly spaced positions floor(i * count / max_frames) of each media
+                longer = counts > max_frames
+                kept = numpy.ones(len(positions), bool)
+                kept[longer[group_index]] = False
+                first = numpy.append(0, numpy.cumsum(counts))[:-1][longer]
+                steps = numpy.tile(numpy.arange(max_frames), numpy.count_nonzero(longer))
+                kept[numpy.repeat(first, max_frames) + steps * numpy.repeat(counts[longer], max_frames) // max_frames] = True
+            else:
+                # the rank of each frame by quality within its media
+                order = numpy.lexsort((frame, self.quality[positions], group_index))
+                rank = numpy.empty(len(order), numpy.int64)
+                rank[order] = numpy.arange(len(order)) - numpy.repeat(numpy.append(0, numpy.cumsum(counts))[:-1], counts)
+                kept = rank < max_frames
+            positions, group_index = positions[kept], group_index[kept]
+
+        offsets = numpy.append(0, numpy.cumsum(numpy.bincount(group_templates[group_index], minlength=len(index)))).astype(numpy.int64)
+        return offsets, self.rows[positions]
+
+
+class PathIndex(Mapping):
+    """Read-only dictionary from the unique physical files, given by their original file names (paths with extension), to the :py:attr:`File.id`'s of all :py:class:`File`'s that share this file.
+
+    As the :py:attr:`File.id` contains the subject id, the same image or frame can be listed under several ids, i.e., when it shows several subjects.
+    The files are stored in compressed sparse row format over the sorted metadata rows.
+
+    **Attributes:**
+
+    paths : :py:class:`numpy.ndarray` (str)
+      The sorted original file names of the unique physical files
+
+    offsets : :py:class:`numpy.ndarray` (int64)
+      The metadata rows of ``paths[i]`` are ``rows[offsets[i]:offsets[i+1]]``
+
+    rows : :py:class:`numpy.ndarray` (int)
+      The sorted metadata rows of all files
+    """
+
+    def __init__(self, metadata, rows):
+        self._metadata = metadata
+        self.rows = numpy.asarray(rows)
+        # the metadata rows are sorted by path, so that the files of each path are contiguous
+        path_index = metadata.path_index[self.rows]
+        starts = numpy.flatnonzero(numpy.concatenate(([True], path_index[1:] != path_index[:-1]))) if len(self.rows) else numpy.zeros(0, numpy.int64)
+        self.offsets = numpy.append(starts, len(self.rows)).astype(numpy.int64)
+        self.paths = numpy.array(metadata.file_names(self.rows[starts]), dtype=str)
+
+    def _index(self, path):
+        index = numpy.searchsorted(self.paths, path)
+        if index < len(self.paths) and self.paths[index] == path:
+            return index
+        return None
+
+    def files(self, index):
+        """Returns the :py:class:`File`'s of the ``index``'th path"""
+        return [self._metadata.file(row) for row in self.rows[self.offsets[index]:self.offsets[index + 1]].tolist()]
+
+    def positions(self, files):
+        """Returns the index into :py:attr:`paths` for each of the given :py:class:`File`'s or :py:attr:`File.id`'s as a :py:class:`numpy.ndarray`.
+
+        Raises a :py:exc:`ValueError` if one of the files is not part of this index."""
+        file_ids = [f if isinstance(f, six.string_types) else f.id for f in files]
+        rows = self._metadata.rows_from_ids(file_ids)
+        index = numpy.minimum(numpy.searchsorted(self.rows, rows), max(len(self.rows) - 1, 0))
+        missing = self.rows[index] != rows if len(self.rows) else numpy.ones(len(rows), bool)
+        if numpy.any(missing):
+            raise ValueError("The file id '%s' is not part of the requested protocols" % file_ids[numpy.flatnonzero(missing)[0]])
+        return numpy.searchsorted(self.offsets, index, side="right") - 1
+
+    def __getitem__(self, path):
+        """Returns the :py:attr:`File.id`'s of the given original file name"""
+        index = self._index(path)
+        if index is None:
+            raise KeyError(path)
+        return [f.id for f in self.files(index)]
+
+    def __contains__(self, path):
+        return self._index(path) is not None
+
+    def __iter__(self):
+        return iter(self.paths.tolist())
+
+    def __len__(self):
+        return len(self.paths)
+
+
+class Shard:
+    """A part of the comparisons of a protocol, as returned by :py:meth:`Protocol.shard`.
+
+    **Attributes:**
+
+    protocol : str
+      The protocol that this shard is part of
+
+    index, count : int
+      The index of this shard, and the total number of shards
+
+    model_ids, probe_ids : :py:class:`numpy.ndarray` (int)
+      The sorted unique ids of the enrollment and probe templates required in this shard
+
+    comparisons : int
+      The number of comparisons in this shard
+    """
+
+    def __init__(self, protocol, index, count, model_ids, probe_ids, comparisons, enroll_rows, probe_rows, metadata):
+        self.protocol = protocol
+        self.index = index
+        self.count = count
+        self.model_ids = model_ids
+        self.probe_ids = probe_ids
+        self.comparisons = comparisons
+        self._rows = {"enroll": enroll_rows, "probe": probe_rows}
+        self._metadata = metadata
+
+    def files(self, purposes=("enroll", "probe")):
+        """Returns the sorted list of unique :py:class:`File`'s that are required for the given purposes in this shard"""
+        if isinstance(purposes, six.string_types):
+            purposes = (purposes,)
+        rows = numpy.unique(numpy.concatenate([self._rows[purpose] for purpose in purposes]))
+        return [self._metadata.file(row) for row in rows.tolist()]
+
+
 class Protocol:
-    """The list of protocols and their according files"""
+    """The list of protocols and their according files.
+
+    Protocol files that have been compiled into the :py:attr:`cache` are memory-mapped with the given ``mmap_mode``; use ``None`` to load them into memory instead.
+    """
 
-    def __init__(self):
-        self.base_directory = pkg_resources.resource_filename(__name__, "protocol")
+    # the protocol files that are read, indexed by the name of the template or match list
+    metadata_file = "ijbc_metadata.csv"
+    template_files = {
+        "G1": "ijbc_1N_gallery_G1.csv",
+        "G2": "ijbc_1N_gallery_G2.csv",
+        "Mixed": "ijbc_1N_probe_mixed.csv",
+        "Image": "ijbc_1N_probe_img.csv",
+        "Video": "ijbc_1N_probe_video.csv",
+        "Covariates": "ijbc_11_covariate_probe_reference.csv",
+    }
+    match_files = {
+        "1:1": "ijbc_11_G1_G2_matches.csv",
+        "Covariates": "ijbc_11_covariate_matches.csv",
+    }
+    # the face detection protocols, and the files that define their images and ground-truth bounding boxes
+    detection_files = {
+        "detection": ("ijbc_face_detection.csv", "ijbc_face_detection_ground_truth.csv"),
+        "wild9": ("ijbc_wild_test9.csv",),
+        "wild10": ("ijbc_wild_test10.csv",),
+        "wild11": ("ijbc_wild_test11.csv",),
+    }
+
+    def __init__(self, base_directory=None, mmap_mode="r"):
+        self.base_directory = base_directory or pkg_resources.resource_filename(__name__, "protocol")
         if not os.path.isdir(self.base_directory):
             raise IOError(
                 "The protocol directory %s cannot be found? Did you forget to download the protocol files with 'bob_dbmanage.py ijbc download'?" % self.base_directory)
-        self._files = {}
+        self.cache = ProtocolCache(os.path.join(self.base_directory, "cache"), mmap_mode)
+        self._metadata = None
         self._templates = {}
         self._matches = {}
         self._covariates = {}
+        self._indexes = {}
+        self._detections = {}
 
         self.protocol_names = [
-            "1:1", "Covariates"
+            "1:1", "Covariates",
+            "1:N-G1-Image", "1:N-G2-Image", "1:N-Image",
+            "1:N-G1-Mixed", "1:N-G2-Mixed", "1:N-Mixed",
+            "1:N-G1-Video", "1:N-G2-Video", "1:N-Video"
         ]
-        # TODO: Take care of other protocols
-        #self.protocol_names = [
-        #    "1:1", "Covariates",
-        #    "1:N-G1-Image", "1:N-G2-Image", "1:N-Image",
-        #    "1:N-G1-Mixed", "1:N-G2-Mixed", "1:N-Mixed",
-        #    "1:N-G1-Video", "1:N-G2-Video", "1:N-Video"
-        #]
 
         self.purpose_names = ["enroll", "probe"]
 
+    def _sources(self, protocol_file):
+        """Returns the name of the cache entry and the list of source files for the given protocol file"""
+        sources = [protocol_file]
+        # template lists refer to the rows of the metadata
+        if protocol_file in self.template_files.values():
+            sources.append(self.metadata_file)
+        return os.path.splitext(protocol_file)[0], [os.path.join(self.base_directory, f) for f in sources]
+
+    def _load_cached(self, protocol_file):
+        """Returns the cached arrays of the given protocol file, or ``None`` if they are not cached or outdated"""
+        return self.cache.load(*self._sources(protocol_file))
+
     def _read_metadata(self):
         """Reads the meta-data file if not yet done"""
-        if not self._files:
-            with open(os.path.join(self.base_directory, "ijbc_metadata.csv")) as p:
-                reader = csv.reader(p)
-                # skip header row
-                six.next(reader)
-                for splits in reader:
-                    # generate annotations
-                    annots = [float(a) for a in splits[3:]]
-                    annotation = None if numpy.all(numpy.isnan(annots)) else Annotation(annots)
-
-                    # create file
-                    subject_id = None if numpy.isnan(float(splits[0])) else int(splits[0])
-                    file = File(subject_id, splits[1], annotation)
-                    if file.id in self._files:
-                        #logger.debug("Found duplicate entry for file %s with ID %d", file.path, file.client_id)
-                        x = 0
-                    else:
-                        self._files[file.id] = file
-
-    def _read_template_list(self, which, protocol_file):
-        if which not in self._templates:
-            templates = self._templates[which] = {}
-            with open(os.path.join(self.base_directory, protocol_file)) as p:
-                reader = csv.reader(p)
-                # skip header row
-                six.next(reader)
-                for splits in reader:
-                    # generate file id
-                    subject_id = None if numpy.isnan(float(splits[1])) else int(splits[1])
-                    file_id = File.make_id(os.path.splitext(splits[2])[0], subject_id)
-
-                    # make sure we know that file already
-                    assert file_id in self._files
-
-                    # add it to the template, or create it if not done yet
-                    template_id = int(splits[0])
-                    if template_id not in templates:
-                        templates[template_id] = Template(template_id, subject_id)
-                    templates[template_id].files.append(self._files[file_id])
-
-                    # TODO: check that the annotations match
+        if self._metadata is None:
+            self._metadata = Metadata(os.path.join(self.base_directory, self.metadata_file), self._load_cached(self.metadata_file))
+        return self._metadata
 
+    def _read_template_list(self, which):
+        if which not in self._templates:
+            protocol_file = self.template_files[which]
+            self._templates[which] = TemplateList(os.path.join(self.base_directory, protocol_file), self._read_metadata, self._load_cached(protocol_file))
         return self._templates[which]
 
-    def _read_match_file(self, protocol, protocol_file):
+    def _read_match_file(self, protocol):
         if protocol not in self._matches:
-            # assure that the probe is loaded
-            if protocol == "1:1":
-                self.get_templates(protocol, "probe")
-
-            # read match files
-            match_file = os.path.join(self.base_directory, protocol_file)
-            matches = self._matches[protocol] = {}
-
-            with open(match_file) as f:
-                # read the rest of the lines
-                reader = csv.reader(f)
-                for splits in reader:
-                    # extract basic information of the file
-                    assert len(splits) == 2
-                    model_id = int(splits[0])
-                    probe_id = int(splits[1])
-                    if model_id not in matches:
-                        matches[model_id] = []
-                    matches[model_id].append(probe_id)
+            # read match file
+            protocol_file = self.match_files[protocol]
+            self._matches[protocol] = MatchList(os.path.join(self.base_directory, protocol_file), self._load_cached(protocol_file))
 
         return self._matches[protocol]
 
+    def _read_detection_list(self, protocol):
+        """Returns the :py:class:`DetectionList` of the given detection protocol, merged from all its files"""
+        if protocol not in self._detections:
+            lists = []
+            for protocol_file in self.detection_files[protocol]:
+                lists.append(DetectionList(os.path.join(self.base_directory, protocol_file), self._load_cached(protocol_file)))
+            self._detections[protocol] = lists[0] if len(lists) == 1 else DetectionList.merge(lists)
+        return self._detections[protocol]
+
+    def compile(self, recreate=False):
+        """Parses the available protocol files and stores them in the binary :py:attr:`cache`.
+
+        Only outdated cache entries are written, unless ``recreate`` is set.
+        Returns the list of protocol files that have been written to the cache.
+        """
+        written = []
+        detection_files = sorted(set(f for files in self.detection_files.values() for f in files))
+        protocol_files = [self.metadata_file] + sorted(self.template_files.values()) + sorted(self.match_files.values()) + detection_files
+        for protocol_file in protocol_files:
+            filename = os.path.join(self.base_directory, protocol_file)
+            if not os.path.exists(filename):
+                logger.info("Skipping non-existing protocol file '%s'", filename)
+                continue
+            name, sources = self._sources(protocol_file)
+            if not recreate and self.cache.is_current(name, sources):
+                logger.info("The protocol cache of '%s' is up-to-date", protocol_file)
+                continue
+
+            logger.info("Compiling protocol file '%s'", filename)
+            if protocol_file == self.metadata_file:
+                # replace the metadata, so that the template lists refer to the new version
+                self._metadata = compiled = Metadata(filename)
+                self._templates, self._matches, self._covariates, self._indexes = {}, {}, {}, {}
+            elif protocol_file in self.template_files.values():
+                compiled = TemplateList(filename, self._read_metadata)
+            elif protocol_file in detection_files:
+                compiled = DetectionList(filename)
+                self._detections = {}
+            else:
+                compiled = MatchList(filename)
+            self.cache.save(name, sources, {array: getattr(compiled, array) for array in compiled._arrays})
+            written.append(protocol_file)
+        return written
+
+    def iter_pairs(self, protocol, chunk_size=1000000):
+        """Yields the model and probe template ids of all comparisons of the given protocol in chunks, see :py:meth:`MatchList.iter_pairs`"""
+        if protocol not in self.match_files:
+            raise ValueError("The protocol '%s' does not define a match list" % protocol)
+        return self._read_match_file(protocol).iter_pairs(chunk_size)
+
+    def _enroll_lists(self, protocol):
+        """Returns the :py:class:`TemplateList`'s that contain the enrollment templates of the given protocol"""
+        if protocol == "Covariates":
+            return [self._read_template_list("Covariates")]
+        lists = []
+        if "G2" not in protocol: lists.append(self._read_template_list("G1"))
+        if "G1" not in protocol: lists.append(self._read_template_list("G2"))
+        return lists
+
+    def model_ids(self, protocol):
+        """Returns the sorted ids of the enrollment templates of the given protocol as a :py:class:`numpy.ndarray`"""
+        if protocol == "Covariates":
+            return self._read_match_file("Covariates").model_ids
+        key = ("models", protocol)
+        if key not in self._indexes:
+            self._indexes[key] = numpy.unique(numpy.concatenate([templates.template_ids for templates in self._enroll_lists(protocol)]))
+        return self._indexes[key]
+
+    def _purpose_lists(self, protocol, purpose):
+        """Returns the :py:class:`TemplateList`'s together with the ids of their templates that are used for the given protocol and purpose"""
+        if purpose == "enroll":
+            model_ids = self.model_ids(protocol)
+            return [(templates, model_ids[numpy.isin(model_ids, templates.template_ids)]) for templates in self._enroll_lists(protocol)]
+        templates = self.get_templates(protocol, "probe")
+        if isinstance(templates, TemplateView):
+            return [(templates.templates, templates.template_ids)]
+        return [(templates, templates.template_ids)]
+
+    def client_index(self, protocol, purpose):
+        """Returns the :py:class:`GroupIndex` from subject ids to the template ids of the given protocol and purpose"""
+        key = ("client", protocol, purpose)
+        if key not in self._indexes:
+            template_ids, subject_ids = [], []
+            for templates, ids in self._purpose_lists(protocol, purpose):
+                template_ids.append(ids)
+                subject_ids.append(templates.subject_ids[numpy.searchsorted(templates.template_ids, ids)])
+            self._indexes[key] = GroupIndex(numpy.concatenate(subject_ids), numpy.concatenate(template_ids))
+        return self._indexes[key]
+
+    def template_subjects(self, protocol, purpose):
+        """Returns the sorted ids of the templates of the given protocol and purpose, and the according subject ids, as two :py:class:`numpy.ndarray`'s"""
+        key = ("subjects", protocol, purpose)
+        if key not in self._indexes:
+            template_ids, subject_ids = [], []
+            for templates, ids in self._purpose_lists(protocol, purpose):
+                template_ids.append(ids)
+                subject_ids.append(templates.subject_ids[numpy.searchsorted(templates.template_ids, ids)])
+            template_ids = numpy.concatenate(template_ids)
+            order = numpy.argsort(template_ids, kind="mergesort")
+            self._indexes[key] = (template_ids[order], numpy.concatenate(subject_ids)[order])
+        return self._indexes[key]
+
+    def template_covariates(self, protocol, purpose):
+        """Returns the covariates of the templates of the given protocol and purpose.
+
+        The covariates of each template are the averages over its files, ignoring missing values; for the single-image templates of the ``Covariates`` protocol, these are the covariates of the image.
+        The covariates are given in the order of :py:attr:`Metadata.covariate_names`, followed by the number of occluded regions.
+
+        Returns the sorted template ids as a :py:class:`numpy.ndarray`, and a 2D :py:class:`numpy.ndarray` with one row of covariates per template, which contains ``NaN`` where no file of the template is annotated.
+        """
+        key = ("covariates", protocol, purpose)
+        if key not in self._indexes:
+            metadata = self._read_metadata()
+            template_ids, covariates = [], []
+            for templates, ids in self._purpose_lists(protocol, purpose):
+                index = numpy.searchsorted(templates.template_ids, ids)
+                starts, ends = templates.offsets[index], templates.offsets[index + 1]
+                rows = templates.file_rows[_ranges(starts, ends)]
+                values = numpy.column_stack((metadata.covariates[rows], numpy.sum(metadata.occlusion[rows], axis=1)))
+                values[~metadata.has_annotation[rows]] = numpy.nan
+                # average the annotated values of the files of each template
+                valid = ~numpy.isnan(values)
+                segments = numpy.repeat(numpy.arange(len(ids)), ends - starts)
+                sums = numpy.zeros((len(ids), values.shape[1]))
+                counts = numpy.zeros((len(ids), values.shape[1]))
+                numpy.add.at(sums, segments, numpy.where(valid, values, 0))
+                numpy.add.at(counts, segments, valid)
+                template_ids.append(ids)
+                with numpy.errstate(invalid="ignore"):
+                    covariates.append(sums / counts)
+            template_ids = numpy.concatenate(template_ids)
+            order = numpy.argsort(template_ids, kind="mergesort")
+            self._indexes[key] = (template_ids[order], numpy.concatenate(covariates)[order])
+        return self._indexes[key]
+
+    def file_index(self, protocol, purpose):
+        """Returns the :py:class:`GroupIndex` from metadata rows to the ids of the templates of the given protocol and purpose that contain this file"""
+        key = ("file", protocol, purpose)
+        if key not in self._indexes:
+            template_ids, rows = [], []
+            for templates, ids in self._purpose_lists(protocol, purpose):
+                all_ids = numpy.repeat(templates.template_ids, numpy.diff(templates.offsets))
+                used = numpy.isin(all_ids, ids)
+                template_ids.append(all_ids[used])
+                rows.append(templates.file_rows[used])
+            self._indexes[key] = GroupIndex(numpy.concatenate(rows), numpy.concatenate(template_ids))
+        return self._indexes[key]
+
+    def frame_index(self, protocol, purpose):
+        """Returns the :py:class:`FrameIndex` from the templates of the given protocol and purpose to their media and their frames.
+
+        The quality of a file is the sum of its absolute yaw and roll angles; files without pose annotation have the lowest quality.
+        """
+        key = ("frames", protocol, purpose)
+        if key not in self._indexes:
+            metadata = self._read_metadata()
+            template_ids, template_index, rows, offset = [], [], [], 0
+            for templates, ids in self._purpose_lists(protocol, purpose):
+                index = numpy.searchsorted(templates.template_ids, ids)
+                starts, ends = templates.offsets[index], templates.offsets[index + 1]
+                rows.append(templates.file_rows[_ranges(starts, ends)])
+                template_index.append(numpy.repeat(numpy.arange(len(ids)) + offset, ends - starts))
+                template_ids.append(ids)
+                offset += len(ids)
+            template_ids, template_index, rows = numpy.concatenate(template_ids), numpy.concatenate(template_index), numpy.concatenate(rows)
+            # enumerate the templates in sorted order
+            order = numpy.argsort(template_ids, kind="mergesort")
+            rank = numpy.empty(len(order), numpy.int64)
+            rank[order] = numpy.arange(len(order))
+            pose = metadata.covariates[rows][:, [metadata.covariate_names.index("yaw"), metadata.covariate_names.index("roll")]]
+            quality = numpy.abs(pose).sum(axis=1)
+            quality[numpy.isnan(quality) | ~metadata.has_annotation[rows]] = numpy.inf
+            self._indexes[key] = FrameIndex(template_ids[order], rank[template_index], rows, self.media_index()[rows], metadata.frame[rows], quality)
+        return self._indexes[key]
+
+    def media_index(self):
+        """Returns the index of the media (image or video) of each row of the metadata as a :py:class:`numpy.ndarray`.
+
+        Each still image is its own media, while the frames of a video share the same media.
+        The video of a frame is derived from its path: frames named ``<directory>/<video>_<frame>`` belong to the video ``<directory>/<video>``.
+        Frames without a ``_`` in their name are assigned to a single media per directory.
+        Frames are identified by their :py:attr:`Annotation.frame` number.
+        """
+        if "media" not in self._indexes:
+            metadata = self._read_metadata()
+            videos = []
+            for path in metadata.paths.tolist():
+                directory, name = os.path.split(path)
+                video, separator, _ = name.rpartition("_")
+                videos.append(os.path.join(directory, video) if separator else directory)
+            video_index = numpy.unique(videos, return_inverse=True)[1].ravel() if videos else numpy.zeros(0, numpy.int64)
+            # images are indexed by their path, videos after all paths
+            is_frame = ~numpy.isnan(metadata.frame)
+            self._indexes["media"] = numpy.where(is_frame, len(metadata.paths) + video_index[metadata.path_index], metadata.path_index).astype(numpy.int64)
+        return self._indexes["media"]
+
+    def client_ids(self, protocol):
+        """Returns the sorted unique subject ids of the enrollment templates of the given protocol as a :py:class:`numpy.ndarray`"""
+        return self.client_index(protocol, "enroll").keys
+
+    def shard(self, protocol, count, index):
+        """Returns the ``index``'th of ``count`` :py:class:`Shard`'s of the comparisons of the given protocol.
+
+        The models are split into contiguous blocks of model ids, such that the number of comparisons in each shard is as balanced as possible.
+        The assignment is deterministic, i.e., it only depends on the match list of the protocol.
+        """
+        if not 0 <= index < count:
+            raise ValueError("The shard index %d is not in the range [0, %d)" % (index, count))
+        if protocol not in self.match_files:
+            raise ValueError("The protocol '%s' does not define a match list" % protocol)
+        matches = self._read_match_file(protocol)
+
+        # find the model boundaries that are closest to the equally-spaced number of comparisons
+        targets = numpy.arange(count + 1) * (len(matches.probe_ids) / float(count))
+        right = numpy.clip(numpy.searchsorted(matches.offsets, targets), 1, len(matches.offsets) - 1)
+        boundaries = numpy.where(targets - matches.offsets[right - 1] < matches.offsets[right] - targets, right - 1, right)
+        boundaries[0], boundaries[-1] = 0, len(matches.model_ids)
+        first, last = boundaries[index], boundaries[index + 1]
+
+        model_ids = numpy.asarray(matches.model_ids[first:last])
+        probe_ids = numpy.unique(matches.probe_ids[matches.offsets[first]:matches.offsets[last]])
+        enroll_rows = numpy.unique(numpy.concatenate([
+            templates.rows(model_ids[numpy.isin(model_ids, templates.template_ids)]) for templates in self._enroll_lists(protocol)]))
+        probe_rows = self.get_templates(protocol, "probe").rows(probe_ids)
+        return Shard(protocol, index, count, model_ids, probe_ids, int(matches.offsets[last] - matches.offsets[first]), enroll_rows, probe_rows, self._read_metadata())
+
     def get_templates(self, protocol, purpose=None):
         """Returns all :py:class:`Template`'s for the given protocol and purpose."""
         assert protocol in self.protocol_names
         assert purpose in self.purpose_names
-        # read metadata if not done yet
-        self._read_metadata()
 
         if protocol == "Covariates":
             # for the covariates, we do not use the default gallery
             if not self._covariates:
                 # first, read all templates
-                self._read_template_list("Covariates", "ijbc_11_covariate_probe_reference.csv")
+                self._read_template_list("Covariates")
                 # and now split them into model and probe (overlapping)
-                matches = self._read_match_file("Covariates", "ijbc_11_covariate_matches.csv")
-                self._covariates["enroll"] = {x: self._templates["Covariates"][x] for x in matches}
-                self._covariates["probe"] = {x: self._templates["Covariates"][x] for x in
-                                             set(p for m in matches.keys() for p in matches[m])}
+                matches = self._read_match_file("Covariates")
+                self._covariates["enroll"] = TemplateView(self._templates["Covariates"], matches.model_ids)
+                self._covariates["probe"] = TemplateView(self._templates["Covariates"], matches.unique_probe_ids)
             return self._covariates[purpose]
 
         elif purpose == "enroll":
             # otherwise, we have the same templates for enrollment, throughout
-            if "S2" not in protocol: self._read_template_list("G1", "ijbc_1N_gallery_G1.csv")
-            if "S1" not in protocol: self._read_template_list("G2", "ijbc_1N_gallery_G2.csv")
+            if "G2" not in protocol: self._read_template_list("G1")
+            if "G1" not in protocol: self._read_template_list("G2")
 
-            if "S1" in protocol:
+            if "G1" in protocol:
                 return self._templates["G1"]
-            elif "S2" in protocol:
+            elif "G2" in protocol:
                 return self._templates["G2"]
             else:
-                if "S1S2" not in self._templates:
-                    self._templates["G1G2"] = self._templates["G1"].copy()
-                    self._templates["G1G2"].update(self._templates["G2"])
+                if "G1G2" not in self._templates:
+                    self._templates["G1G2"] = TemplateUnion([self._templates["G1"], self._templates["G2"]])
                 return self._templates["G1G2"]
 
         else:
             # probes for 1:N protocol
             if "Image" in protocol:
-                return self._read_template_list("Image", "ijbc_1N_probe_img.csv")
+                return self._read_template_list("Image")
             elif "Video" in protocol:
-                return self._read_template_list("Video", "ijbc_1N_probe_video.csv")
+                return self._read_template_list("Video")
             else:
                 # This file is used for both the 1:1 protocol (as probes) and the 1:N-Mixed protocols
-                return self._read_template_list("Mixed", "ijbc_1N_probe_mixed.csv")
+                return self._read_template_list("Mixed")
 
     def enroll_template(self, protocol, model_id):
         """Returns the enrollment template for the given model_id"""
@@ -299,11 +1339,11 @@ class Protocol:
     def probe_templates(self, protocol, model_id):
         """Returns the probe templates for the given model_id"""
         if protocol == "1:1":
-            matches = self._read_match_file("1:1", "ijbc_11_G1_G2_matches.csv")[model_id]
-            return [self._templates["Mixed"][m] for m in matches]
+            matches = self._read_match_file("1:1")[model_id]
+            return [self._read_template_list("Mixed")[m] for m in matches.tolist()]
         elif protocol == "Covariates":
-            matches = self._read_match_file("Covariates", "ijbc_11_covariate_matches.csv")[model_id]
-            return [self._templates["Covariates"][m] for m in matches]
+            matches = self._read_match_file("Covariates")[model_id]
+            return [self._read_template_list("Covariates")[m] for m in matches.tolist()]
         else:
             # for 1:N protocols, return all probe files
             return self.get_templates(protocol, "probe").values()
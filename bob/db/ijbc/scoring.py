@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Block-wise computation of the scores of all comparisons of an IJB-C protocol from template features
+"""
+
+import multiprocessing
+
+import numpy
+
+score_formats = ("4column", "5column", "binary")
+metrics = ("cosine", "euclidean")
+
+# the state of the worker processes, see :py:func:`_initialize`
+_scorer = None
+
+
+def _initialize(scorer):
+    global _scorer
+    _scorer = scorer
+
+
+def _score_block(block):
+    return _scorer.block(*block)
+
+
+class Scorer:
+    """Computes the scores of the comparisons of a match list.
+
+    The comparisons are processed in blocks of contiguous models.
+    If the comparisons of a block are dense enough, all scores between the models and the unique probes of the block are computed with a single matrix product; otherwise, the features of each comparison are gathered.
+
+    **Parameters:**
+
+    template_ids : :py:class:`numpy.ndarray` (int)
+      The sorted ids of the templates
+
+    template_features : :py:class:`numpy.ndarray` (N x D)
+      The features of the templates, one per row
+
+    matches : :py:class:`bob.db.ijbc.reader.MatchList`
+      The comparisons to compute
+
+    metric : str
+      One of :py:data:`metrics`; the Euclidean distance is negated, so that larger scores always mean more similar
+
+    model_subjects, probe_subjects : (:py:class:`numpy.ndarray`, :py:class:`numpy.ndarray`) or ``None``
+      The sorted template ids and the according subject ids of the models and the probes, required for text score files
+
+    dense_ratio : float
+      A block is computed with a matrix product when this requires at most this factor of the number of its comparisons; ``0`` always gathers the features of each comparison
+    """
+
+    def __init__(self, template_ids, template_features, matches, metric="cosine", model_subjects=None, probe_subjects=None, dense_ratio=4):
+        if metric not in metrics:
+            raise ValueError("The metric '%s' is not one of %s" % (metric, metrics))
+        self.template_ids = numpy.asarray(template_ids)
+        features = numpy.asarray(template_features)
+        if not numpy.issubdtype(features.dtype, numpy.floating):
+            features = features.astype(numpy.float64)
+        self.metric = metric
+        if metric == "cosine":
+            norms = numpy.sqrt(numpy.einsum("ij,ij->i", features, features))
+            features = features / numpy.where(norms > 0, norms, 1)[:, None]
+        else:
+            self.squared_norms = numpy.einsum("ij,ij->i", features, features)
+        self.features = features
+        self.model_ids, self.offsets, self.probe_ids = matches.model_ids, matches.offsets, matches.probe_ids
+        self.model_subjects, self.probe_subjects = model_subjects, probe_subjects
+        self.dense_ratio = dense_ratio
+        self.format = "binary"
+
+    def _rows(self, ids):
+        rows = numpy.searchsorted(self.template_ids, ids)
+        rows[rows == len(self.template_ids)] = 0
+        missing = self.template_ids[rows] != ids
+        if numpy.any(missing):
+            raise ValueError("No feature was given for template %d" % ids[missing][0])
+        return rows
+
+    def blocks(self, block_size):
+        """Returns the list of ``(first, last)`` model indexes of the blocks, each containing about ``block_size`` comparisons"""
+        boundaries = numpy.unique(numpy.append(numpy.searchsorted(self.offsets, numpy.arange(0, self.offsets[-1], max(block_size, 1)), side="right") - 1, len(self.model_ids)))
+        return list(zip(boundaries[:-1].tolist(), boundaries[1:].tolist()))
+
+    def scores(self, first, last):
+        """Computes the scores of all comparisons of the models ``first`` to ``last``, in the order of the match list"""
+        counts = numpy.diff(self.offsets[first:last + 1])
+        model_rows = self._rows(self.model_ids[first:last])
+        probe_rows = self._rows(self.probe_ids[self.offsets[first]:self.offsets[last]])
+        unique_rows, probe_index = numpy.unique(probe_rows, return_inverse=True)
+        model_index = numpy.repeat(numpy.arange(len(model_rows)), counts)
+
+        if len(model_rows) * len(unique_rows) <= self.dense_ratio * len(probe_rows):
+            # dense block: a single matrix product
+            products = numpy.dot(self.features[model_rows], self.features[unique_rows].T)[model_index, probe_index.ravel()]
+        else:
+            products = numpy.einsum("ij,ij->i", self.features[model_rows][model_index], self.features[probe_rows])
+
+        if self.metric == "cosine":
+            return products.astype(numpy.float32)
+        distances = self.squared_norms[model_rows][model_index] + self.squared_norms[probe_rows] - 2 * products
+        return -numpy.sqrt(numpy.maximum(distances, 0)).astype(numpy.float32)
+
+    def _subjects(self, subjects, ids):
+        return subjects[1][numpy.searchsorted(subjects[0], ids)]
+
+    def block(self, first, last):
+        """Computes the scores of the given block of models, and formats them according to :py:attr:`format`"""
+        scores = self.scores(first, last)
+        if self.format == "binary":
+            return scores
+        models = numpy.repeat(self.model_ids[first:last], numpy.diff(self.offsets[first:last + 1]))
+        probes = self.probe_ids[self.offsets[first]:self.offsets[last]]
+        columns = [self._subjects(self.model_subjects, models).tolist()]
+        if self.format == "5column":
+            columns.append(models.tolist())
+        columns.extend([self._subjects(self.probe_subjects, probes).tolist(), probes.tolist(), scores.tolist()])
+        line = " ".join(["%d"] * (len(columns) - 1) + ["%.8g"]) + "\n"
+        return "".join(line % values for values in zip(*columns))
+
+    def write(self, output, score_format="4column", parallel=1, block_size=1000000):
+        """Computes all scores and writes them to the given file.
+
+        The ``4column`` format contains the subject ids of model and probe, the probe template id and the score; the ``5column`` format additionally contains the model template id.
+        The ``binary`` format stores the ``float32`` scores as a ``.npy`` file, in the order of the match list.
+        The blocks are computed by ``parallel`` processes, and written in order.
+        """
+        if score_format not in score_formats:
+            raise ValueError("The score format '%s' is not one of %s" % (score_format, score_formats))
+        self.format = score_format
+        if score_format == "binary":
+            scores = numpy.lib.format.open_memmap(output, mode="w+", dtype=numpy.float32, shape=(int(self.offsets[-1]),))
+            for (first, last), block in zip(self.blocks(block_size), self._map(parallel, block_size)):
+                scores[self.offsets[first]:self.offsets[last]] = block
+            scores.flush()
+            del scores
+        else:
+            with open(output, "w") as f:
+                for block in self._map(parallel, block_size):
+                    f.write(block)
+        return int(self.offsets[-1])
+
+    def _map(self, parallel, block_size):
+        """Yields the formatted blocks in order, computed by ``parallel`` processes"""
+        blocks = self.blocks(block_size)
+        if parallel <= 1:
+            for block in blocks:
+                yield self.block(*block)
+            return
+        pool = multiprocessing.Pool(parallel, _initialize, (self,))
+        try:
+            for result in pool.imap(_score_block, blocks):
+                yield result
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def __call__(self, parallel=1, block_size=1000000):
+        """Returns the ``float32`` scores of all comparisons, in the order of the match list"""
+        self.format = "binary"
+        scores = list(self._map(parallel, block_size))
+        return numpy.concatenate(scores) if scores else numpy.zeros(0, numpy.float32)
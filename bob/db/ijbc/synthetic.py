@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Generation of synthetic protocol files in the format and with the structure of the IJB-C protocols, at a configurable scale
+
+With ``scale=1``, the counts approximate those of IJB-C: about 31.3k images and 117.5k frames of 11.8k videos of 3531 subjects, 15.7M comparisons of 19.6k probe templates in the ``1:1`` protocol, and 47.4M comparisons of 140.7k single-file templates in the ``Covariates`` protocol.
+"""
+
+import os
+
+import numpy
+
+# the number of subjects of IJB-C; the other counts are given per subject, and approximate the original protocols
+subjects = 3531
+
+# the frequencies of the skin tones; with these, each 1:1 probe template is compared to about as many gallery templates as in IJB-C
+skintone_frequencies = (0.61, 0.25, 0.14)
+
+# the header of the metadata file; the order of the columns is the one that is expected by :py:class:`bob.db.ijbc.reader.Metadata`
+metadata_header = ["SUBJECT_ID", "FILENAME", "SIGHTING_ID", "FACE_X", "FACE_Y", "FACE_WIDTH", "FACE_HEIGHT", "FRAME_NUM",
+                   "FACIAL_HAIR", "AGE", "INDOOR_OUTDOOR", "SKINTONE", "GENDER", "YAW", "ROLL"] + ["OCC%d" % i for i in range(1, 19)]
+
+
+def _write_rows(filename, header, columns, chunk_size=1000000):
+    """Writes the given columns into a CSV file, where each column is a list or :py:class:`numpy.ndarray` of the same length"""
+    line = ",".join("%s" for _ in columns) + "\n"
+    with open(filename, "w") as f:
+        if header is not None:
+            f.write(",".join(header) + "\n")
+        count = len(columns[0]) if columns else 0
+        for start in range(0, count, chunk_size):
+            rows = zip(*[column[start:start + chunk_size].tolist() if isinstance(column, numpy.ndarray) else column[start:start + chunk_size] for column in columns])
+            f.write("".join(line % row for row in rows))
+
+
+def _write_pairs(filename, models, probes, chunk_size=1000000):
+    """Writes the header-less match file with the given model and probe template ids"""
+    with open(filename, "w") as f:
+        for start in range(0, len(models), chunk_size):
+            pairs = numpy.column_stack((models[start:start + chunk_size], probes[start:start + chunk_size]))
+            f.write(("%d,%d\n" * len(pairs)) % tuple(pairs.ravel().tolist()))
+
+
+def _choose(random, groups, counts, sizes):
+    """For each group ``i``, chooses ``counts[i]`` elements uniformly from ``range(sizes[groups[i]])``, and returns them as a flat array"""
+    return numpy.floor(random.rand(int(numpy.sum(counts))) * numpy.repeat(sizes[groups], counts)).astype(numpy.int64)
+
+
+def write_protocol(directory, scale=0.01, seed=0, images_per_subject=9, videos_per_subject=3.3, frames_per_video=10,
+                   probes_per_subject=5.5, covariate_templates=0.95, covariate_comparisons=337):
+    """Writes a complete set of synthetic IJB-C protocol files into the given directory.
+
+    The files have the format of the original protocol files, and they are generated with the same structure:
+
+    * each subject has ``images_per_subject`` images and ``videos_per_subject`` videos of ``frames_per_video`` frames on average; a few images show a second subject
+    * the ``G1`` and ``G2`` galleries contain a single template of each subject, composed of several images
+    * the mixed probe templates contain either some images or the frames of a video; the image and video probes are the according subsets
+    * in the ``1:1`` protocol, each gallery template is compared to all probe templates with the same gender and skin tone
+    * the ``Covariates`` templates contain a single image or frame each, and each of them is compared to ``covariate_comparisons`` other templates
+
+    With ``scale=1`` and the default counts, the number of subjects, files, templates and comparisons of each protocol is within a few percent of IJB-C, see :py:mod:`bob.db.ijbc.synthetic`.
+
+    **Parameters:**
+
+    directory : str
+      The directory to write the protocol files into; it is created if it does not exist
+
+    scale : float
+      The fraction of the 3531 subjects of IJB-C that are generated
+
+    seed : int
+      The seed of the random number generator; the same seed always generates the same files
+
+    images_per_subject, videos_per_subject, frames_per_video, probes_per_subject : float
+      The average number of images, videos, frames and probe templates
+
+    covariate_templates : float
+      The fraction of the files that are used as a template of the ``Covariates`` protocol
+
+    covariate_comparisons : int
+      The number of comparisons of each ``Covariates`` gallery template
+
+    **Returns:**
+
+    counts : dict
+      The number of subjects, files, templates and comparisons that have been written
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    random = numpy.random.RandomState(seed)
+    subject_count = max(int(round(subjects * scale)), 4)
+    subject_ids = numpy.arange(1, subject_count + 1)
+    gender = random.randint(0, 2, subject_count)
+    skintone = random.choice(numpy.arange(1, 4), subject_count, p=skintone_frequencies)
+
+    # the images and the video frames of each subject
+    image_counts = random.poisson(max(images_per_subject - 4, 0), subject_count) + 4
+    image_subject = numpy.repeat(numpy.arange(subject_count), image_counts)
+    video_counts = random.poisson(videos_per_subject, subject_count)
+    video_subject = numpy.repeat(numpy.arange(subject_count), video_counts)
+    frame_counts = random.poisson(frames_per_video - 1, len(video_subject)) + 1
+    frame_video = numpy.repeat(numpy.arange(len(video_subject)), frame_counts)
+    frame_number = numpy.arange(len(frame_video)) - numpy.repeat(numpy.cumsum(frame_counts) - frame_counts, frame_counts)
+    # about 1% of the images show a second subject
+    shared = random.rand(len(image_subject)) < 0.01
+    second_subject = (image_subject[shared] + 1 + random.randint(0, subject_count - 1, numpy.count_nonzero(shared))) % subject_count
+
+    paths = ["img/%d.jpg" % i for i in range(len(image_subject))]
+    frame_paths = ["frames/%d_%d.png" % (v, f) for v, f in zip(frame_video.tolist(), frame_number.tolist())]
+    file_paths = paths + [paths[i] for i in numpy.flatnonzero(shared).tolist()] + frame_paths
+    file_subject = numpy.concatenate((image_subject, second_subject, video_subject[frame_video]))
+    file_frame = numpy.concatenate((numpy.full(len(image_subject) + len(second_subject), numpy.nan), frame_number))
+    count = len(file_paths)
+
+    # annotations of all files
+    boxes = numpy.column_stack((random.randint(0, 500, count), random.randint(0, 500, count), random.randint(20, 300, count), random.randint(20, 300, count)))
+    columns = [subject_ids[file_subject], file_paths, numpy.zeros(count, numpy.int64)] + [boxes[:, i] for i in range(4)]
+    columns += [["NaN" if f != f else "%d" % f for f in file_frame.tolist()], random.randint(0, 4, count), random.randint(15, 80, count), random.randint(0, 2, count),
+                skintone[file_subject], gender[file_subject], numpy.round(random.randn(count) * 30, 1), numpy.round(random.randn(count) * 10, 1)]
+    columns += [random.randint(0, 2, count) for _ in range(18)]
+    # a non-face image without any annotation
+    columns = [list(c.tolist() if isinstance(c, numpy.ndarray) else c) + [v] for c, v in zip(columns, ["NaN", "nonfaces/1.jpg"] + ["NaN"] * 31)]
+    _write_rows(os.path.join(directory, "ijbc_metadata.csv"), metadata_header, columns)
+
+    image_offsets = numpy.append(0, numpy.cumsum(image_counts))
+    frame_offsets = numpy.append(0, numpy.cumsum(frame_counts))
+    video_offsets = numpy.append(0, numpy.cumsum(video_counts))
+    template_header = ["TEMPLATE_ID", "SUBJECT_ID", "FILENAME"]
+
+    # the galleries: one template with the first three images of each subject
+    gallery_files = image_offsets[:-1, None] + numpy.arange(3)[None, :]
+    half = subject_count // 2
+    for name, selected in (("G1", numpy.arange(half)), ("G2", numpy.arange(half, subject_count))):
+        _write_rows(os.path.join(directory, "ijbc_1N_gallery_%s.csv" % name), template_header,
+                    [numpy.repeat(subject_ids[selected], 3), numpy.repeat(subject_ids[selected], 3), [paths[i] for i in gallery_files[selected].ravel().tolist()]])
+
+    # the probes: templates of the remaining images of a subject, or of all frames of a video
+    probe_counts = numpy.maximum(random.poisson(probes_per_subject, subject_count), 1)
+    probe_subject = numpy.repeat(numpy.arange(subject_count), probe_counts)
+    is_video = (random.rand(len(probe_subject)) < 0.6) & (video_counts[probe_subject] > 0)
+    probe_ids = 100000 + numpy.arange(len(probe_subject))
+    image_probes = numpy.flatnonzero(~is_video)
+    image_templates = numpy.repeat(image_probes, random.randint(1, 4, len(image_probes)))
+    image_files = image_offsets[probe_subject[image_templates]] + 3 + _choose(random, probe_subject[image_templates], numpy.ones(len(image_templates), numpy.int64), image_counts - 3)
+    # the same image is only used once in each template
+    unique = numpy.unique(image_templates * count + image_files)
+    image_templates, image_files = unique // count, unique % count
+    video_probes = numpy.flatnonzero(is_video)
+    videos = video_offsets[probe_subject[video_probes]] + _choose(random, probe_subject[video_probes], numpy.ones(len(video_probes), numpy.int64), video_counts)
+    video_templates = numpy.repeat(video_probes, frame_counts[videos])
+    video_files = numpy.concatenate([numpy.arange(frame_offsets[v], frame_offsets[v + 1]) for v in videos.tolist()] + [numpy.zeros(0, numpy.int64)])
+    image_rows = (probe_ids[image_templates], subject_ids[probe_subject[image_templates]], [paths[i] for i in image_files.tolist()])
+    video_rows = (probe_ids[video_templates], subject_ids[probe_subject[video_templates]], [frame_paths[i] for i in video_files.tolist()])
+    _write_rows(os.path.join(directory, "ijbc_1N_probe_img.csv"), template_header, list(image_rows))
+    _write_rows(os.path.join(directory, "ijbc_1N_probe_video.csv"), template_header, list(video_rows))
+    _write_rows(os.path.join(directory, "ijbc_1N_probe_mixed.csv"), template_header, [numpy.concatenate((i, v)) if isinstance(i, numpy.ndarray) else i + v for i, v in zip(image_rows, video_rows)])
+
+    # the 1:1 protocol compares each gallery template with all probes of the same gender and skin tone
+    group = gender * 4 + skintone
+    probe_order = numpy.argsort(group[probe_subject], kind="mergesort")
+    probe_groups = group[probe_subject][probe_order]
+    starts, ends = numpy.searchsorted(probe_groups, group), numpy.searchsorted(probe_groups, group, side="right")
+    models = numpy.repeat(subject_ids, ends - starts)
+    probes = probe_ids[probe_order][numpy.concatenate([numpy.arange(s, e) for s, e in zip(starts.tolist(), ends.tolist())])]
+    _write_pairs(os.path.join(directory, "ijbc_11_G1_G2_matches.csv"), models, probes)
+
+    # the covariates protocol uses single-file templates; each gallery template is compared to random other templates
+    covariate_files = numpy.flatnonzero(random.rand(count) < covariate_templates)
+    covariate_ids = 1000000 + numpy.arange(len(covariate_files))
+    _write_rows(os.path.join(directory, "ijbc_11_covariate_probe_reference.csv"), template_header,
+                [covariate_ids, subject_ids[file_subject[covariate_files]], [file_paths[i] for i in covariate_files.tolist()]])
+    covariate_models = numpy.repeat(numpy.arange(len(covariate_files)), min(covariate_comparisons, len(covariate_files)))
+    covariate_probes = random.randint(0, len(covariate_files), len(covariate_models))
+    pairs = numpy.unique(covariate_models * len(covariate_files) + covariate_probes)
+    pairs = pairs[pairs // len(covariate_files) != pairs % len(covariate_files)]
+    _write_pairs(os.path.join(directory, "ijbc_11_covariate_matches.csv"), covariate_ids[pairs // len(covariate_files)], covariate_ids[pairs % len(covariate_files)])
+
+    # the face detection protocols use the images of all subjects
+    detection_header = ["FILENAME", "FACE_X", "FACE_Y", "FACE_WIDTH", "FACE_HEIGHT"]
+    detection_columns = [paths + ["nonfaces/1.jpg"]] + [boxes[:len(paths), i].tolist() + ["NaN"] for i in range(4)]
+    _write_rows(os.path.join(directory, "ijbc_face_detection.csv"), detection_header[:1], detection_columns[:1])
+    _write_rows(os.path.join(directory, "ijbc_face_detection_ground_truth.csv"), detection_header, [c[:-1] for c in detection_columns])
+    for test in (9, 10, 11):
+        selected = numpy.flatnonzero(image_subject % 3 == test % 3).tolist()
+        _write_rows(os.path.join(directory, "ijbc_wild_test%d.csv" % test), detection_header, [[c[i] for i in selected] for c in detection_columns])
+
+    return dict(
+        subjects=subject_count,
+        files=count + 1,
+        probe_templates=len(probe_subject),
+        probe_files=len(image_templates) + len(video_templates),
+        comparisons_1_1=len(models),
+        covariate_templates=len(covariate_files),
+        comparisons_covariates=len(pairs),
+    )
@@ -10,28 +10,86 @@ import os, sys
 import bob.db.ijbc
 import nose.tools
 import random
+import shutil
+import tempfile
+import numpy
 from nose.plugins.attrib import attr
 
 # we create only a single instance of the database, to avoid loading file-lists over and over
 db = bob.db.ijbc.Database()
 
 
+def _write_protocol(directory):
+    """Writes a small set of protocol files in the IJB-C format into the given directory"""
+    def _annotations(subject, index, frame=None):
+        values = [10 * index, 20 * index, 50, 60, "NaN" if frame is None else frame, 1, 30 + subject, 0, subject % 6 + 1, subject % 2, -10 + 5 * index, 2]
+        return values + [index % 2] * 18
+
+    metadata = []
+    for subject in range(1, 7):
+        for index in range(3):
+            metadata.append([subject, "img/%d%d.jpg" % (subject, index), 0] + _annotations(subject, index))
+        for frame in range(4):
+            metadata.append([subject, "frames/%d_%d.png" % (subject, frame), 0] + _annotations(subject, frame, frame))
+    # duplicate entry, image with two subjects, and a non-face image
+    metadata.append(metadata[0])
+    metadata.append([2, "img/10.jpg", 0] + _annotations(2, 0))
+    metadata.append(["NaN", "nonfaces/1.jpg", 0] + ["NaN"] * 30)
+
+    def _write(name, rows, header=True):
+        with open(os.path.join(directory, name), "w") as f:
+            if header:
+                f.write(",".join("C%d" % i for i in range(len(rows[0]))) + "\n")
+            for row in rows:
+                f.write(",".join(str(r) for r in row) + "\n")
+
+    _write("ijbc_metadata.csv", metadata)
+    _write("ijbc_1N_gallery_G1.csv", [[s, s, "img/%d%d.jpg" % (s, i)] for s in range(1, 4) for i in range(2)])
+    _write("ijbc_1N_gallery_G2.csv", [[s, s, "img/%d%d.jpg" % (s, i)] for s in range(4, 7) for i in range(2)])
+    _write("ijbc_1N_probe_img.csv", [[200 + s, s, "img/%d2.jpg" % s] for s in range(1, 7)])
+    _write("ijbc_1N_probe_video.csv", [[300 + s, s, "frames/%d_%d.png" % (s, i)] for s in range(1, 7) for i in range(4)])
+    _write("ijbc_1N_probe_mixed.csv", [[100 + s, s, f] for s in range(1, 7) for f in ["img/%d2.jpg" % s] + ["frames/%d_%d.png" % (s, i) for i in range(4)]] + [[107, 2, "img/10.jpg"]])
+    _write("ijbc_11_G1_G2_matches.csv", [[m, p] for m in range(1, 7) for p in range(101, 108)], False)
+    _write("ijbc_11_covariate_probe_reference.csv", [[1000 + 10 * s + i, s, "img/%d%d.jpg" % (s, i)] for s in range(1, 7) for i in range(3)])
+    _write("ijbc_11_covariate_matches.csv", [[1000 + 10 * s, 1000 + 10 * t + 1] for s in range(1, 7) for t in range(1, 7) if s != t] + [[1000 + 10 * s, 1000 + 10 * s + 2] for s in range(1, 7)], False)
+
+    def _write_csv(name, header, rows):
+        with open(os.path.join(directory, name), "w") as f:
+            f.write(",".join(header) + "\n")
+            for row in rows:
+                f.write(",".join(str(r) for r in row) + "\n")
+
+    # face detection: every image with a face has two boxes, and a non-face image
+    boxes = [["img/%d%d.jpg" % (s, i), 10 * i, 20 * i, 50, 60] for s in range(1, 7) for i in range(3)] + [["img/%d%d.jpg" % (s, i), 100, 100, 40, 40] for s in range(1, 7) for i in range(3)]
+    _write_csv("ijbc_face_detection.csv", ["FILENAME"], [[b[0]] for b in boxes[:18]] + [["nonfaces/1.jpg"]])
+    _write_csv("ijbc_face_detection_ground_truth.csv", ["FILENAME", "FACE_X", "FACE_Y", "FACE_WIDTH", "FACE_HEIGHT"], boxes)
+    for test in (9, 10, 11):
+        _write_csv("ijbc_wild_test%d.csv" % test, ["FILENAME", "FACE_X", "FACE_Y", "FACE_WIDTH", "FACE_HEIGHT"], [b for b in boxes if int(b[0][4]) % 3 == test % 3])
+
+
+class _SyntheticDatabase:
+    """Provides a database on a small set of synthetic protocol files"""
+    def __enter__(self):
+        self.directory = tempfile.mkdtemp(prefix="bob.db.ijbc_")
+        _write_protocol(self.directory)
+        return bob.db.ijbc.Database(protocol_directory=self.directory)
+
+    def __exit__(self, *args):
+        shutil.rmtree(self.directory)
+
+
 # all the numbers from below have been estimated from the original protocol files using an external script
 
 @attr('slow')
 def test_clients():
     # The number of groups
     assert len(db.groups(protocol='1:1')) == 1
-    assert len(db.protocol_names()) == 2
-    #assert len(db.protocol_names()) == 11
+    assert len(db.protocol_names()) == 11
 
     # test that the expected number of clients/client_ids is returned; the values are according to the Protocol Description
     for protocol in db.protocol_names():
-        #import ipdb; ipdb.set_trace();
         # number of clients differ between protocols
-        #client_ids = 931 if "G1" in protocol else 914 if "G2" in protocol else 1817 if protocol == "Covariates" else 3531
-        #client_ids = 1817 if protocol == "Covariates" else 3531
-        client_ids = 3531
+        client_ids = 1772 if "G1" in protocol else 1759 if "G2" in protocol else 3531
         assert len(db.client_ids(protocol=protocol)) == client_ids
         # number of models is only different for the covariates protocol
         assert len(db.model_ids(protocol=protocol)) == (140739 if protocol == "Covariates" else client_ids)
@@ -68,29 +126,18 @@ def test_covariates():
                db.model_ids(protocol="Covariates"))
 
 
-"""
+@attr('slow')
 def test_identification():
     # 1:N protocols
-    for protocol in ("1:N-S1-Image", "1:N-S2-Image", "1:N-Image"):
-        # .. number of probes is identical for all models
-        assert all(len(db.objects(protocol=protocol, model_ids=model_id, purposes="probe")) == 5999 for model_id in
-                   random.sample(db.model_ids(protocol=protocol), 100))
-        assert all(len(db.object_sets(protocol=protocol, model_ids=model_id, purposes="probe")) == 8104 for model_id in
-                   db.model_ids(protocol=protocol))
-
-    for protocol in ("1:N-S1-Mixed", "1:N-S2-Mixed", "1:N-Mixed"):
-        assert all(len(db.objects(protocol=protocol, model_ids=model_id, purposes="probe")) == 61494 for model_id in
-                   random.sample(db.model_ids(protocol=protocol), 100))
-        assert all(len(db.object_sets(protocol=protocol, model_ids=model_id, purposes="probe")) == 10270 for model_id in
-                   db.model_ids(protocol=protocol))
-
-    for protocol in ("1:N-S1-Video", "1:N-S2-Video", "1:N-Video"):
-        assert all(len(db.objects(protocol=protocol, model_ids=model_id, purposes="probe")) == 7110 for model_id in
-                   random.sample(db.model_ids(protocol=protocol), 100))
-        assert all(len(db.object_sets(protocol=protocol, model_ids=model_id, purposes="probe")) == 7110 for model_id in
-                   db.model_ids(protocol=protocol))
+    # .. all probes are compared to all models, independent of the model ids
+    for protocol in ("1:N-G1-Mixed", "1:N-G2-Mixed", "1:N-Mixed"):
+        assert len(db.object_sets(protocol=protocol)) == 19593
+        assert len(db.object_sets(protocol=protocol, model_ids=random.sample(db.model_ids(protocol=protocol), 100))) == 19593
+        assert len(db.objects(protocol=protocol, purposes="probe")) == 128876
 
-"""
+    for probes in ("Image", "Video"):
+        counts = [len(db.object_sets(protocol="1:N-%s%s" % (gallery, probes))) for gallery in ("G1-", "G2-", "")]
+        assert counts[0] == counts[1] == counts[2] > 0
 
 @attr('slow')
 def test_annotations():
@@ -112,6 +159,706 @@ def test_annotations():
                 assert set(annotations.keys()).issubset(all_keys)
 
 
+def test_synthetic_metadata():
+    with _SyntheticDatabase() as sdb:
+        metadata = sdb.protocol._read_metadata()
+        # annotations are read in the same pass as the file names
+        assert metadata.bbox.shape == (len(metadata), 4) and metadata.bbox.dtype == numpy.float64
+        assert metadata.occlusion.shape == (len(metadata), 18) and metadata.occlusion.dtype == numpy.float32
+        assert metadata.paths.dtype.kind == "U" and metadata.has_annotation.sum() == len(metadata) - 1
+        # duplicate entry is removed, the image with two subjects is kept twice
+        assert len(metadata) == 6 * 7 + 2
+        assert metadata.extensions.tolist() == [".jpg", ".png"]
+        file = metadata.file(metadata.rows(["img/10"], [2])[0])
+        assert file.id == "img/10-2" and file.extension == ".jpg" and file.client_id == 2
+        assert file is metadata.file(metadata.rows(["img/10"], [2])[0])
+        assert file.annotation.frame is None and file.annotation.age == 32
+        assert not hasattr(file.annotation, "__dict__")
+        assert file.annotation.occlusion is metadata.file(metadata.rows(["img/12"], [1])[0]).annotation.occlusion
+        assert isinstance(file.annotation.occlusion, tuple) and len(file.annotation.occlusion) == 18
+        # the shared occlusions belong to the metadata, and are released with it
+        other = bob.db.ijbc.reader.Metadata(metadata._filename)
+        assert other.file(other.rows(["img/10"], [2])[0]).annotation.occlusion is not file.annotation.occlusion
+        assert not hasattr(bob.db.ijbc.reader, "_occlusions")
+        nonface = metadata.file(metadata.rows(["nonfaces/1"], [-1])[0])
+        assert nonface.client_id is None and nonface.annotation is None
+        nose.tools.assert_raises(ValueError, metadata.rows, ["img/99"], [1])
+
+
+def test_synthetic_queries():
+    with _SyntheticDatabase() as sdb:
+        assert sdb.model_ids(protocol="1:1") == [1, 2, 3, 4, 5, 6]
+        assert sdb.client_ids(protocol="1:1") == [1, 2, 3, 4, 5, 6]
+        assert len(list(sdb.iter_pairs(protocol="1:1"))) == 1
+        assert sdb.get_client_id_from_model_id("1:1", 3) == 3
+        assert sdb.get_client_id_from_model_id("Covariates", 1020) == 2
+        # ID-only queries do not read the metadata
+        assert sdb.protocol._metadata is None
+        assert len(sdb.object_sets(protocol="1:1")) == 7
+        assert len(sdb.objects(protocol="1:1", purposes="enroll", model_ids=3)) == 2
+        assert len(sdb.objects(protocol="1:1", purposes="probe", model_ids=3)) == 31
+        assert sdb.annotations(sdb.protocol.enroll_template("1:1", 1).files[1]) == {"topleft": (20., 10.), "size": (60., 50.), "bottomright": (80., 60.)}
+        assert sdb.model_ids(protocol="Covariates") == [1010, 1020, 1030, 1040, 1050, 1060]
+        assert sum(len(sdb.objects(protocol="Covariates", purposes="probe", model_ids=m)) for m in sdb.model_ids(protocol="Covariates")) == 36
+        assert sdb.get_model_ids_from_client_id("1:1", "probe", 2) == [102, 107]
+        assert sum(len(m) for m, p in sdb.iter_pairs(protocol="1:1", chunk_size=5)) == 42
+
+
+def test_match_list():
+    directory = tempfile.mkdtemp(prefix="bob.db.ijbc_")
+    try:
+        filename = os.path.join(directory, "matches.csv")
+        with open(filename, "w") as f:
+            f.write("5,10\r\n3,12\r\n5,11\r\n3,10\r\n7,10")
+        pairs = bob.db.ijbc.reader._read_pairs(filename, chunk_size=4)
+        assert pairs.tolist() == [[5, 10], [3, 12], [5, 11], [3, 10], [7, 10]]
+        matches = bob.db.ijbc.reader.MatchList(filename)
+        assert list(matches) == [3, 5, 7]
+        assert matches.offsets.tolist() == [0, 2, 4, 5]
+        assert matches[3].tolist() == [12, 10] and matches[5].tolist() == [10, 11]
+        assert 4 not in matches
+        nose.tools.assert_raises(KeyError, matches.__getitem__, 4)
+        for chunk_size in (1, 2, 3, 5, 10):
+            chunks = list(matches.iter_pairs(chunk_size))
+            assert all(len(m) == len(p) <= chunk_size for m, p in chunks)
+            assert numpy.concatenate([m for m, p in chunks]).tolist() == [3, 3, 5, 5, 7]
+            assert numpy.concatenate([p for m, p in chunks]).tolist() == [12, 10, 10, 11, 10]
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_annotations_array():
+    with _SyntheticDatabase() as sdb:
+        files = sorted(sdb.objects(protocol="1:1"))
+        files.append(sdb.protocol._read_metadata().file(sdb.protocol._read_metadata().rows_from_ids(["nonfaces/1-None"])[0]))
+        annotations = sdb.annotations_array(files)
+        assert annotations.shape == (len(files),)
+        assert annotations.tobytes() == sdb.annotations_array([f.id for f in files]).tobytes()
+        for file, annotation in zip(files, annotations):
+            if file.annotation is None:
+                assert not annotation["has_annotation"] and numpy.all(numpy.isnan(annotation["topleft"]))
+                continue
+            assert annotation["has_annotation"]
+            assert tuple(annotation["topleft"]) == file.annotation.topleft
+            assert tuple(annotation["bottomright"]) == file.annotation.bottomright
+            assert tuple(annotation["size"]) == file.annotation.size
+            assert annotation["yaw"] == file.annotation.yaw and annotation["age"] == file.annotation.age
+            assert (file.annotation.frame is None and numpy.isnan(annotation["frame"])) or annotation["frame"] == file.annotation.frame
+            assert annotation["occlusion"].tolist() == list(file.annotation.occlusion)
+
+
+def test_inverted_indexes():
+    with _SyntheticDatabase() as sdb:
+        for protocol in ("1:1", "Covariates"):
+            for purpose in ("enroll", "probe"):
+                templates = sdb.protocol.get_templates(protocol, purpose)
+                client_ids = list(range(0, 8))
+                expected = [sorted(t.id for t in templates.values() if t.client_id == c) for c in client_ids]
+                assert [sdb.get_model_ids_from_client_id(protocol, purpose, c) for c in client_ids] == expected
+                assert [m.tolist() for m in sdb.get_model_ids_from_client_ids(protocol, purpose, numpy.array(client_ids))] == expected
+
+        assert sdb.get_template_ids_from_file("1:1", "probe", "img/10-2") == [107]
+        assert sdb.get_template_ids_from_file("1:1", "enroll", "img/10-2") == []
+        assert sdb.get_template_ids_from_file("Covariates", "enroll", "img/10-1") == [1010]
+        assert sdb.get_template_ids_from_file("Covariates", "probe", "img/10-1") == []
+        file = sdb.protocol.enroll_template("1:1", 3).files[0]
+        assert sdb.get_template_ids_from_file("1:1", "enroll", file) == [3]
+
+
+def test_shards():
+    with _SyntheticDatabase() as sdb:
+        for protocol in ("1:1", "Covariates"):
+            for count in (1, 2, 4):
+                shards = [sdb.shards(protocol, count, index) for index in range(count)]
+                # all comparisons are distributed over the shards
+                assert numpy.concatenate([s.model_ids for s in shards]).tolist() == sdb.model_ids(protocol=protocol)
+                assert sum(s.comparisons for s in shards) == sum(len(m) for m, p in sdb.iter_pairs(protocol))
+                assert max(s.comparisons for s in shards) - min(s.comparisons for s in shards) <= 7
+                for shard in shards:
+                    expected = sdb.objects(protocol=protocol, model_ids=shard.model_ids.tolist())
+                    assert shard.files() == sorted(expected)
+                    expected = set(t.id for m in shard.model_ids.tolist() for t in sdb.protocol.probe_templates(protocol, m))
+                    assert shard.probe_ids.tolist() == sorted(expected)
+        nose.tools.assert_raises(ValueError, sdb.shards, "1:1", 2, 2)
+
+
+def test_protocol_cache():
+    with _SyntheticDatabase() as sdb:
+        expected = sdb.objects(protocol="Covariates", purposes="probe", model_ids=1020)
+        protocol = bob.db.ijbc.Protocol(sdb.protocol.base_directory)
+        written = protocol.compile()
+        assert len(written) == 14
+        assert protocol.compile() == []
+
+        # a new protocol reads the cache, and not the CSV files
+        protocol = bob.db.ijbc.Protocol(sdb.protocol.base_directory)
+        assert protocol._load_cached("ijbc_metadata.csv") is not None
+        assert isinstance(protocol._read_match_file("Covariates").probe_ids, numpy.memmap)
+        assert isinstance(protocol._read_metadata().paths, numpy.memmap)
+        assert protocol.get_templates("Covariates", "probe").template_ids.tolist() == [1011, 1012, 1021, 1022, 1031, 1032, 1041, 1042, 1051, 1052, 1061, 1062]
+        files = set(f for t in protocol.probe_templates("Covariates", 1020) for f in t.files)
+        assert sorted(f.id for f in files) == sorted(f.id for f in expected)
+
+        # touching a file does not invalidate the cache, but changing it does
+        matches_file = os.path.join(sdb.protocol.base_directory, "ijbc_11_covariate_matches.csv")
+        os.utime(matches_file, (0, 0))
+        from bob.db.ijbc import cache as cache_module
+        checksum, hashed = cache_module.checksum, []
+        cache_module.checksum = lambda filename: hashed.append(filename) or checksum(filename)
+        try:
+            assert bob.db.ijbc.Protocol(sdb.protocol.base_directory)._load_cached("ijbc_11_covariate_matches.csv") is not None
+            assert hashed == [matches_file]
+            # the new modification time is recorded, so that the file is not hashed again
+            assert bob.db.ijbc.Protocol(sdb.protocol.base_directory)._load_cached("ijbc_11_covariate_matches.csv") is not None
+            assert hashed == [matches_file]
+        finally:
+            cache_module.checksum = checksum
+        with open(matches_file, "a") as f:
+            f.write("1020,1011\n")
+        protocol = bob.db.ijbc.Protocol(sdb.protocol.base_directory)
+        assert protocol._load_cached("ijbc_11_covariate_matches.csv") is None
+        assert len(protocol.probe_templates("Covariates", 1020)) == 7
+        assert protocol.compile() == ["ijbc_11_covariate_matches.csv"]
+
+        # processes that store different entries concurrently keep each other's entries
+        from bob.db.ijbc.cache import ProtocolCache
+        cache_directory = os.path.join(sdb.protocol.base_directory, "cache")
+        first, second = ProtocolCache(cache_directory), ProtocolCache(cache_directory)
+        first.index(), second.index()
+        first.save("first", [matches_file], {"ids": numpy.arange(3)})
+        second.save("second", [matches_file], {"ids": numpy.arange(4)})
+        cache = ProtocolCache(cache_directory)
+        assert len(cache.load("first", [matches_file])["ids"]) == 3
+        assert len(cache.load("second", [matches_file])["ids"]) == 4
+        assert len(cache.index()["entries"]) == 16
+
+
+def test_checkfiles():
+    import argparse
+    import json
+    from bob.db.ijbc.driver import Interface
+    parser = argparse.ArgumentParser()
+    Interface().add_commands(parser)
+
+    with _SyntheticDatabase() as sdb:
+        directory = sdb.protocol.base_directory
+        # create some of the original files
+        for file in list(sdb.objects(protocol="Covariates"))[:10]:
+            path = file.make_path(os.path.join(directory, "data"), file.extension, add_client_id=False)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            open(path, "w").close()
+        # the protocol cache is compiled into the protocol directory; -p only selects protocols in other commands
+        args = parser.parse_args(["create", "--protocol-directory", directory, "--self-test"])
+        assert args.func(args) == 0 and os.path.exists(os.path.join(directory, "cache", "index.json"))
+        report_file = os.path.join(directory, "report.json")
+        args = parser.parse_args(["checkfiles", "-d", os.path.join(directory, "data"), "--protocol-directory", directory, "--report", report_file, "--self-test"])
+        assert args.func(args) == 0
+
+        with open(report_file) as f:
+            report = json.load(f)
+        files = set(f for p in sdb.protocol_names() for f in sdb.objects(protocol=p))
+        existing = set(f.path for f in files if os.path.exists(f.make_path(os.path.join(directory, "data"), f.extension, add_client_id=False)))
+        # each physical file is checked and reported once, even if it is shared by several subjects
+        paths = set(f.path + f.extension for f in files)
+        assert len(paths) < len(files)
+        assert report["checked"] == len(paths)
+        assert len(set(m["path"] for m in report["missing"])) == len(report["missing"])
+        assert sorted(i for m in report["missing"] for i in m["ids"]) == sorted(f.id for f in files if f.path not in existing)
+
+        # the unique file names with the given extension are checked per file
+        args = parser.parse_args(["checkfiles", "-d", os.path.join(directory, "data"), "-e", ".hdf5", "--protocol-directory", directory, "--report", report_file, "--self-test"])
+        assert args.func(args) == 0
+        with open(report_file) as f:
+            report = json.load(f)
+        assert report["checked"] == len(files) == len(report["missing"])
+
+
+def test_paths():
+    import argparse
+    from bob.db.ijbc.driver import Interface
+    parser = argparse.ArgumentParser()
+    Interface().add_commands(parser)
+
+    with _SyntheticDatabase() as sdb:
+        directory = sdb.protocol.base_directory
+        sdb.original_directory = os.path.join(directory, "data")
+        files = sorted(sdb.objects(protocol="1:1"))
+        names = sdb.original_file_names(files, check_existence=False)
+        assert names == [sdb.original_file_name(f, check_existence=False) for f in files]
+        assert sdb.original_file_names([f.id for f in files], check_existence=False) == names
+        nose.tools.assert_raises(ValueError, sdb.original_file_names, files)
+        nose.tools.assert_raises(ValueError, sdb.original_file_names, ["img/99-1"], check_existence=False)
+        assert sdb.original_file_names(["img/99-1", "invalid", files[0].id], check_existence=False, skip_unknown=True) == names[:1]
+        for name in names:
+            if not os.path.isdir(os.path.dirname(name)):
+                os.makedirs(os.path.dirname(name))
+            open(name, "w").close()
+        assert bob.db.ijbc.Database(original_directory=sdb.original_directory, protocol_directory=directory).original_file_names(files) == names
+        assert sdb.paths(["img/99-1", files[0].id], "dir", ".hdf5") == [files[0].make_path("dir", ".hdf5")]
+
+        # read ids from file
+        id_file = os.path.join(directory, "ids.txt")
+        with open(id_file, "w") as f:
+            f.write("\n".join(f.id for f in files))
+        args = parser.parse_args(["path", "-d", sdb.original_directory, "-i", id_file, "--original", "-c", "5", "--protocol-directory", directory, "--self-test"])
+        assert args.func(args) == 0
+        args = parser.parse_args(["path", "--protocol-directory", directory, "--self-test", "img/99-1"])
+        assert args.func(args) == 1
+        # the original file names cannot be formed without the original directory
+        args = parser.parse_args(["path", "--original", "--protocol-directory", directory, "--self-test", files[0].id])
+        assert args.func(args) == 1
+
+
+def _load_npy(file_name):
+    """Loads images from .npy files, for the tests of the loader"""
+    return numpy.load(os.path.splitext(file_name)[0] + ".npy")
+
+
+def _write_images(directory, files):
+    """Writes random images as .npy files for the given files, and returns them"""
+    images = {}
+    for file in files:
+        path = file.make_path(directory, ".npy", add_client_id=False)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        images[file.path] = numpy.random.randint(0, 255, (3, 100, 120)).astype(numpy.uint8)
+        numpy.save(path, images[file.path])
+    return images
+
+
+def test_loader():
+    from bob.db.ijbc.loader import FaceLoader, crop, bounding_box
+    assert bounding_box((10., 20., 30., 40.), (100, 100)) == (20, 60, 10, 40)
+    assert bounding_box((10., 20., 30., 40.), (50, 100), margin=0.5) == (0, 50, 0, 55)
+    assert bounding_box((numpy.nan,) * 4, (50, 100)) == (0, 50, 0, 100)
+
+    with _SyntheticDatabase() as sdb:
+        sdb.original_directory = os.path.join(sdb.protocol.base_directory, "data")
+        templates = sorted(sdb.object_sets(protocol="1:1"))
+        images = _write_images(sdb.original_directory, set(f for t in templates for f in t.files))
+        for processes in (False, True):
+            loader = FaceLoader(sdb.original_directory, batch_size=4, parallel=2, prefetch=1, processes=processes, load_function=_load_npy)
+            batches = list(loader.batches(templates))
+            assert all(len(files) == len(faces) <= 4 for files, faces in batches)
+            loaded = [(f, face) for files, faces in batches for f, face in zip(files, faces)]
+            assert [f for f, _ in loaded] == [f for t in templates for f in t.files]
+            for file, face in loaded:
+                a = file.annotation
+                expected = images[file.path][:, int(a.topleft[0]):int(a.bottomright[0]), int(a.topleft[1]):int(a.bottomright[1])]
+                assert numpy.array_equal(face, expected)
+        assert len(list(loader(templates[:1]))) == len(templates[0].files)
+
+
+def test_chips():
+    from bob.db.ijbc.loader import crop
+    from bob.db.ijbc.chips import ChipStore, resize, convert
+    image = numpy.arange(12).reshape(3, 4)
+    assert numpy.array_equal(resize(image, (6, 2)), image[[0, 0, 1, 1, 2, 2]][:, [0, 2]])
+    assert convert(image, True).shape == (3, 3, 4)
+    assert convert(numpy.ones((3, 2, 2), numpy.uint8), False).shape == (2, 2)
+
+    with _SyntheticDatabase() as sdb:
+        original_directory = os.path.join(sdb.protocol.base_directory, "data")
+        files = sorted(sdb.objects(protocol="1:1"), key=lambda f: f.id)
+        images = _write_images(original_directory, files)
+        store = ChipStore(os.path.join(sdb.protocol.base_directory, "chips"), shape=(8, 6), margin=0.1)
+        assert not store.exists()
+        assert store.create(files + files[:3], original_directory, batch_size=5, parallel=2, load_function=_load_npy) == len(files)
+        assert store.exists() and len(store) == len(files)
+        assert numpy.load(store.path, mmap_mode="r").shape == (len(files), 3, 8, 6)
+        assert files[0] in store and files[0].id in store and "unknown" not in store
+
+        # random access and block-wise reading return the same chips
+        expected = numpy.array([resize(crop(images[f.path], (f.annotation.topleft[1], f.annotation.topleft[0], f.annotation.size[1], f.annotation.size[0]), 0.1), (8, 6)) for f in files])
+        assert numpy.array_equal(store.chips(files[::-1]), expected[::-1])
+        blocks = list(store.blocks(block_size=7))
+        assert [i for ids, _ in blocks for i in ids] == [f.id for f in files]
+        assert numpy.array_equal(numpy.concatenate([c for _, c in blocks]), expected)
+        nose.tools.assert_raises(KeyError, store.chips, ["unknown"])
+
+        # other crop parameters are stored separately
+        assert not ChipStore(store.directory, shape=(8, 6), color=False).exists()
+
+        # floating point images are rounded and clipped
+        float_store = ChipStore(os.path.join(sdb.protocol.base_directory, "float_chips"), shape=(8, 6))
+        float_store.create(files[:2], original_directory, load_function=lambda name: numpy.full((3, 100, 120), -10.) if os.path.splitext(name)[0].endswith("/" + files[0].path) else numpy.full((3, 100, 120), 254.6))
+        assert numpy.all(float_store.chips(files[:1]) == 0) and numpy.all(float_store.chips(files[1:2]) == 255)
+
+
+def test_template_features():
+    from bob.db.ijbc.features import segment_means
+    keys, means = segment_means(numpy.array([[1.], [3.], [5.], [6.]]), numpy.array([2, 2, 7, 9]))
+    assert numpy.array_equal(keys, [2, 7, 9]) and numpy.array_equal(means, [[2.], [5.], [6.]])
+
+    with _SyntheticDatabase() as sdb:
+        media = sdb.protocol.media_index()
+        metadata = sdb.protocol._read_metadata()
+        names = metadata.file_names(numpy.arange(len(metadata)))
+        # images are separate media, the frames of the same video share one
+        assert len(set(media[[names.index("img/%d%d.jpg" % (s, i)) for s in range(1, 7) for i in range(3)]])) == 18
+        assert len(set(media[[names.index("frames/1_%d.png" % f) for f in range(4)]])) == 1
+        assert media[names.index("frames/1_0.png")] != media[names.index("frames/2_0.png")]
+
+        files = sorted(sdb.objects(protocol="1:1"), key=lambda f: f.id)
+        features = numpy.random.rand(len(files), 5)
+        lookup = dict(zip((f.id for f in files), features))
+        template_ids, template_features = sdb.template_features(features, files, protocol="1:1", block_size=4)
+        templates = {t.id: t for t in sdb.templates(protocol="1:1")}
+        assert template_ids.tolist() == sorted(templates)
+        for template_id, template_feature in zip(template_ids.tolist(), template_features):
+            # the frames of each video are averaged first
+            by_media = {}
+            for f in templates[template_id].files:
+                by_media.setdefault(f.path.split("_")[0] if f.path.startswith("frames") else f.path, []).append(lookup[f.id])
+            expected = numpy.mean([numpy.mean(m, axis=0) for m in by_media.values()], axis=0)
+            assert numpy.allclose(template_feature, expected)
+
+        # normalization, purposes and missing files
+        ids, normalized = sdb.template_features(features, [f.id for f in files], protocol="1:1", purposes="enroll", normalize=True)
+        assert ids.tolist() == list(range(1, 7)) and numpy.allclose(numpy.linalg.norm(normalized, axis=1), 1)
+        nose.tools.assert_raises(ValueError, sdb.template_features, features[1:], files[1:], protocol="1:1")
+        ids, partial = sdb.template_features(features[1:], files[1:], protocol="1:1", skip_missing=True)
+        assert numpy.array_equal(ids, template_ids) and not numpy.any(numpy.isnan(partial))
+        ids, covariates = sdb.template_features(features[:2], files[:2], protocol="Covariates", skip_missing=True)
+        assert len(ids) == 18 and numpy.all(numpy.isnan(covariates[2:]))
+
+
+def test_scores():
+    with _SyntheticDatabase() as sdb:
+        for protocol in ("1:1", "Covariates"):
+            templates = {t.id: t for t in sdb.templates(protocol=protocol)}
+            template_ids = numpy.array(sorted(templates))
+            features = numpy.random.rand(len(template_ids), 4) - 0.5
+            lookup = dict(zip(template_ids.tolist(), features))
+            pairs = [(m, p) for models, probes in sdb.iter_pairs(protocol) for m, p in zip(models.tolist(), probes.tolist())]
+            cosine = numpy.array([numpy.dot(lookup[m], lookup[p]) / numpy.linalg.norm(lookup[m]) / numpy.linalg.norm(lookup[p]) for m, p in pairs])
+            euclidean = numpy.array([-numpy.linalg.norm(lookup[m] - lookup[p]) for m, p in pairs])
+
+            # dense and sparse blocks, sequential and parallel
+            for dense_ratio in (4, 0):
+                for block_size, parallel in ((1000, 1), (5, 1), (1, 2)):
+                    assert numpy.allclose(sdb.scores(template_ids, features, protocol, block_size=block_size, parallel=parallel, dense_ratio=dense_ratio), cosine, atol=1e-6)
+                    assert numpy.allclose(sdb.scores(template_ids, features, protocol, metric="euclidean", block_size=block_size, parallel=parallel, dense_ratio=dense_ratio), euclidean, atol=1e-6)
+
+            # score files
+            score_file = os.path.join(sdb.protocol.base_directory, "scores")
+            assert sdb.scores(template_ids, features, protocol, output=score_file, score_format="4column", block_size=7, parallel=2) == len(pairs)
+            with open(score_file) as f:
+                lines = [line.split() for line in f]
+            assert [(templates[m].client_id, templates[p].client_id, p) for m, p in pairs] == [(int(l[0]), int(l[1]), int(l[2])) for l in lines]
+            assert numpy.allclose([float(l[3]) for l in lines], cosine, atol=1e-6)
+            sdb.scores(template_ids, features, protocol, output=score_file, score_format="5column")
+            with open(score_file) as f:
+                assert [m for m, p in pairs] == [int(line.split()[1]) for line in f]
+            sdb.scores(template_ids, features, protocol, output=score_file + ".npy", score_format="binary", block_size=3)
+            assert numpy.allclose(numpy.load(score_file + ".npy"), cosine, atol=1e-6)
+
+        nose.tools.assert_raises(ValueError, sdb.scores, template_ids[1:], features[1:], "Covariates")
+        nose.tools.assert_raises(ValueError, sdb.scores, template_ids, features, "Covariates", metric="unknown")
+
+
+def test_evaluation():
+    from bob.db.ijbc.evaluation import tar_at_far, TopScores
+    top = TopScores(3)
+    for chunk in ([5., 1., 7.], [2., 9.], [8., 0., 3.]):
+        top.add(numpy.array(chunk))
+    assert top.total == 8 and top.sorted().tolist() == [9., 8., 7.]
+
+    # 10 impostors: at FAR 0.1, one impostor is accepted
+    impostors = numpy.arange(10.)[::-1]
+    thresholds, tars, fars = tar_at_far(numpy.array([3.5, 8.5, 9.5, 10.]), impostors, 10, (0., 0.1, 0.5))
+    assert thresholds.tolist() == [9., 8., 4.] and tars.tolist() == [0.5, 0.75, 0.75] and fars.tolist() == [0., 0.1, 0.5]
+    nose.tools.assert_raises(ValueError, tar_at_far, numpy.zeros(1), impostors[:3], 10, (0.5,))
+
+    with _SyntheticDatabase() as sdb:
+        for protocol in ("1:1", "Covariates"):
+            templates = {t.id: t for t in sdb.templates(protocol=protocol)}
+            pairs = [(m, p) for models, probes in sdb.iter_pairs(protocol) for m, p in zip(models.tolist(), probes.tolist())]
+            labels = sdb.labels(protocol)
+            assert labels.tolist() == [templates[m].client_id == templates[p].client_id for m, p in pairs]
+
+            # compare chunked evaluation with a direct computation
+            scores = numpy.random.rand(len(pairs)).astype(numpy.float32)
+            impostors = numpy.sort(scores[~labels].astype(numpy.float64))[::-1]
+            expected = tar_at_far(scores[labels], impostors, len(impostors), (0.01, 0.1, 0.3))
+            for chunk_size in (1, 5, 1000):
+                result = sdb.evaluate(scores, protocol, far_values=(0.01, 0.1, 0.3), chunk_size=chunk_size)
+                assert all(numpy.array_equal(r, e) for r, e in zip(result, expected))
+            nose.tools.assert_raises(ValueError, sdb.evaluate, scores[1:], protocol)
+
+
+def test_covariate_evaluation():
+    from bob.db.ijbc.evaluation import tar_at_far, bin_values
+    index, labels = bin_values(numpy.array([1., numpy.nan, 3., 1.]))
+    assert index.tolist() == [0, -1, 1, 0] and labels == [1., 3.]
+    index, labels = bin_values(numpy.array([-5., 0., 10., numpy.nan, 25.]), (0, 10, 20))
+    assert index.tolist() == [-1, 0, 1, -1, -1] and labels == [(0., 10.), (10., 20.)]
+
+    with _SyntheticDatabase() as sdb:
+        ids, covariates = sdb.protocol.template_covariates("Covariates", "probe")
+        templates = {t.id: t for t in sdb.templates(protocol="Covariates")}
+        assert numpy.array_equal(ids, sdb.protocol._read_match_file("Covariates").unique_probe_ids)
+        assert [templates[i].files[0].annotation.yaw for i in ids.tolist()] == covariates[:, 5].tolist()
+        assert [sum(templates[i].files[0].annotation.occlusion) for i in ids.tolist()] == covariates[:, 7].tolist()
+
+        pairs = [(m, p) for models, probes in sdb.iter_pairs("Covariates") for m, p in zip(models.tolist(), probes.tolist())]
+        labels = sdb.labels("Covariates")
+        scores = numpy.random.rand(len(pairs))
+        far_values = (0.1, 0.5)
+        bins = {"yaw": (-20, -7, 20)}
+        for chunk_size in (4, 1000):
+            results = sdb.evaluate_covariates(scores, covariates=("yaw", "skintone", "occlusion"), bins=bins, far_values=far_values, chunk_size=chunk_size)
+            assert sorted(results) == ["occlusion", "skintone", "yaw"]
+            assert sorted(results["yaw"]) == [(-20., -7.), (-7., 20.)]
+            assert sorted(results["skintone"]) == list(range(1, 7))
+            for covariate, selector in (("yaw", lambda a, label: label[0] <= a.yaw < label[1]), ("skintone", lambda a, label: a.skintone == label), ("occlusion", lambda a, label: label[0] <= sum(a.occlusion) < label[1])):
+                for label, result in results[covariate].items():
+                    selected = numpy.array([selector(templates[p].files[0].annotation, label) for m, p in pairs])
+                    impostors = numpy.sort(scores[selected & ~labels])[::-1]
+                    expected = tar_at_far(scores[selected & labels], impostors, len(impostors), far_values)
+                    assert all(numpy.array_equal(r, e) for r, e in zip(result, expected))
+
+        # the bins of the enrollment templates
+        results = sdb.evaluate_covariates(scores, covariates="gender", purpose="enroll")
+        assert sorted(results["gender"]) == [0., 1.]
+        nose.tools.assert_raises(ValueError, sdb.evaluate_covariates, scores, covariates="unknown")
+
+
+def test_identification_protocols():
+    from bob.db.ijbc.identification import cmc, fnir_at_fpir
+    with _SyntheticDatabase() as sdb:
+        assert len(sdb.protocol_names()) == 11
+        assert sdb.model_ids(protocol="1:N-G1-Image") == [1, 2, 3]
+        assert sdb.model_ids(protocol="1:N-G2-Video") == [4, 5, 6]
+        assert sdb.model_ids(protocol="1:N-Mixed") == list(range(1, 7))
+        assert sdb.client_ids(protocol="1:N-G2-Mixed") == [4, 5, 6]
+        assert sorted(t.id for t in sdb.object_sets(protocol="1:N-G1-Image")) == list(range(201, 207))
+        assert sorted(t.id for t in sdb.object_sets(protocol="1:N-Video", model_ids=[1, 2])) == list(range(301, 307))
+        assert len(sdb.objects(protocol="1:N-G1-Mixed", purposes="probe", model_ids=1)) == 31
+        assert len(sdb.objects(protocol="1:N-G1-Mixed", purposes="enroll", model_ids=1)) == 2
+
+        templates = {t.id: t for t in sdb.templates(protocol="1:N-Image")}
+        template_ids = numpy.array(sorted(templates))
+        features = numpy.random.rand(len(template_ids), 4) - 0.5
+        lookup = dict(zip(template_ids.tolist(), features / numpy.linalg.norm(features, axis=1)[:, None]))
+        for protocol, gallery in (("1:N-G1-Image", [1, 2, 3]), ("1:N-Image", list(range(1, 7)))):
+            for k, block_size in ((2, 1), (10, 4)):
+                probe_ids, top_ids, top_scores, mated_scores, mated_ranks = sdb.identify(template_ids, features, protocol, k=k, block_size=block_size)
+                assert probe_ids.tolist() == list(range(201, 207))
+                for i, probe_id in enumerate(probe_ids.tolist()):
+                    scores = sorted(((numpy.dot(lookup[probe_id], lookup[g]), g) for g in gallery), reverse=True)
+                    assert top_ids[i].tolist() == [g for _, g in scores[:k]]
+                    assert numpy.allclose(top_scores[i], [score for score, _ in scores[:k]])
+                    mates = [rank for rank, (_, g) in enumerate(scores) if templates[g].client_id == templates[probe_id].client_id]
+                    assert mated_ranks[i] == (mates[0] + 1 if mates else 0)
+                    assert numpy.isnan(mated_scores[i]) == (not mates)
+
+        # evaluation
+        assert numpy.array_equal(cmc([1, 3, 0, 2], (1, 2, 3)), [1. / 3, 2. / 3, 1.])
+        thresholds, fnirs, fpirs = fnir_at_fpir([0.9, 0.8, 0.3, 0.5, 0.6], [0.9, 0.5, numpy.nan, numpy.nan, numpy.nan], [1, 2, 0, 0, 0], (0., 1. / 3), rank=1)
+        assert thresholds.tolist() == [0.6, 0.5] and fpirs.tolist() == [0., 1. / 3] and fnirs.tolist() == [0.5, 0.5]
+        nose.tools.assert_raises(ValueError, sdb.identify, template_ids, features, "1:1")
+
+
+def test_combined_gallery():
+    with _SyntheticDatabase() as sdb:
+        protocol = sdb.protocol
+        for name in ("1:1", "1:N-Mixed", "1:N-Image"):
+            gallery = protocol.get_templates(name, "enroll")
+            # the combined gallery is built once, and it shares the templates of G1 and G2
+            assert protocol.get_templates(name, "enroll") is gallery
+            assert protocol.model_ids(name) is protocol.model_ids(name)
+            assert sorted(gallery) == list(range(1, 7)) and len(gallery) == 6
+            assert gallery[1] is protocol.get_templates("1:N-G1-Mixed", "enroll")[1]
+            assert gallery[6] is protocol.get_templates("1:N-G2-Mixed", "enroll")[6]
+            assert protocol.enroll_template(name, 5) is gallery[5]
+            assert 7 not in gallery
+            nose.tools.assert_raises(KeyError, lambda: gallery[7])
+            expected = numpy.union1d(protocol.get_templates("1:N-G1-Image", "enroll").rows([1]), protocol.get_templates("1:N-G2-Image", "enroll").rows([4]))
+            assert numpy.array_equal(gallery.rows([4, 1]), expected)
+
+
+def test_frame_subsampling():
+    with _SyntheticDatabase() as sdb:
+        protocol = sdb.protocol
+        index = protocol.frame_index("1:N-Mixed", "probe")
+        assert numpy.array_equal(index.template_ids, list(range(101, 108)))
+        # each mixed probe contains an image and a video, the last one only an image
+        assert numpy.array_equal(numpy.diff(index.media_offsets), [2] * 6 + [1])
+        metadata = protocol._read_metadata()
+        video = index.rows[index.row_offsets[1]:index.row_offsets[2]]
+        assert numpy.array_equal(metadata.frame[video], [0, 1, 2, 3])
+
+        def _frames(templates):
+            return {t.id: sorted(f.path for f in t.files) for t in templates}
+
+        full = _frames(sdb.object_sets(protocol="1:N-Video"))
+        assert full[301] == ["frames/1_0", "frames/1_1", "frames/1_2", "frames/1_3"]
+        assert _frames(sdb.object_sets(protocol="1:N-Video", frame_stride=1)) == full
+        assert _frames(sdb.object_sets(protocol="1:N-Video", frame_stride=2))[302] == ["frames/2_0", "frames/2_2"]
+        assert _frames(sdb.object_sets(protocol="1:N-Video", max_frames=2))[303] == ["frames/3_0", "frames/3_2"]
+        assert _frames(sdb.object_sets(protocol="1:N-Video", max_frames=3))[303] == ["frames/3_0", "frames/3_1", "frames/3_2"]
+        assert _frames(sdb.object_sets(protocol="1:N-Video", frame_stride=3, max_frames=1))[304] == ["frames/4_0"]
+        # the frames with the smallest absolute yaw (-10 + 5 * frame) and roll are preferred
+        assert _frames(sdb.object_sets(protocol="1:N-Video", max_frames=1, frame_selection="quality"))[305] == ["frames/5_2"]
+        assert _frames(sdb.object_sets(protocol="1:N-Video", max_frames=2, frame_selection="quality"))[306] == ["frames/6_1", "frames/6_2"]
+
+        # still images are always kept
+        mixed = _frames(sdb.object_sets(protocol="1:1", model_ids=[1], max_frames=1, frame_selection="quality"))
+        assert mixed[101] == ["frames/1_2", "img/12"] and mixed[107] == ["img/10"]
+        files = sdb.objects(protocol="1:N-Mixed", max_frames=2)
+        assert files < sdb.objects(protocol="1:N-Mixed") and len(sdb.objects(protocol="1:N-Mixed")) - len(files) == 12
+        assert sdb.objects(protocol="Covariates", frame_stride=2) == sdb.objects(protocol="Covariates")
+        nose.tools.assert_raises(ValueError, sdb.objects, protocol="1:1", frame_stride=0)
+        nose.tools.assert_raises(ValueError, sdb.objects, protocol="1:1", max_frames=2, frame_selection="best")
+
+
+def test_unique_paths():
+    with _SyntheticDatabase() as sdb:
+        files = sdb.objects()
+        index = sdb.unique_paths()
+        # each physical file is listed once, with all files that share it
+        assert list(index) == sorted(set(f.path + f.extension for f in files))
+        assert len(index) == len(files) - 1
+        assert index["img/10.jpg"] == ["img/10-1", "img/10-2"]
+        assert "nonfaces/1.jpg" not in index
+        assert sorted(i for path in index for i in index[path]) == sorted(f.id for f in files)
+        files = sorted(files)
+        positions = index.positions(files)
+        assert [index.paths[p] for p in positions] == [f.path + f.extension for f in files]
+        assert all(f in index.files(p) for f, p in zip(files, positions))
+        assert numpy.array_equal(index.positions([f.id for f in files]), positions)
+
+        # only the files of the given protocols and purposes
+        covariates = sdb.unique_paths(protocol="Covariates", purposes="enroll")
+        assert list(covariates) == ["img/%d0.jpg" % s for s in range(1, 7)]
+        assert sdb.unique_paths(protocol=["1:1", "Covariates"]).paths.tolist() == index.paths.tolist()
+        nose.tools.assert_raises(ValueError, covariates.positions, ["frames/1_0-1"])
+
+
+def test_manifest():
+    from bob.db.ijbc.manifest import Manifest
+    with _SyntheticDatabase() as sdb:
+        directory = os.path.join(sdb.protocol.base_directory, "manifest")
+        manifest = sdb.manifest(directory)
+        files = sdb.remaining_files(manifest, protocol="1:1")
+        assert files == sorted(sdb.objects(protocol="1:1"), key=lambda f: f.id)
+        assert not numpy.any(manifest.completed())
+
+        # two workers log their progress concurrently
+        first, second = manifest.writer("first"), manifest.writer("second")
+        assert first.add(files[:5]) == 5
+        second.add([f.id for f in files[5:8]])
+        first.add(files[8:9])
+        assert sdb.remaining_files(sdb.manifest(directory), protocol="1:1") == files[9:]
+        assert numpy.array_equal(manifest.is_completed(files[7:11]), [True, True, False, False])
+        # the files are shared with other protocols
+        covariates = sdb.objects(protocol="Covariates")
+        assert set(sdb.remaining_files(manifest, protocol="Covariates")) == covariates - set(files[:9])
+
+        # a partially written record of a killed worker is ignored
+        with open(os.path.join(directory, "log-second.bin"), "ab") as f:
+            f.write(b"\x01\x00")
+        assert sdb.remaining_files(manifest, protocol="1:1") == files[9:]
+        # ... and removed when the worker is restarted, so that its next records are not shifted
+        manifest.writer("second").add(files[9:10])
+        assert os.path.getsize(os.path.join(directory, "log-second.bin")) == 4 * 4
+        assert sdb.remaining_files(manifest, protocol="1:1") == files[10:]
+        assert numpy.count_nonzero(manifest.completed()) == 10
+
+        # compacting merges the logs into the bitmap
+        assert manifest.compact() == 10
+        assert not [name for name in os.listdir(directory) if name.startswith("log-")]
+        manifest.add(files[10:])
+        assert sdb.remaining_files(sdb.manifest(directory), protocol="1:1") == []
+        assert sdb.manifest(directory).compact() == len(files)
+
+        # the manifest belongs to the metadata that it was created with
+        metadata = sdb.protocol._read_metadata()
+        other = bob.db.ijbc.reader.Metadata.__new__(bob.db.ijbc.reader.Metadata)
+        other.keys = metadata.keys[:-1]
+        nose.tools.assert_raises(ValueError, Manifest, directory, other)
+
+
+def test_detection():
+    from bob.db.ijbc.detection import iou, match
+    with _SyntheticDatabase() as sdb:
+        assert sdb.detection_protocol_names() == ["detection", "wild10", "wild11", "wild9"]
+        ground_truth = sdb.detection_ground_truth()
+        # images without faces are part of the protocol, but have no bounding box
+        assert len(ground_truth) == 19 and len(ground_truth.boxes) == 36
+        assert "nonfaces/1.jpg" in ground_truth and len(ground_truth["nonfaces/1.jpg"]) == 0
+        assert numpy.array_equal(ground_truth["img/12.jpg"], [[20, 40, 50, 60], [100, 100, 40, 40]])
+        assert sorted(sdb.detection_ground_truth("wild9")) == ["img/%d%d.jpg" % (s, i) for s in (3, 6) for i in range(3)]
+        nose.tools.assert_raises(ValueError, sdb.detection_ground_truth, "wild12")
+
+        # the vectorized matching is identical to matching each image in a loop
+        random.seed(7)
+        images, boxes, scores = [], [], []
+        for image in ground_truth:
+            for box in list(ground_truth[image]) + [[random.uniform(0, 150), random.uniform(0, 150), 50, 50] for _ in range(random.randint(0, 4))]:
+                for _ in range(random.randint(0, 2)):
+                    images.append(image)
+                    boxes.append(numpy.asarray(box) + [random.uniform(-15, 15), random.uniform(-15, 15), 0, 0])
+                    scores.append(random.random())
+        images, boxes, scores = numpy.array(images), numpy.array(boxes), numpy.array(scores)
+        true_positives = numpy.zeros(len(scores), bool)
+        for image in set(images):
+            assigned = set()
+            for index in sorted(numpy.flatnonzero(images == image), key=lambda i: -scores[i]):
+                truth = ground_truth[image]
+                if not len(truth):
+                    continue
+                overlaps = iou(numpy.repeat(boxes[index:index + 1], len(truth), axis=0), truth)
+                if overlaps.max() >= 0.5 and overlaps.argmax() not in assigned:
+                    assigned.add(overlaps.argmax())
+                    true_positives[index] = True
+
+        thresholds, precision, recall, false_positives = sdb.evaluate_detections(images, boxes, scores)
+        ranking = numpy.argsort(-scores)
+        assert numpy.array_equal(thresholds, scores[ranking])
+        assert numpy.array_equal(false_positives, numpy.cumsum(~true_positives[ranking]))
+        assert numpy.allclose(recall, numpy.cumsum(true_positives[ranking]) / 36.)
+        assert numpy.allclose(precision, numpy.cumsum(true_positives[ranking]) / numpy.arange(1., len(scores) + 1))
+
+        # perfect detections, and a duplicate detection, which is a false positive
+        perfect = numpy.repeat(numpy.arange(len(ground_truth)), numpy.diff(ground_truth.offsets))
+        offsets = ground_truth.offsets.copy()
+        offsets[-2:] += 1
+        detected, _ = match(ground_truth.offsets, ground_truth.boxes, offsets, numpy.vstack((ground_truth.boxes, ground_truth.boxes[-1:])), numpy.append(numpy.ones(36), 0.5))
+        assert numpy.all(detected[:36]) and not detected[36]
+        _, _, recall, false_positives = sdb.evaluate_detections(ground_truth.images[perfect], ground_truth.boxes, numpy.ones(36), "detection")
+        assert recall[-1] == 1 and false_positives[-1] == 0
+        nose.tools.assert_raises(ValueError, sdb.evaluate_detections, ["img/99.jpg"], [[0, 0, 1, 1]], [1.])
+
+
+def test_synthetic_generator():
+    from bob.db.ijbc.synthetic import write_protocol
+    directory = tempfile.mkdtemp(prefix="bob.db.ijbc_")
+    try:
+        counts = write_protocol(directory, scale=0.003, seed=3)
+        sdb = bob.db.ijbc.Database(protocol_directory=directory)
+        assert counts["subjects"] == 11
+        assert len(sdb.protocol_names()) == 11 and all(len(sdb.client_ids(protocol=p)) for p in sdb.protocol_names())
+        assert len(sdb.client_ids(protocol="1:1")) == 11 and len(sdb.model_ids(protocol="1:N-G1-Mixed")) == 5
+        assert len(sdb.protocol._read_metadata()) == counts["files"]
+        assert len(sdb.object_sets(protocol="1:1")) == counts["probe_templates"]
+        assert sum(len(m) for m, _ in sdb.iter_pairs("1:1")) == counts["comparisons_1_1"]
+        assert sum(len(m) for m, _ in sdb.iter_pairs("Covariates")) == counts["comparisons_covariates"]
+        assert len(sdb.objects(protocol="Covariates")) == counts["covariate_templates"]
+        # the compiled protocol cache contains all protocol files
+        assert len(sdb.protocol.compile()) == 14
+        # the files are deterministic
+        with open(os.path.join(directory, "ijbc_metadata.csv")) as f:
+            metadata = f.read()
+        write_protocol(directory, scale=0.003, seed=3)
+        with open(os.path.join(directory, "ijbc_metadata.csv")) as f:
+            assert f.read() == metadata
+    finally:
+        shutil.rmtree(directory)
+
+
 def notest_driver_api():
     # Tests the bob_dbmanage.py driver interface
     from bob.db.base.script.dbmanage import main